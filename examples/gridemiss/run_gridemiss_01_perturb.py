@@ -69,12 +69,17 @@ print('INFO:: to scale', scalekeys)
 # %%
 # Apply Scaling
 # -------------
+# - keep layer-summed time-mean old and new values for QA, so the files do not
+#   need to be read again for plotting
 
+qa = {}
 for skey in scalekeys:
     print('INFO:: scaling', skey, 'by', factor)
     outvar = outfile.variables[skey]
-    invar = infile[skey]
-    outvar[:] = factor * invar[:]
+    invals = infile[skey][:]
+    outvals = factor * invals
+    outvar[:] = outvals
+    qa[skey] = invals.sum(1).mean(0), outvals.sum(1).mean(0)
 
 outfile.sync()
 del outfile
@@ -88,12 +93,12 @@ import pyrsig
 import pycno
 import matplotlib.colors as mc
 
+# open_ioapi only reads metadata here; values come from qa
 oldfile = pyrsig.open_ioapi(oldpath)
-newfile = pyrsig.open_ioapi(newpath)
 key = scalekeys[0]
-compfile = newfile[[]]
-compfile['New'] = newfile[key].sum('LAY').mean('TSTEP')
-compfile['Old'] = oldfile[key].sum('LAY').mean('TSTEP')
+compfile = oldfile[[]]
+compfile['New'] = ('ROW', 'COL'), qa[key][1]
+compfile['Old'] = ('ROW', 'COL'), qa[key][0]
 Z = compfile.to_dataarray(dim='version')
 Z.attrs.update(oldfile[key].attrs)
 fca = Z.plot(col='version', norm=mc.LogNorm(10, compfile['Old'].max()))
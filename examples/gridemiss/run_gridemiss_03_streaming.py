@@ -0,0 +1,279 @@
+"""
+Streaming Gridded Emission Scaling
+==================================
+
+Apply a constant factor to a subset of emission variables one time step at a
+time. The whole-domain example (`run_gridemiss_01_perturb.py`) uses
+`outvar[:] = factor * invar[:]`, which reads the whole TSTEP x LAY x ROW x COL
+array and promotes it to float64 before writing. For annual or fine
+resolution files, that can exceed the memory on a node. This example reads,
+scales, and writes one slab (e.g., one TSTEP) at a time, so peak memory is
+one slab regardless of the file size.
+
+The basic steps are:
+
+1. Copy a file.
+2. Select species to scale.
+3. Scale each slab in place, keeping the file's dtype.
+4. Save QA summaries accumulated while scaling.
+5. Benchmark against the whole-array approach.
+6. Plot the old and new result from the summaries.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# date to process
+date = '20160610'
+# file to copy
+oldpath = f'../../camx/emiss/camx_area.mobile.{date}.36km.nc'
+# new file to create
+newpath = f'outputs/camx_area_2x_streaming.mobile.{date}.36km.nc'
+# QA summary file (small) created while scaling
+summarypath = f'outputs/camx_area_2x_streaming.mobile.{date}.36km_summary.nc'
+# species to scale
+scalekeys = ['NO', 'NO2', 'HONO']  # list of strings or set to 'all'
+# factor to scale by
+factor = 2.
+# dimension to stream over (TSTEP or LAY)
+slabdim = 'TSTEP'
+# path for figure comparing
+figpath = 'outputs/scaled_gridemiss_streaming.png'
+
+# %%
+# Imports and File Prep
+# '''''''''''''''''''''
+
+import netCDF4
+import numpy as np
+import shutil
+import time
+import tracemalloc
+import os
+
+os.makedirs('outputs', exist_ok=True)
+shutil.copyfile(oldpath, newpath)
+
+# %%
+# Define a Streaming Scaler
+# '''''''''''''''''''''''''
+# - iterate over one dimension (e.g., TSTEP)
+# - read one slab, multiply in the variable's dtype, and write it back
+# - factor can be a scalar or any array that broadcasts to the slab
+#   (e.g., a ROW x COL field as in `run_gridemiss_02_perturbbox.py`)
+# - QA summaries are accumulated while scaling, so plots and checks do not
+#   need to read the full files again
+
+
+def iterslabs(var, dim='TSTEP'):
+    """
+    Yield index tuples that select one element of dim at a time.
+    Other dimensions are selected completely.
+    """
+    axis = var.dimensions.index(dim)
+    for i in range(var.shape[axis]):
+        idx = [slice(None)] * var.ndim
+        idx[axis] = i
+        yield tuple(idx)
+
+
+def scale_streaming(infile, outfile, keys, factor, dim='TSTEP', summarize=True):
+    """
+    Arguments
+    ---------
+    infile : netCDF4.Dataset
+        Source of original values.
+    outfile : netCDF4.Dataset
+        Destination opened in append mode (may be the same as infile).
+    keys : list
+        Variables to scale.
+    factor : scalar or array
+        Multiplicative factor; must broadcast to one slab.
+    dim : str
+        Dimension to stream over (TSTEP or LAY).
+    summarize : bool
+        If True, accumulate QA summaries while scaling.
+
+    Returns
+    -------
+    summary : dict
+        For each key (if summarize), a dictionary with old and new layer-sum
+        TSTEP-mean (ROW, COL) arrays, old and new domain totals, and the
+        maximum absolute change in any element.
+    """
+    summary = {}
+    for key in keys:
+        invar = infile.variables[key]
+        outvar = outfile.variables[key]
+        # cast the factor once so the multiply stays in the file dtype
+        vfactor = np.asarray(factor, dtype=invar.dtype)
+        if dim not in invar.dimensions:
+            # e.g., time-independent variables have no TSTEP
+            slabs = [(slice(None),) * invar.ndim]
+            slabdims = invar.dimensions
+        else:
+            slabs = iterslabs(invar, dim=dim)
+            slabdims = tuple(dk for dk in invar.dimensions if dk != dim)
+        # sum over everything but ROW and COL (e.g., LAY and TSTEP)
+        sumaxes = tuple(i for i, dk in enumerate(slabdims) if dk not in ('ROW', 'COL'))
+        oldsum = newsum = 0.
+        maxchange = 0.
+        for idx in slabs:
+            vals = invar[idx]
+            if summarize:
+                oldsum = oldsum + vals.sum(axis=sumaxes, dtype='d')
+                oldvals = vals.copy()
+            vals *= vfactor
+            if summarize:
+                newsum = newsum + vals.sum(axis=sumaxes, dtype='d')
+                maxchange = max(maxchange, float(np.abs(vals - oldvals).max()))
+            outvar[idx] = vals
+        if summarize:
+            nt = len(infile.dimensions['TSTEP']) if 'TSTEP' in invar.dimensions else 1
+            summary[key] = dict(
+                old=oldsum / nt, new=newsum / nt,
+                total_old=float(np.sum(oldsum)), total_new=float(np.sum(newsum)),
+                max_abs_change=maxchange, units=getattr(invar, 'units', '').strip()
+            )
+    return summary
+
+
+# The summary has no TSTEP or LAY and no TFLAG, so time, layer, and variable
+# list attributes are not copied (IOAPI readers would expect them to match).
+skipattrs = ['NVARS', 'VAR-LIST', 'TSTEP', 'SDATE', 'STIME', 'NLAYS', 'VGTYP', 'VGTOP', 'VGLVLS']
+
+
+def save_summary(summary, infile, path):
+    """
+    Save summaries as a small file with {key}_old and {key}_new (ROW, COL)
+    variables and the input grid attributes. Totals and maximum change are
+    variable attributes.
+    """
+    with netCDF4.Dataset(path, mode='w', format='NETCDF4_CLASSIC') as sumf:
+        sumf.setncatts({
+            pk: infile.getncattr(pk) for pk in infile.ncattrs()
+            if pk not in skipattrs
+        })
+        sumf.createDimension('ROW', len(infile.dimensions['ROW']))
+        sumf.createDimension('COL', len(infile.dimensions['COL']))
+        sumf.FILEDESC = 'Layer-sum TSTEP-mean emissions before and after scaling'
+        for key, ksum in summary.items():
+            for sfx in ['old', 'new']:
+                var = sumf.createVariable(f'{key}_{sfx}', 'f', ('ROW', 'COL'))
+                var.units = ksum['units']
+                var.long_name = f'{key}_{sfx}'
+                var.total = ksum[f'total_{sfx}']
+                var.max_abs_change = ksum['max_abs_change']
+                var[:] = ksum[sfx]
+
+
+# %%
+# Open Files and Select Emission Variables
+# ''''''''''''''''''''''''''''''''''''''''
+# - Open the existing file in read-only mode
+# - Open the new file in editable append mode
+# - if scalekeys is all, identify all emission variables by unit
+
+infile = netCDF4.Dataset(oldpath, mode='r')
+outfile = netCDF4.Dataset(newpath, mode='a')
+
+if scalekeys == 'all':
+    scalekeys = [
+        k for k, v in outfile.variables.items()
+        if v.units.strip() in ('mol hr-1', 'g hr-1')
+    ]
+
+print('INFO:: to scale', scalekeys)
+
+# %%
+# Apply Scaling
+# '''''''''''''
+
+summary = scale_streaming(infile, outfile, scalekeys, factor, dim=slabdim)
+outfile.sync()
+save_summary(summary, infile, summarypath)
+for key, ksum in summary.items():
+    print(
+        f'INFO:: {key} total {ksum["total_old"]:.4e} -> {ksum["total_new"]:.4e}'
+        f' {ksum["units"]}; max change {ksum["max_abs_change"]:.4e}'
+    )
+
+# %%
+# Benchmark
+# '''''''''
+# - Compare the whole-array approach (`outvar[:] = factor * invar[:]`)
+# - to the streaming approach.
+# - Time is the best of 3 repeats.
+# - Peak memory is tracked separately by tracemalloc (numpy reports its
+#   allocations), because tracing slows down the python loop.
+# - For small files (like the tutorial), the whole-array approach is faster
+#   because it makes fewer calls. Streaming keeps peak memory at one slab,
+#   which is what matters when the whole array does not fit in memory.
+
+
+def whole_array(infile, outfile, keys, factor):
+    for key in keys:
+        outfile.variables[key][:] = factor * infile.variables[key][:]
+
+
+nbytes = sum(
+    infile.variables[k].size * infile.variables[k].dtype.itemsize
+    for k in scalekeys
+)
+for label, func, args in [
+    ('whole', whole_array, (infile, outfile, scalekeys, factor)),
+    ('streaming', scale_streaming, (infile, outfile, scalekeys, factor, slabdim, False)),
+]:
+    elapsed = []
+    for i in range(3):
+        t0 = time.perf_counter()
+        func(*args)
+        outfile.sync()
+        elapsed.append(time.perf_counter() - t0)
+    elapsed = min(elapsed)
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f'INFO:: {label:9s} {elapsed:7.3f}s {nbytes / elapsed / 1e6:8.1f}MB/s'
+        f' peak={peak / 1e6:8.1f}MB (data={nbytes / 1e6:.1f}MB)'
+    )
+
+# Confirm that both approaches produced the same answer
+for key in scalekeys:
+    expected = (factor * infile.variables[key][:]).astype(infile.variables[key].dtype)
+    assert np.allclose(outfile.variables[key][:], expected)
+    assert outfile.variables[key].dtype == infile.variables[key].dtype
+
+infile.close()
+outfile.close()
+
+# %%
+# Plot Comparison
+# '''''''''''''''
+# - uses only the summary file
+
+import pyrsig
+import pycno
+import matplotlib.colors as mc
+
+sumfile = pyrsig.open_ioapi(summarypath)
+key = scalekeys[0]
+compfile = sumfile[[]]
+compfile['New'] = sumfile[f'{key}_new']
+compfile['Old'] = sumfile[f'{key}_old']
+Z = compfile.to_dataarray(dim='version')
+Z.attrs.update(sumfile[f'{key}_old'].attrs)
+fca = Z.plot(col='version', norm=mc.LogNorm(10, compfile['Old'].max()))
+pycno.cno(sumfile.crs_proj4).drawstates(ax=fca.axs)
+fca.fig.savefig(figpath)
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Change slabdim to LAY. When is that faster?
+# 2. Use a ROW x COL factor from `run_gridemiss_02_perturbbox.py`.
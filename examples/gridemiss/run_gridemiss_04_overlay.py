@@ -0,0 +1,234 @@
+"""
+Overlay Gridded Emission Scenarios
+==================================
+
+Store only the edited species for each scenario and merge on demand.
+
+The scaling examples start by copying the whole file and then rewriting a few
+variables (e.g., NO, NO2, HONO). With many scenarios, most of the disk and
+time goes to copying unchanged species. An "overlay" file holds the header
+metadata (dimensions, global attributes, TFLAG/ETFLAG) and only the modified
+variables, so scenario creation scales with the number of edited species. A
+CAMx-ready file is created only when needed by hardlinking the base (nothing
+edited) or by a variable-level concatenation of the base and the overlay.
+
+The basic steps are:
+
+1. Write an overlay with only the scaled species.
+2. Merge the overlay with its base into a CAMx-ready file.
+3. Confirm the merged file matches the base except for the scaled species.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# date to process
+date = '20160610'
+# file to use as the base
+oldpath = f'../../camx/emiss/camx_area.mobile.{date}.36km.nc'
+# overlay with only the edited species
+overlaypath = f'outputs/camx_area_2x_overlay.mobile.{date}.36km.nc'
+# CAMx-ready file created on demand
+newpath = f'outputs/camx_area_2x_merged.mobile.{date}.36km.nc'
+# species to scale
+scalekeys = ['NO', 'NO2', 'HONO']  # list of strings or set to 'all'
+# factor to scale by
+factor = 2.
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import netCDF4
+import numpy as np
+import shutil
+import time
+import os
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Define Overlay Tools
+# ''''''''''''''''''''
+# - header variables (TFLAG, ETFLAG) are always copied
+# - the overlay records the base path in a global attribute
+# - variables are copied one TSTEP at a time to keep memory bounded
+
+headerkeys = ['TFLAG', 'ETFLAG']
+
+
+def copy_header(infile, outfile, exclude=()):
+    """Copy dimensions and global attributes from infile to outfile"""
+    for dk, dim in infile.dimensions.items():
+        outfile.createDimension(dk, None if dim.isunlimited() else len(dim))
+    outfile.setncatts({
+        pk: infile.getncattr(pk) for pk in infile.ncattrs() if pk not in exclude
+    })
+
+
+def copy_variable(infile, outfile, key, factor=None):
+    """
+    Define key in outfile like infile and copy values one TSTEP at a time.
+    If factor is not None, values are multiplied by factor in the variable's
+    dtype. Compression and chunking are kept when both files are NETCDF4.
+    """
+    invar = infile.variables[key]
+    attrs = {pk: invar.getncattr(pk) for pk in invar.ncattrs()}
+    fill_value = attrs.pop('_FillValue', None)
+    opts = {}
+    filters = invar.filters()
+    if filters is not None and outfile.data_model.startswith('NETCDF4'):
+        opts = {fk: filters[fk] for fk in ['zlib', 'complevel', 'shuffle', 'fletcher32']}
+        chunking = invar.chunking()
+        if chunking == 'contiguous':
+            opts['contiguous'] = True
+        else:
+            opts['chunksizes'] = chunking
+    outvar = outfile.createVariable(
+        key, invar.dtype, invar.dimensions, fill_value=fill_value, **opts
+    )
+    outvar.setncatts(attrs)
+    if invar.ndim == 0 or invar.dimensions[0] != 'TSTEP':
+        slabs = [slice(None)]
+    else:
+        slabs = range(invar.shape[0])
+    for idx in slabs:
+        vals = invar[idx]
+        if factor is not None:
+            vals *= np.asarray(factor, dtype=invar.dtype)
+        outvar[idx] = vals
+    return outvar
+
+
+def write_overlay(basepath, overlaypath, keys, factor):
+    """
+    Write only keys (scaled by factor) and header metadata to overlaypath.
+
+    Arguments
+    ---------
+    basepath : str
+        Existing CAMx-ready emission file.
+    overlaypath : str
+        Path for the overlay file.
+    keys : list
+        Variables to scale and store.
+    factor : scalar or array
+        Multiplicative factor; must broadcast to one TSTEP.
+
+    Returns
+    -------
+    None
+    """
+    with netCDF4.Dataset(basepath, mode='r') as infile:
+        with netCDF4.Dataset(overlaypath, mode='w', format=infile.data_model) as outfile:
+            copy_header(infile, outfile)
+            outfile.OVERLAY_BASE = os.path.abspath(basepath)
+            outfile.OVERLAY_KEYS = ' '.join(keys)
+            for key in headerkeys:
+                if key in infile.variables:
+                    copy_variable(infile, outfile, key)
+            for key in keys:
+                copy_variable(infile, outfile, key, factor=factor)
+
+
+def merge_overlay(overlaypath, mergedpath):
+    """
+    Create a CAMx-ready file from an overlay and its base.
+
+    If the overlay has no edited variables, mergedpath is a hardlink to the
+    base. A hardlink is the same file, so do not edit it in place (that would
+    also edit the base); write a new overlay instead. Otherwise, mergedpath
+    has every base variable in base order (with the base compression and
+    chunking) and edited variables taken from the overlay.
+
+    Arguments
+    ---------
+    overlaypath : str
+        Path written by write_overlay.
+    mergedpath : str
+        Path for the CAMx-ready file.
+
+    Returns
+    -------
+    None
+    """
+    if os.path.exists(mergedpath):
+        os.remove(mergedpath)
+    with netCDF4.Dataset(overlaypath, mode='r') as ovfile:
+        basepath = ovfile.OVERLAY_BASE
+        editkeys = ovfile.OVERLAY_KEYS.split()
+        if len(editkeys) == 0:
+            try:
+                os.link(basepath, mergedpath)
+            except OSError:
+                # e.g., different file systems; fall back to a full copy
+                shutil.copyfile(basepath, mergedpath)
+            return
+        with netCDF4.Dataset(basepath, mode='r') as basefile:
+            fmt = basefile.data_model
+            with netCDF4.Dataset(mergedpath, mode='w', format=fmt) as outfile:
+                copy_header(basefile, outfile)
+                for key in basefile.variables:
+                    srcfile = ovfile if key in editkeys else basefile
+                    copy_variable(srcfile, outfile, key)
+
+
+# %%
+# Select Emission Variables to Scale
+# ''''''''''''''''''''''''''''''''''
+# - if scalekeys is all, identify all emission variables by unit
+
+if scalekeys == 'all':
+    with netCDF4.Dataset(oldpath, mode='r') as infile:
+        scalekeys = [
+            k for k, v in infile.variables.items()
+            if getattr(v, 'units', '').strip() in ('mol hr-1', 'g hr-1')
+        ]
+
+print('INFO:: to scale', scalekeys)
+
+# %%
+# Create the Scenario as an Overlay
+# '''''''''''''''''''''''''''''''''
+
+t0 = time.perf_counter()
+write_overlay(oldpath, overlaypath, scalekeys, factor)
+t1 = time.perf_counter()
+oldsize = os.path.getsize(oldpath)
+ovsize = os.path.getsize(overlaypath)
+print(f'INFO:: overlay {t1 - t0:.3f}s {ovsize / 1e6:.1f}MB ({ovsize / oldsize:.1%} of base)')
+
+# %%
+# Merge on Demand
+# '''''''''''''''
+# - Only needed before running CAMx.
+
+t0 = time.perf_counter()
+merge_overlay(overlaypath, newpath)
+t1 = time.perf_counter()
+print(f'INFO:: merged {t1 - t0:.3f}s {os.path.getsize(newpath) / 1e6:.1f}MB')
+
+# %%
+# Check the Merged Result
+# '''''''''''''''''''''''
+
+with netCDF4.Dataset(oldpath) as oldfile, netCDF4.Dataset(newpath) as newfile:
+    assert list(oldfile.variables) == list(newfile.variables)
+    for key in oldfile.variables:
+        oldvals = oldfile.variables[key][:]
+        newvals = newfile.variables[key][:]
+        if key in scalekeys:
+            oldvals = oldvals * np.asarray(factor, dtype=oldvals.dtype)
+        assert np.array_equal(oldvals, newvals), key
+        assert oldfile.variables[key].filters() == newfile.variables[key].filters(), key
+        assert oldfile.variables[key].chunking() == newfile.variables[key].chunking(), key
+    print('INFO:: merged file matches base except scaled species')
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Make overlays for factors 0.5, 0.75, 1.25 and compare their total size to full copies.
+# 2. Write an overlay with no species and check that merge_overlay makes a hardlink.
@@ -0,0 +1,187 @@
+"""
+Batch Gridded Emission Scaling
+==============================
+
+Scale every daily sector file for a range of dates and a list of grids.
+
+The other gridded examples process one hard-coded date and one grid. For a
+full season, this example builds the list of all date x grid x sector files,
+fans the work out over a pool of processes, and reports how long each file
+took. Each output is written to a temporary name and renamed when complete,
+so an interrupted batch can be restarted and only unfinished files are redone.
+Each output records its settings (factor and keys), so changing them redoes
+every file.
+
+The basic steps are:
+
+1. Define the date range, grids, and sectors.
+2. Define the scaling for one file.
+3. Run all files in a process pool.
+4. Save per-file timings.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# first and last date to process
+bdate = '20160610'
+edate = '20160611'
+# grids and sectors to process
+grids = ['36km', '12km']
+sectors = ['mobile']
+# input and output templates
+intmpl = '../../camx/emiss/camx_area.{sector}.{date}.{grid}.nc'
+outtmpl = 'outputs/camx_area_2x_batch.{sector}.{date}.{grid}.nc'
+# species to scale
+scalekeys = ['NO', 'NO2', 'HONO']  # list of strings or set to 'all'
+# factor to scale by
+factor = 2.
+# number of processes (None uses all cpus)
+nworkers = 4
+# per-file timing report
+timingpath = 'outputs/batch_gridemiss_timings.csv'
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import netCDF4
+import numpy as np
+import pandas as pd
+import shutil
+import time
+import os
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Define the Work for One File
+# ''''''''''''''''''''''''''''
+# - Skip outputs that are complete (newer than their input and made with the
+#   same factor and keys, stored in the BATCH_SETTINGS global attribute).
+# - Copy to a temporary file, scale one TSTEP at a time, then rename.
+# - A crash leaves only a temporary file, which is replaced on restart.
+
+
+def scale_file(inpath, outpath, keys, factor):
+    """
+    Arguments
+    ---------
+    inpath : str
+        Existing emission file.
+    outpath : str
+        Scaled emission file to create.
+    keys : list or str
+        Variables to scale or 'all' for all variables with emission units.
+    factor : scalar or array
+        Multiplicative factor; must broadcast to one TSTEP.
+
+    Returns
+    -------
+    out : dict
+        inpath, outpath, status (done, skipped, missing, or failed), seconds,
+        and error (failed only)
+    """
+    t0 = time.perf_counter()
+    out = dict(inpath=inpath, outpath=outpath)
+    if not os.path.exists(inpath):
+        return dict(out, status='missing', seconds=0.)
+    settings = json.dumps(dict(factor=np.asarray(factor).tolist(), keys=keys))
+    if (
+        os.path.exists(outpath)
+        and os.path.getmtime(outpath) >= os.path.getmtime(inpath)
+    ):
+        with netCDF4.Dataset(outpath, mode='r') as donefile:
+            if getattr(donefile, 'BATCH_SETTINGS', None) == settings:
+                return dict(out, status='skipped', seconds=0.)
+
+    tmppath = outpath + '.part'
+    try:
+        shutil.copyfile(inpath, tmppath)
+        with netCDF4.Dataset(inpath, mode='r') as infile:
+            with netCDF4.Dataset(tmppath, mode='a') as outfile:
+                outfile.BATCH_SETTINGS = settings
+                if keys == 'all':
+                    keys = [
+                        k for k, v in infile.variables.items()
+                        if getattr(v, 'units', '').strip() in ('mol hr-1', 'g hr-1')
+                    ]
+                for key in keys:
+                    invar = infile.variables[key]
+                    outvar = outfile.variables[key]
+                    vfactor = np.asarray(factor, dtype=invar.dtype)
+                    for ti in range(invar.shape[0]):
+                        vals = invar[ti]
+                        vals *= vfactor
+                        outvar[ti] = vals
+        os.replace(tmppath, outpath)
+    except Exception as e:
+        # e.g., missing variable, truncated file, or full disk
+        return dict(
+            out, status='failed', seconds=time.perf_counter() - t0,
+            error=f'{type(e).__name__}: {e}'
+        )
+    return dict(out, status='done', seconds=time.perf_counter() - t0)
+
+
+# %%
+# List All Files
+# ''''''''''''''
+
+dates = pd.date_range(bdate, edate, freq='1D').strftime('%Y%m%d')
+tasks = [
+    (
+        intmpl.format(sector=sector, date=date, grid=grid),
+        outtmpl.format(sector=sector, date=date, grid=grid),
+    )
+    for date in dates for grid in grids for sector in sectors
+]
+print(f'INFO:: {len(tasks)} files ({len(dates)} dates x {len(grids)} grids x {len(sectors)} sectors)')
+
+# %%
+# Run in a Process Pool
+# '''''''''''''''''''''
+# - The __main__ check is required on systems that spawn (e.g., Windows).
+# - A failed file is reported (status failed) and the rest keep going; the
+#   timing report is always written.
+
+if __name__ == '__main__':
+    t0 = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=nworkers) as executor:
+        futures = {
+            executor.submit(scale_file, inpath, outpath, scalekeys, factor): (inpath, outpath)
+            for inpath, outpath in tasks
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # e.g., a worker process died
+                inpath, outpath = futures[future]
+                result = dict(
+                    inpath=inpath, outpath=outpath, status='failed',
+                    seconds=time.perf_counter() - t0, error=f'{type(e).__name__}: {e}'
+                )
+            print(f'INFO:: {result["status"]:7s} {result["seconds"]:7.2f}s {result["outpath"]}')
+            if result['status'] == 'failed':
+                print(f'WARN:: {result["error"]}')
+            results.append(result)
+
+    elapsed = time.perf_counter() - t0
+    timedf = pd.DataFrame(results).sort_values('outpath')
+    timedf.to_csv(timingpath, index=False)
+    print(timedf.groupby('status')['seconds'].agg(['count', 'sum', 'mean', 'max']))
+    print(f'INFO:: {elapsed:.2f}s wall-clock for {timedf["seconds"].sum():.2f}s of file work')
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Run the script, interrupt it with Ctrl+C, and rerun. Which files are redone?
+#    Change factor and rerun. Which files are redone?
+# 2. Add the area and pt sectors to sectors.
@@ -0,0 +1,183 @@
+"""
+Cache Region Masks
+==================
+
+Reuse region masks across days and sectors.
+
+The region-specific example (`run_gridemiss_02_perturbbox.py`) rebuilds cell
+centroids and tests them against the region shape every run. For complex
+shapes (e.g., a union of counties), that geometry work can take longer than
+the scaling. A mask only depends on the grid definition and the shape, so
+this example saves each mask as a bit-packed array in a cache folder. The
+file name is a hash of the IOAPI grid attributes and the shape's WKB, so any
+file on the same grid with the same shape reuses the mask. The least recently
+used masks are removed when the cache is full.
+
+The basic steps are:
+
+1. Define a region (same as the region-specific example).
+2. Get the mask from the cache (or compute and store it).
+3. Reuse the mask for many days and sectors.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# dates and sectors to process
+dates = ['20160610', '20160611']
+sectors = ['mobile']
+# file template to use as input
+intmpl = '../../camx/emiss/camx_area.{sector}.{date}.12km.nc'
+# bounding box within which to scale
+bbox = [-86.5, 30, -80, 35.5]      # [wlon,slat,elon,nlat] or 'custom'
+# where to keep masks and how many to keep
+cachedir = 'outputs/maskcache'
+maxentries = 256
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import hashlib
+import json
+import time
+import os
+import numpy as np
+import netCDF4
+import pyproj
+from shapely import points, box
+
+os.makedirs(cachedir, exist_ok=True)
+
+# %%
+# Define Cache Tools
+# ''''''''''''''''''
+# - The key uses only attributes that define the grid.
+# - Masks are stored with np.packbits (1 bit per cell).
+# - Reading a mask updates its modification time, which is used for LRU.
+
+gridattrkeys = [
+    'GDTYP', 'P_ALP', 'P_BET', 'P_GAM', 'XCENT', 'YCENT',
+    'XORIG', 'YORIG', 'XCELL', 'YCELL', 'NCOLS', 'NROWS',
+]
+
+
+def getproj(attrs):
+    """Return a pyproj.Proj for an IOAPI LCC grid"""
+    proj4tmpl = '+proj=lcc +lat_0={YCENT} +lon_0={P_GAM}'
+    proj4tmpl += ' +lat_1={P_ALP} +lat_2={P_BET} +R=6370000 +units=m +no_defs'
+    return pyproj.Proj(proj4tmpl.format(**attrs))
+
+
+def maskkey(attrs, shp):
+    """Hash the grid definition and shape (in grid coordinates)"""
+    gridjson = json.dumps({k: float(attrs[k]) for k in gridattrkeys}, sort_keys=True)
+    h = hashlib.sha256(gridjson.encode())
+    h.update(shp.wkb)
+    return h.hexdigest()[:32]
+
+
+def calcmask(attrs, shp):
+    """True where the cell centroid intersects shp"""
+    x = np.arange(0.5, attrs['NCOLS']) * attrs['XCELL'] + attrs['XORIG']
+    y = np.arange(0.5, attrs['NROWS']) * attrs['YCELL'] + attrs['YORIG']
+    X, Y = np.meshgrid(x, y)
+    return shp.intersects(points(X, Y))
+
+
+def evict(cachedir, maxentries):
+    """Remove the least recently used masks beyond maxentries"""
+    paths = [
+        os.path.join(cachedir, p) for p in os.listdir(cachedir)
+        if p.endswith('.npz')
+    ]
+    paths = sorted(paths, key=os.path.getmtime, reverse=True)
+    for path in paths[maxentries:]:
+        os.remove(path)
+
+
+def getmask(attrs, shp, cachedir=cachedir, maxentries=maxentries):
+    """
+    Arguments
+    ---------
+    attrs : mappable
+        IOAPI global attributes (must include gridattrkeys).
+    shp : shapely.Geometry
+        Region in grid coordinates (m).
+    cachedir : str
+        Folder for cached masks.
+    maxentries : int
+        Maximum number of masks to keep.
+
+    Returns
+    -------
+    mask : np.ndarray
+        Boolean (ROW, COL) array, True where centroid is in shp
+    """
+    path = os.path.join(cachedir, maskkey(attrs, shp) + '.npz')
+    shape = (int(attrs['NROWS']), int(attrs['NCOLS']))
+    if os.path.exists(path):
+        os.utime(path)
+        with np.load(path) as npzf:
+            bits = np.unpackbits(npzf['packed'], count=shape[0] * shape[1])
+        return bits.reshape(shape).astype(bool)
+
+    mask = calcmask(attrs, shp)
+    tmppath = path + '.tmp'
+    with open(tmppath, 'wb') as tmpf:
+        np.savez_compressed(tmpf, packed=np.packbits(mask.ravel()))
+    os.replace(tmppath, path)
+    evict(cachedir, maxentries)
+    return mask
+
+
+# %%
+# Define an area for scaling
+# ''''''''''''''''''''''''''
+# - same as the region-specific example
+# - the shape is reprojected to grid space before hashing
+
+with netCDF4.Dataset(intmpl.format(sector=sectors[0], date=dates[0])) as f:
+    attrs = {k: f.getncattr(k) for k in f.ncattrs()}
+
+proj = getproj(attrs)
+if bbox != 'custom':
+    pbbox = proj(*bbox[:2]) + proj(*bbox[2:])
+    myshp = box(*pbbox)
+else:
+    import geopandas as gpd
+
+    cntypath = '../../www2.census.gov/geo/tiger/TIGER2020/COUNTY/tl_2020_us_county.zip'
+    cnty = gpd.read_file(cntypath, bbox=(-135, 20, -60, 60))
+    myshp = cnty.query('STATEFP == "13"').to_crs(proj.srs).union_all()
+
+# %%
+# Reuse the Mask
+# ''''''''''''''
+# - the first request computes (unless cached by a previous run)
+# - every other date and sector on the same grid reads from the cache
+
+for date in dates:
+    for sector in sectors:
+        with netCDF4.Dataset(intmpl.format(sector=sector, date=date)) as f:
+            attrs = {k: f.getncattr(k) for k in f.ncattrs()}
+        t0 = time.perf_counter()
+        ismine = getmask(attrs, myshp)
+        t1 = time.perf_counter()
+        print(f'INFO:: {date} {sector} {ismine.sum()} cells in {(t1 - t0) * 1e3:.1f}ms')
+
+# Confirm the cached mask matches a fresh calculation
+t0 = time.perf_counter()
+fresh = calcmask(attrs, myshp)
+t1 = time.perf_counter()
+assert np.array_equal(fresh, getmask(attrs, myshp))
+print(f'INFO:: uncached calculation takes {(t1 - t0) * 1e3:.1f}ms')
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Use getmask in `run_gridemiss_02_perturbbox.py` to define ismine.
+# 2. Set bbox to 'custom' and compare cached and uncached times.
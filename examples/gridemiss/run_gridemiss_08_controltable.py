@@ -0,0 +1,167 @@
+"""
+Apply a Control Strategy Table
+==============================
+
+Apply many region x species x sector factors in one pass per file.
+
+The other gridded examples apply one factor to one list of species in one
+region. A control strategy has many rules, and applying them one at a time
+means reading and writing each file once per rule. This example reads a
+table of rules (region, species or species group, sector, factor), combines
+all rules for a file into one factor field per species, and applies them in a
+single pass over the file. Emission totals before and after are saved for
+review.
+
+The basic steps are:
+
+1. Define regions, species groups, and a control table.
+2. Combine rules into a factor field for each sector and species.
+3. Scale each file in one pass.
+4. Summarize totals before and after.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# date and grid to process
+date = '20160610'
+grid = '12km'
+# input and output templates
+intmpl = '../../camx/emiss/camx_area.{sector}.{date}.{grid}.nc'
+outtmpl = 'outputs/camx_area_ctl.{sector}.{date}.{grid}.nc'
+# control table: set to your own CSV, or None to write controlcsv below to
+# examplecontrolpath (rewritten every run, so edits to controlcsv apply)
+controlpath = None
+examplecontrolpath = 'outputs/control_table.csv'
+controlcsv = """region,species,sector,factor
+domain,NOX,mobile,0.9
+southeast,NOX,mobile,0.8
+atlanta,NOX,mobile,0.5
+southeast,CO,mobile,0.75
+"""
+# regions as [wlon,slat,elon,nlat]; domain is always the whole grid
+regions = {
+    'southeast': [-86.5, 30, -80, 35.5],
+    'atlanta': [-84.8, 33.4, -84, 34.1],
+}
+# species groups; any other name in the table is a single species
+speciesgroups = {
+    'NOX': ['NO', 'NO2', 'HONO'],
+}
+# summary of emission totals
+summarypath = f'outputs/control_summary.{date}.{grid}.csv'
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import shutil
+import os
+import numpy as np
+import pandas as pd
+import netCDF4
+import pyproj
+from shapely import points, box
+
+os.makedirs('outputs', exist_ok=True)
+if controlpath is None:
+    controlpath = examplecontrolpath
+    with open(controlpath, 'w') as cf:
+        cf.write(controlcsv)
+
+# %%
+# Read the Control Table
+# ''''''''''''''''''''''
+# - expand species groups to one row per species
+# - rules that overlap are multiplied (e.g., domain 0.9 and atlanta 0.5)
+
+ctldf = pd.read_csv(controlpath, dtype={'factor': 'd'})
+ctldf['species'] = ctldf['species'].map(lambda k: speciesgroups.get(k, [k]))
+ctldf = ctldf.explode('species', ignore_index=True)
+print(ctldf)
+
+# %%
+# Combine Rules into Factor Fields
+# ''''''''''''''''''''''''''''''''
+# - cell centroids are tested against each region once per grid
+# - factors[species] is a ROW x COL field
+
+
+def getregionmasks(ncf, regions):
+    """Return a ROW x COL mask for each region and domain"""
+    attrs = {k: ncf.getncattr(k) for k in ncf.ncattrs()}
+    proj4tmpl = '+proj=lcc +lat_0={YCENT} +lon_0={P_GAM}'
+    proj4tmpl += ' +lat_1={P_ALP} +lat_2={P_BET} +R=6370000 +units=m +no_defs'
+    proj = pyproj.Proj(proj4tmpl.format(**attrs))
+    x = np.arange(0.5, ncf.NCOLS) * ncf.XCELL + ncf.XORIG
+    y = np.arange(0.5, ncf.NROWS) * ncf.YCELL + ncf.YORIG
+    gcxy = points(*np.meshgrid(x, y))
+    masks = {'domain': np.ones(gcxy.shape, dtype=bool)}
+    for name, bbox in regions.items():
+        pbbox = proj(*bbox[:2]) + proj(*bbox[2:])
+        masks[name] = box(*pbbox).intersects(gcxy)
+    return masks
+
+
+def getfactors(sectordf, masks):
+    """Return a ROW x COL factor field for each species in sectordf"""
+    factors = {}
+    for _, row in sectordf.iterrows():
+        mask = masks[row['region']]
+        field = factors.setdefault(row['species'], np.ones(mask.shape, dtype='f'))
+        field[mask] *= row['factor']
+    return factors
+
+
+# %%
+# Apply All Rules in One Pass per File
+# ''''''''''''''''''''''''''''''''''''
+# - copy the file, then read, scale, and write each controlled species once
+# - one TSTEP at a time (see `run_gridemiss_03_streaming.py`)
+# - totals are accumulated while scaling
+
+sums = []
+masks = None
+for sector, sectordf in ctldf.groupby('sector'):
+    inpath = intmpl.format(sector=sector, date=date, grid=grid)
+    outpath = outtmpl.format(sector=sector, date=date, grid=grid)
+    shutil.copyfile(inpath, outpath)
+    with netCDF4.Dataset(inpath) as infile, netCDF4.Dataset(outpath, mode='a') as outfile:
+        if masks is None:
+            # all sectors share a grid
+            masks = getregionmasks(infile, regions)
+        factors = getfactors(sectordf, masks)
+        for skey, factor in factors.items():
+            print(f'INFO:: {sector} {skey} factor avg={factor.mean():.3f}')
+            invar = infile[skey]
+            outvar = outfile[skey]
+            before = after = 0.
+            for ti in range(invar.shape[0]):
+                vals = invar[ti]
+                before += vals.sum(dtype='d')
+                vals *= factor
+                after += vals.sum(dtype='d')
+                outvar[ti] = vals
+            sums.append(dict(
+                sector=sector, species=skey, units=invar.units.strip(),
+                before=before, after=after
+            ))
+
+# %%
+# Summarize Totals
+# ''''''''''''''''
+# - totals are sums over all hours, layers, and cells
+
+sumdf = pd.DataFrame(sums)
+sumdf['ratio'] = sumdf['after'] / sumdf['before']
+sumdf.to_csv(summarypath, index=False)
+print(sumdf.to_string())
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Add a rule for the area sector.
+# 2. Add a species group for VOC and reduce it in atlanta.
@@ -0,0 +1,182 @@
+"""
+Compression and Chunk Layout for Emission Files
+===============================================
+
+Rewrite perturbed emission files with configurable compression and chunking,
+then measure file size and read time for each layout.
+
+The perturbed files from the other examples keep whatever layout the source
+file had. On a shared, I/O bound file system, smaller files can be faster to
+read even after paying for decompression. CAMx reads emissions one time step
+at a time, so chunks should hold one TSTEP (or one TSTEP and one layer). This
+example writes the same gridded and point files with several layouts and
+reports the size and full-timestep read latency of each, so layouts can be
+chosen from data.
+
+Note: compressed inputs require CAMx to be built with NetCDF4/HDF5. The
+`NetCDF_Use_Compression` flag in the CAMx job only affects CAMx outputs.
+
+The basic steps are:
+
+1. Define layouts (zlib level, shuffle, chunk shape).
+2. Rewrite each file with each layout.
+3. Measure size and time to read every variable for each TSTEP.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+date = '20160610'
+# perturbed files to rewrite (from gridemiss and ptsrce examples)
+inpaths = [
+    f'outputs/camx_area_2x.mobile.{date}.36km.nc',
+    f'../ptsrce/outputs/point.camx.ptnonipm_edit.{date}.nc',
+]
+# Layouts: complevel=0 is uncompressed
+# - chunk='tstep' holds one TSTEP per chunk
+# - chunk='tsteplay' holds one TSTEP and one LAY per chunk
+# - chunk='day' holds 24 TSTEPs per chunk (misaligned for per-TSTEP reads)
+layouts = [
+    dict(name='raw', complevel=0, shuffle=False, chunk='tstep'),
+    dict(name='z1', complevel=1, shuffle=False, chunk='tstep'),
+    dict(name='z1s', complevel=1, shuffle=True, chunk='tstep'),
+    dict(name='z4s', complevel=4, shuffle=True, chunk='tstep'),
+    dict(name='z1slay', complevel=1, shuffle=True, chunk='tsteplay'),
+    dict(name='z1sday', complevel=1, shuffle=True, chunk='day'),
+]
+# benchmark results
+benchpath = 'outputs/layout_benchmark.csv'
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import time
+import os
+import numpy as np
+import pandas as pd
+import netCDF4
+
+os.makedirs('outputs/layouts', exist_ok=True)
+
+# %%
+# Define Rewrite
+# ''''''''''''''
+# - dimensions, global attributes, and variable attributes are unchanged
+# - values are copied one TSTEP at a time
+
+
+def chunksizes(var, chunk):
+    """Chunk shape for var according to the chunk layout name"""
+    if var.ndim == 0:
+        return None
+    shape = list(var.shape)
+    if var.dimensions[0] == 'TSTEP':
+        shape[0] = {'tstep': 1, 'tsteplay': 1, 'day': min(24, max(shape[0], 1))}[chunk]
+        if chunk == 'tsteplay' and 'LAY' in var.dimensions:
+            shape[var.dimensions.index('LAY')] = 1
+    return [max(s, 1) for s in shape]
+
+
+def rewrite(inpath, outpath, complevel=0, shuffle=False, chunk='tstep'):
+    """
+    Arguments
+    ---------
+    inpath : str
+        Existing CAMx-ready file.
+    outpath : str
+        Path to write with the new layout.
+    complevel : int
+        zlib level (0 for none).
+    shuffle : bool
+        Use the HDF5 byte-shuffle filter (only with complevel > 0).
+    chunk : str
+        tstep, tsteplay, or day (see chunksizes)
+
+    Returns
+    -------
+    None
+    """
+    with netCDF4.Dataset(inpath) as infile:
+        with netCDF4.Dataset(outpath, mode='w', format='NETCDF4_CLASSIC') as outfile:
+            for dk, dim in infile.dimensions.items():
+                outfile.createDimension(dk, None if dim.isunlimited() else len(dim))
+            outfile.setncatts({pk: infile.getncattr(pk) for pk in infile.ncattrs()})
+            for key, invar in infile.variables.items():
+                attrs = {pk: invar.getncattr(pk) for pk in invar.ncattrs()}
+                fill_value = attrs.pop('_FillValue', None)
+                outvar = outfile.createVariable(
+                    key, invar.dtype, invar.dimensions, fill_value=fill_value,
+                    zlib=complevel > 0, complevel=max(complevel, 1),
+                    shuffle=shuffle and complevel > 0,
+                    chunksizes=chunksizes(invar, chunk)
+                )
+                outvar.setncatts(attrs)
+                if invar.ndim > 0 and invar.dimensions[0] == 'TSTEP':
+                    for ti in range(invar.shape[0]):
+                        outvar[ti] = invar[ti]
+                else:
+                    outvar[:] = invar[:]
+
+
+def read_latency(path):
+    """Seconds to read all TSTEP variables for each TSTEP"""
+    times = []
+    with netCDF4.Dataset(path) as ncf:
+        tvars = [
+            v for v in ncf.variables.values()
+            if v.ndim > 0 and v.dimensions[0] == 'TSTEP'
+        ]
+        for ti in range(len(ncf.dimensions['TSTEP'])):
+            t0 = time.perf_counter()
+            for var in tvars:
+                var[ti]
+            times.append(time.perf_counter() - t0)
+    return np.array(times)
+
+
+# %%
+# Rewrite and Benchmark
+# '''''''''''''''''''''
+# - reads are warm (the file was just written); on a shared file system,
+#   run read_latency from a separate job to include cold reads.
+
+rows = []
+for inpath in inpaths:
+    if not os.path.exists(inpath):
+        print('WARN:: missing (run the earlier example first)', inpath)
+        continue
+    stem = os.path.basename(inpath)[:-3]
+    for layout in layouts:
+        opts = {k: v for k, v in layout.items() if k != 'name'}
+        outpath = f'outputs/layouts/{stem}.{layout["name"]}.nc'
+        t0 = time.perf_counter()
+        rewrite(inpath, outpath, **opts)
+        wtime = time.perf_counter() - t0
+        rtimes = read_latency(outpath)
+        rows.append(dict(
+            file=stem, **layout,
+            size_MB=os.path.getsize(outpath) / 1e6,
+            ratio=os.path.getsize(outpath) / os.path.getsize(inpath),
+            write_s=wtime,
+            read_tstep_ms_median=np.median(rtimes) * 1e3,
+            read_tstep_ms_max=rtimes.max() * 1e3,
+            read_all_s=rtimes.sum(),
+        ))
+        print(f'INFO:: {stem} {layout["name"]}: {rows[-1]["size_MB"]:.1f}MB')
+
+if len(rows) == 0:
+    print('WARN:: no input files; skipping the benchmark report')
+else:
+    benchdf = pd.DataFrame(rows)
+    benchdf.to_csv(benchpath, index=False)
+    print(benchdf.drop(columns=['complevel', 'shuffle', 'chunk']).round(3).to_string())
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Copy a layout to your shared file system and rerun read_latency there.
+# 2. Add a layout with complevel=9. Is the size reduction worth the time?
@@ -0,0 +1,267 @@
+"""
+Calculate MDA8 Quickly for Many Stations
+========================================
+
+Calculate the maximum daily 8-hour average (Appendix U) for all stations at
+once with arrays instead of a loop over stations.
+
+The MDA8 example (`run_mpe_02_o3mda8.py`) calls `groupby('STATION').apply`
+with a rolling mean for each station, then groups again by day. Each station
+is a separate Python call, which takes minutes for a year of AQS data. This
+example puts all stations into one station x hour array, calculates every
+8-hour average from cumulative sums and counts of valid hours, and then takes
+the daily maximum with a reshape to station x day x hour. The Appendix U rules
+are the same:
+
+- an 8h average needs at least 6 valid hours,
+- 8h averages starting 00-06 LST are removed,
+- a daily maximum needs at least 13 valid 8h averages.
+
+The basic steps are:
+
+1. Pair observations and CAMx as in `run_mpe_02_o3mda8.py`.
+2. Calculate MDA8 with the array method and with groupby/rolling.
+3. Check that they are the same.
+4. Benchmark at 4,000 stations x 8,760 hours.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# Define Analysis
+obssrc = 'airnow'  # or aqs
+obsspc = 'ozone'     # or ozone, co, pm25, ...
+modsrc = 'CAMx'    # Or CMAQ
+modspc = 'O3'     # or O3, CO, PM25, ...
+
+# Set input files
+dates = ['20160610', '20160611']
+avrgtmpl = '../../camx/outputs/CAMx.v7.32.36.12.{}.avrg.grd02.nc'  # placeholder {} for date
+
+# Outputs
+outstem = f'outputs/{obssrc}.{obsspc}_MDA8fast_and_CAMx.v7.32.36.12.avrg.grd02'
+pairedpath = outstem + '.csv'
+
+# Benchmark size (set nbenchstation to 0 to skip)
+nbenchstation = 4000
+nbenchhour = 8760
+# groupby/rolling is timed with fewer stations and scaled up
+nbenchref = 100
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import time
+import pyrsig
+import numpy as np
+import pandas as pd
+import os
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Define MDA8 with groupby/rolling
+# ''''''''''''''''''''''''''''''''
+# - the approach in `run_mpe_02_o3mda8.py` (Steps 3(b)-(d))
+
+
+def mda8_groupby(df, obskey, modkey):
+    a8df = df[['STATION', 'time_lst', obskey, modkey]].groupby('STATION').apply(
+        lambda sdf:
+        sdf.set_index('time_lst')[[obskey, modkey]].asfreq('1h')
+        .rolling('8h', min_periods=6).mean(),
+        include_groups=True
+    )
+    iddf = a8df.index.to_frame()
+    iddf['start_time_lst'] = iddf['time_lst'] + pd.to_timedelta('-7h')
+    a8df.index = pd.MultiIndex.from_frame(iddf[['STATION', 'start_time_lst']])
+    a8df = a8df.query('start_time_lst.dt.hour > 6')
+    mda8df = a8df.groupby(['STATION', pd.Grouper(level='start_time_lst', freq='24h')]).agg(**{
+        obskey: (obskey, 'max'),
+        modkey: (modkey, 'max'),
+        'count': (obskey, 'count')
+    })
+    return mda8df.query('count >= 13')
+
+
+# %%
+# Define MDA8 with Arrays
+# '''''''''''''''''''''''
+# - hours are placed in a (station, hour) array starting at 00 LST of the day
+#   before the first observation (pandas includes 8h averages that start up
+#   to 7h before the first observation)
+# - with C the cumulative count of valid hours and S the cumulative sum, the
+#   8h average starting at hour h is (S[h+8] - S[h]) / (C[h+8] - C[h])
+# - pandas labels an 8h average by its last hour and only up to the last
+#   observation, so averages ending after a station's last time are removed
+# - duplicate station/time rows are not expected; the last one is used
+
+
+def mda8_dense(df, keys, countkey=None, stationkey='STATION', timekey='time_lst'):
+    """
+    Arguments
+    ---------
+    df : pandas.DataFrame
+        Hourly data with stationkey, timekey (tz-naive LST), and keys.
+    keys : list
+        Columns to calculate MDA8 for.
+    countkey : str
+        Column used to count valid 8h averages (default keys[0]).
+
+    Returns
+    -------
+    mda8df : pandas.DataFrame
+        Index (stationkey, start_time_lst) with MDA8 for each key and count;
+        only days with count >= 13
+    """
+    if countkey is None:
+        countkey = keys[0]
+    sidx, stations = pd.factorize(df[stationkey], sort=True)
+    times = df[timekey].to_numpy().astype('datetime64[h]')
+    day0 = times.min().astype('datetime64[D]') - np.timedelta64(1, 'D')
+    hidx = (times - day0).astype('i8')
+    nd = int((times.max().astype('datetime64[D]') - day0).astype('i8')) + 1
+    ns = stations.size
+    nh = nd * 24 + 7
+    lasth = np.full(ns, -1, dtype='i8')
+    np.maximum.at(lasth, sidx, hidx)
+    # 8h averages starting at h end at h + 7
+    isafter = (np.arange(nd * 24)[None, :] + 7) > lasth[:, None]
+
+    out = {}
+    for key in keys:
+        vals = np.full((ns, nh), np.nan)
+        vals[sidx, hidx] = df[key].to_numpy()
+        isvalid = ~np.isnan(vals)
+        csum = np.zeros((ns, nh + 1), dtype='i4')
+        np.cumsum(isvalid, axis=1, out=csum[:, 1:])
+        n8 = csum[:, 8:] - csum[:, :-8]
+        del csum, isvalid
+        vsum = np.zeros((ns, nh + 1))
+        np.cumsum(np.nan_to_num(vals, copy=False), axis=1, out=vsum[:, 1:])
+        del vals
+        a8 = vsum[:, 8:] - vsum[:, :-8]
+        del vsum
+        ok = (n8 >= 6) & ~isafter
+        # invalid averages are -inf so that max ignores them
+        a8 = np.divide(a8, n8, out=np.full(a8.shape, -np.inf), where=ok)
+        # station x day x hour; keep starts 07-23 LST
+        dmax = a8.reshape(ns, nd, 24)[:, :, 7:].max(-1)
+        dmax[np.isneginf(dmax)] = np.nan
+        out[key] = dmax
+        if key == countkey:
+            out['count'] = ok.reshape(ns, nd, 24)[:, :, 7:].sum(-1)
+        del a8, ok, n8
+
+    keep = out['count'] >= 13
+    si, di = np.nonzero(keep)
+    index = pd.MultiIndex.from_arrays([
+        stations[si],
+        (day0 + di.astype('timedelta64[D]')).astype('datetime64[ns]'),
+    ], names=[stationkey, 'start_time_lst'])
+    cols = {key: out[key][keep] for key in keys}
+    cols['count'] = out['count'][keep]
+    return pd.DataFrame(cols, index=index)
+
+
+# %%
+# Query Observations for Model file
+# '''''''''''''''''''''''''''''''''
+
+obskey = f'{obssrc}.{obsspc}'  # must exist in RSIG
+modkey = f'{modsrc}{modspc}'
+keys = [obskey, modkey]
+dfs = []
+for datestr in dates:
+    ncpath = avrgtmpl.format(datestr)
+    ds = pyrsig.open_ioapi(ncpath)
+    df = pyrsig.cmaq.pair_rsigcmaq(ds, modspc, obskey, prefix=modsrc, workdir='outputs')
+    df[modkey] *= 1000
+    df.rename(columns={obsspc: obskey}, inplace=True)
+    dfs.append(df)
+
+df = pd.concat(dfs)
+
+# %%
+# Adjust Times to LST
+# '''''''''''''''''''
+# - same as Step 3(a) in `run_mpe_02_o3mda8.py`
+
+tz = (df.groupby('STATION')['LONGITUDE'].mean() / 15).round(0)
+tz = pd.to_timedelta(tz, unit='h')  # EST=-5h, ... PST=-8h
+df['time_lst'] = df['time'].dt.tz_convert(None) + tz.loc[df.STATION].values
+
+# %%
+# Compare Methods
+# '''''''''''''''
+
+t0 = time.perf_counter()
+refdf = mda8_groupby(df, obskey, modkey)
+t1 = time.perf_counter()
+mda8df = mda8_dense(df, keys)
+t2 = time.perf_counter()
+print(f'INFO:: groupby {t1 - t0:.2f}s; arrays {t2 - t1:.2f}s')
+
+
+def check_same(refdf, newdf, keys):
+    assert refdf.index.equals(newdf.index)
+    assert np.array_equal(refdf['count'], newdf['count'])
+    for key in keys:
+        assert np.allclose(refdf[key], newdf[key], rtol=1e-9, equal_nan=True)
+
+
+check_same(refdf, mda8df, keys)
+print(f'INFO:: {mda8df.shape[0]} MDA8 values match')
+mda8df['COUNTYFP'] = mda8df.index.to_frame()['STATION'].astype(str).str[:5]
+mda8df.to_csv(pairedpath)
+print(pyrsig.utils.quickstats(mda8df[keys], obskey))
+
+# %%
+# Benchmark
+# '''''''''
+# - synthetic diurnal ozone with 10% of hours missing and a few long gaps
+# - stations have different start and end times
+
+if nbenchstation > 0:
+    rng = np.random.default_rng(0)
+    ns, nh = nbenchstation, nbenchhour
+    hour = np.arange(nh)
+    o3 = 40 + 20 * np.sin((hour[None, :] - 9) / 24 * 2 * np.pi) + rng.normal(0, 5, (ns, nh))
+    o3[rng.random((ns, nh)) < 0.1] = np.nan
+    for si in rng.choice(ns, ns // 10, replace=False):
+        start = rng.integers(0, nh - 48)
+        o3[si, start:start + rng.integers(6, 48)] = np.nan
+    o3[np.arange(ns) % 7 == 0, :rng.integers(0, 200)] = np.nan
+    o3[np.arange(ns) % 5 == 0, -rng.integers(1, 200):] = np.nan
+    si, hi = np.nonzero(~np.isnan(o3))
+    benchdf = pd.DataFrame({
+        'STATION': si.astype('i4'),
+        'time_lst': pd.Timestamp('2016-01-01') + pd.to_timedelta(hi, unit='h'),
+        obskey: o3[si, hi].astype('f'),
+        modkey: (o3[si, hi] * 1.1 + 3).astype('f'),
+    })
+    del o3, si, hi
+    print(f'INFO:: benchmark {ns} stations x {nh} hours ({benchdf.shape[0]} rows)')
+
+    t0 = time.perf_counter()
+    fastdf = mda8_dense(benchdf, keys)
+    t1 = time.perf_counter()
+    print(f'INFO:: arrays {t1 - t0:.2f}s for {ns} stations')
+
+    subdf = benchdf.query(f'STATION < {nbenchref}')
+    t0 = time.perf_counter()
+    slowdf = mda8_groupby(subdf, obskey, modkey)
+    t1 = time.perf_counter()
+    est = (t1 - t0) * ns / nbenchref
+    print(f'INFO:: groupby {t1 - t0:.2f}s for {nbenchref} stations (~{est:.0f}s for {ns})')
+    check_same(slowdf, fastdf.loc[fastdf.index.get_level_values('STATION') < nbenchref], keys)
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Use mda8_dense in `run_mpe_02_o3mda8.py`.
+# 2. Truncate hourly values to ppb before averaging (Appendix U 3(a)).
@@ -0,0 +1,259 @@
+"""
+Calculate MDA8 for Every Grid Cell
+==================================
+
+Make a daily maximum 8-hour average (MDA8) ozone file for every grid cell from
+a series of daily CAMx avrg files.
+
+The MDA8 examples (`run_mpe_02_o3mda8.py` and `run_mpe_03_mda8fast.py`) only
+calculate MDA8 where there are monitors. Maps of design values need MDA8 in
+every cell. Each cell uses its own local standard time (LST), based on its
+longitude, so an LST day uses hours from two UTC files. This example reads
+surface ozone one hour at a time, keeps only the hours still needed (about two
+days), and picks each cell's LST hours with one indexing operation. The
+Appendix U rules are the same as `run_mpe_02_o3mda8.py`:
+
+- an 8h average needs at least 6 valid hours,
+- only 8h averages starting 07-23 LST are used,
+- a daily maximum needs at least 13 valid 8h averages.
+
+The basic steps are:
+
+1. Calculate each cell's UTC offset from longitude.
+2. For each LST day, read the UTC hours that are needed.
+3. Calculate the 8h averages and daily maximum.
+4. Write a daily IOAPI-like file in ppb.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# Set input files (consecutive days; add more dates for a season)
+dates = ['20160610', '20160611']
+avrgtmpl = '../../camx/outputs/CAMx.v7.32.36.12.{}.avrg.grd02.nc'  # placeholder {} for date
+key = 'O3'
+factor = 1000  # ppm to ppb
+units = 'ppb'
+
+# Outputs
+outpath = f'outputs/CAMx.v7.32.36.12.{dates[0]}_{dates[-1]}.MDA8.grd02.nc'
+figpath = f'outputs/CAMx.v7.32.36.12.{dates[0]}.MDA8.grd02.png'
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import time
+import os
+import numpy as np
+import netCDF4
+import pyproj
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Define UTC Offsets
+# ''''''''''''''''''
+# - the offset for each cell is round(longitude / 15) hours (EST=-5h, ...)
+# - LST = UTC + offset
+
+
+def getproj(attrs):
+    proj4tmpl = '+proj=lcc +lat_0={YCENT} +lon_0={P_GAM}'
+    proj4tmpl += ' +lat_1={P_ALP} +lat_2={P_BET} +R=6370000 +units=m +no_defs'
+    return pyproj.Proj(proj4tmpl.format(**attrs))
+
+
+def utcoffsets(attrs):
+    """
+    Arguments
+    ---------
+    attrs : dict
+        IOAPI grid attributes.
+
+    Returns
+    -------
+    tz : np.ndarray (ROW, COL)
+        Hours to add to UTC to get LST
+    """
+    x = attrs['XORIG'] + (np.arange(attrs['NCOLS']) + 0.5) * attrs['XCELL']
+    y = attrs['YORIG'] + (np.arange(attrs['NROWS']) + 0.5) * attrs['YCELL']
+    x, y = np.meshgrid(x, y)
+    lon, lat = getproj(attrs)(x, y, inverse=True)
+    return np.round(lon / 15).astype('i')
+
+
+# %%
+# Read Hours
+# ''''''''''
+# - each file is read one TSTEP at a time
+# - hours are keyed by hours since 1970-01-01 UTC, so 24 or 25 hour files and
+#   the boundary between files do not need special handling
+
+
+def tflag2hour(tflag):
+    """(TSTEP, 2) YYYYJJJ, HHMMSS to hours since 1970-01-01"""
+    yyyy, jjj = np.divmod(tflag[:, 0], 1000)
+    days = (
+        (yyyy - 1970).astype('datetime64[Y]').astype('datetime64[D]')
+        - np.datetime64('1970-01-01') + (jjj - 1).astype('timedelta64[D]')
+    ).astype('i8')
+    return days * 24 + tflag[:, 1] // 10000
+
+
+def iterhours(paths, key, factor):
+    """yields (hour, (ROW, COL) values) for each TSTEP of each file"""
+    for path in paths:
+        with netCDF4.Dataset(path) as f:
+            var = f[key]
+            for ti, hour in enumerate(tflag2hour(f['TFLAG'][:, 0, :])):
+                # masked (missing) values become NaN
+                yield int(hour), np.ma.filled(var[ti, 0].astype('f'), np.nan) * factor
+
+
+# %%
+# Define Gridded MDA8
+# '''''''''''''''''''
+# - for LST day d, cell values for 07 LST day d to 06 LST day d+1 are picked
+#   from a (hour, ROW, COL) buffer with np.take_along_axis
+# - with C the cumulative count of valid hours and S the cumulative sum, the
+#   8h average starting at hour h is (S[h+8] - S[h]) / (C[h+8] - C[h])
+# - hours not in the files are missing (e.g., the last day has no next day)
+
+
+def mda8_grid(paths, outpath, key='O3', factor=1000, units='ppb'):
+    """
+    Arguments
+    ---------
+    paths : list
+        Consecutive daily IOAPI files (e.g., CAMx avrg) in time order.
+    outpath : str
+        Daily MDA8 file to create.
+    key : str
+        Variable to use (first layer).
+    factor : float
+        Multiplier for units (e.g., ppm to ppb).
+    units : str
+        Units after factor.
+
+    Returns
+    -------
+    None
+    """
+    with netCDF4.Dataset(paths[0]) as f:
+        attrs = {k: f.getncattr(k) for k in f.ncattrs()}
+        vattrs = {k: f[key].getncattr(k) for k in f[key].ncattrs()}
+        firsthour = int(tflag2hour(f['TFLAG'][:1, 0, :])[0])
+    with netCDF4.Dataset(paths[-1]) as f:
+        lasthour = int(tflag2hour(f['TFLAG'][-1:, 0, :])[0])
+    nrows, ncols = int(attrs['NROWS']), int(attrs['NCOLS'])
+    tz = utcoffsets(attrs)
+    # the last day is the last LST day whose 07 LST start is in the files in
+    # any cell (a 25th TSTEP at 00 UTC does not add an empty day)
+    firstday, lastday = firsthour // 24, (lasthour + int(tz.max()) - 7) // 24
+    # hours after 00 LST of day d: 07 LST day d to 06 LST day d+1
+    lsthours = np.arange(7, 31)[:, None, None]
+
+    outf = netCDF4.Dataset(outpath, mode='w', format='NETCDF4_CLASSIC')
+    outf.setncatts(attrs)
+    sdate = np.datetime64('1970-01-01') + np.timedelta64(firstday, 'D')
+    outf.SDATE = np.int32(sdate.astype(object).strftime('%Y%j'))
+    outf.STIME = np.int32(0)
+    outf.TSTEP = np.int32(240000)
+    outf.NLAYS = np.int32(1)
+    outf.NVARS = np.int32(2)
+    setattr(outf, 'VAR-LIST', f'{key}_MDA8'.ljust(16) + 'NWIN8'.ljust(16))
+    outf.FILEDESC = f'{key} MDA8 (LST) from ' + ' '.join(os.path.basename(p) for p in paths)
+    outf.createDimension('TSTEP', None)
+    outf.createDimension('DATE-TIME', 2)
+    outf.createDimension('LAY', 1)
+    outf.createDimension('VAR', 2)
+    outf.createDimension('ROW', nrows)
+    outf.createDimension('COL', ncols)
+    tflag = outf.createVariable('TFLAG', 'i', ('TSTEP', 'VAR', 'DATE-TIME'))
+    tflag.units = '<YYYYDDD,HHMMSS>'
+    tflag.long_name = 'TFLAG'.ljust(16)
+    tflag.var_desc = 'Timestep-valid flags:  (1) YYYYDDD or (2) HHMMSS'.ljust(80)
+    mvar = outf.createVariable(f'{key}_MDA8', 'f', ('TSTEP', 'LAY', 'ROW', 'COL'))
+    mvar.units = units.ljust(16)
+    mvar.long_name = f'{key}_MDA8'.ljust(16)
+    mvar.var_desc = (
+        f'{vattrs.get("long_name", key).strip()} max daily 8h average (LST);'
+        ' NaN if fewer than 13 valid 8h averages'
+    ).ljust(80)
+    nvar = outf.createVariable('NWIN8', 'i', ('TSTEP', 'LAY', 'ROW', 'COL'))
+    nvar.units = 'count'.ljust(16)
+    nvar.long_name = 'NWIN8'.ljust(16)
+    nvar.var_desc = 'Number of valid 8h averages starting 07-23 LST'.ljust(80)
+
+    hours = {}
+    hourgen = iterhours(paths, key, factor)
+    loadedhour = firsthour - 1
+    for oi, day in enumerate(range(firstday, lastday + 1)):
+        need = day * 24 + lsthours - tz[None]  # (24, ROW, COL) UTC hours
+        hmin, hmax = int(need.min()), int(need.max())
+        while loadedhour < hmax:
+            nexthour = next(hourgen, None)
+            if nexthour is None:
+                break
+            loadedhour, hourvals = nexthour
+            hours[loadedhour] = hourvals
+        for hour in [h for h in hours if h < hmin]:
+            del hours[hour]
+        buf = np.full((hmax - hmin + 1, nrows, ncols), np.nan, dtype='f')
+        for hour, hourvals in hours.items():
+            if hour <= hmax:
+                buf[hour - hmin] = hourvals
+        vals = np.take_along_axis(buf, need - hmin, axis=0).astype('d')
+        isvalid = ~np.isnan(vals)
+        csum = np.zeros((25, nrows, ncols), dtype='i4')
+        np.cumsum(isvalid, axis=0, out=csum[1:])
+        vsum = np.zeros((25, nrows, ncols))
+        np.cumsum(np.where(isvalid, vals, 0), axis=0, out=vsum[1:])
+        # 17 windows starting 07-23 LST
+        n8 = csum[8:] - csum[:17]
+        ok = n8 >= 6
+        a8 = np.divide(vsum[8:] - vsum[:17], n8, out=np.full(n8.shape, -np.inf), where=ok)
+        nwin = ok.sum(0)
+        mda8 = np.where(nwin >= 13, a8.max(0), np.nan)
+        date = np.datetime64('1970-01-01') + np.timedelta64(day, 'D')
+        tflag[oi] = [[int(date.astype(object).strftime('%Y%j')), 0]] * 2
+        mvar[oi, 0] = mda8
+        nvar[oi, 0] = nwin
+        print(f'INFO:: {date} {np.isfinite(mda8).mean():.1%} cells valid; {len(hours)} hours in memory')
+
+    outf.close()
+
+
+# %%
+# Calculate MDA8
+# ''''''''''''''
+
+paths = [avrgtmpl.format(d) for d in dates]
+t0 = time.perf_counter()
+mda8_grid(paths, outpath, key=key, factor=factor, units=units)
+t1 = time.perf_counter()
+print(f'INFO:: {outpath} in {t1 - t0:.2f}s')
+
+# %%
+# Visualize First Day
+# '''''''''''''''''''
+
+import matplotlib.pyplot as plt
+
+with netCDF4.Dataset(outpath) as f:
+    Z = f[f'{key}_MDA8'][0, 0]
+    fig, ax = plt.subplots()
+    p = ax.pcolormesh(Z)
+    fig.colorbar(p, label=f'{key} MDA8 [{units}]')
+    ax.set(title=f'{key} MDA8 {dates[0]} (LST)')
+    fig.savefig(figpath)
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Calculate the 4th highest MDA8 for each cell from a season of files.
+# 2. Sample the file at monitors and compare to `run_mpe_03_mda8fast.py`.
@@ -0,0 +1,292 @@
+"""
+Pair Many Days Concurrently
+===========================
+
+Download observations for several days at the same time, and extract model
+values in other processes while downloads continue.
+
+The hourly NO2 example (`run_mpe_01_no2.py`) calls
+`pyrsig.cmaq.pair_rsigcmaq` for one day at a time. Each day waits for the
+RSIG download, and then for the model extraction. Downloads mostly wait on
+the network, so a pool of threads can run several at once. Model extraction
+uses the CPU, so it runs in a pool of processes. As each download finishes,
+its extraction starts, and results are put back in date order.
+
+The observation source is a "fetcher" (a function of key, bbox, and times),
+so RSIG can be replaced by any URL template. For testing, a local stand-in
+server can serve synthetic observations with a delay like a download.
+
+The basic steps are:
+
+1. Define fetchers (RSIG or a URL template).
+2. Define model extraction (same as pair_rsigcmaq).
+3. Pair one day at a time (serial).
+4. Pair with threads for downloads and processes for extraction.
+5. Compare results and report the speedup.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# Define Analysis
+obssrc = 'airnow'  # or aqs
+obsspc = 'no2'     # or ozone, co, pm25, ...
+modsrc = 'CAMx'    # Or CMAQ
+modspc = 'NO2'     # or O3, CO, PM25, ...
+
+# Set input files
+dates = ['20160610', '20160611']
+avrgtmpl = '../../camx/outputs/CAMx.v7.32.36.12.{}.avrg.grd02.nc'  # placeholder {} for date
+
+# Observation source: 'rsig', 'url', or 'local' (stand-in server)
+fetchsrc = 'rsig'
+# for 'url', a template with key, bdate, and edate (times accept strftime formats)
+urltmpl = 'http://localhost:8000/{key}_{bdate:%Y%m%d}.csv'
+# for 'local', seconds each request waits (like a download)
+localdelay = 2.
+
+# number of download threads and extraction processes
+nthreads = 4
+nprocs = 2
+
+# Outputs
+outstem = f'outputs/{obssrc}.{obsspc}_and_CAMx.v7.32.36.12.avrg.grd02_concurrent'
+pairedpath = outstem + '.csv'
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import functools
+import http.server
+import threading
+import time
+import os
+import numpy as np
+import pandas as pd
+import pyproj
+import pyrsig
+import xarray as xr
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Define Fetchers
+# '''''''''''''''
+# - a fetcher is called as fetcher(key, bbox, bdate, edate) and returns a
+#   DataFrame with time (UTC), LONGITUDE, LATITUDE, STATION, and key
+# - workdir keeps RSIG downloads; separate workdirs keep timings fair
+
+
+class RsigFetcher:
+    def __init__(self, workdir='outputs'):
+        self.workdir = workdir
+
+    def __call__(self, key, bbox, bdate, edate):
+        os.makedirs(self.workdir, exist_ok=True)
+        api = pyrsig.RsigApi(bbox=bbox, workdir=self.workdir)
+        return api.to_dataframe(
+            key, bdate=bdate, edate=edate, unit_keys=False, parse_dates=True
+        )
+
+
+class UrlFetcher:
+    def __init__(self, urltmpl):
+        self.urltmpl = urltmpl
+
+    def __call__(self, key, bbox, bdate, edate):
+        url = self.urltmpl.format(key=key, bdate=bdate, edate=edate)
+        df = pd.read_csv(url)
+        df['time'] = pd.to_datetime(df['time'], utc=True)
+        inbox = (
+            (df['LONGITUDE'] >= bbox[0]) & (df['LONGITUDE'] <= bbox[2])
+            & (df['LATITUDE'] >= bbox[1]) & (df['LATITUDE'] <= bbox[3])
+        )
+        return df.loc[inbox].reset_index(drop=True)
+
+
+# %%
+# Define Model Extraction
+# '''''''''''''''''''''''
+# - getquery finds the bbox and times (same as pair_rsigcmaq)
+# - extract adds model values at the nearest time, row, and column
+# - extract runs in another process, so it opens the file itself
+
+
+def getquery(path):
+    qds = pyrsig.open_ioapi(path)
+    Y, X = xr.broadcast(qds.ROW, qds.COL)
+    qlon, qlat = pyproj.Proj(qds.crs_proj4)(X.values, Y.values, inverse=True)
+    lonb = np.quantile(qlon, [0, 1]) + np.array([-1, 1])
+    latb = np.quantile(qlat, [0, 1]) + np.array([-1, 1])
+    bbox = lonb[0], latb[0], lonb[1], latb[1]
+    times = pd.to_datetime(qds.TSTEP.values)
+    bdate = times[0]
+    edate = times[-1] + (times[-1] - times[-2]) - pd.to_timedelta('1s')
+    return bbox, bdate, edate
+
+
+def extract(path, qkey, df, prefix):
+    qds = pyrsig.open_ioapi(path)
+    proj = pyproj.Proj(qds.crs_proj4)
+    df = df.copy()
+    df['x'], df['y'] = proj(df['LONGITUDE'], df['LATITUDE'])
+    qvar = qds[qkey][:, 0].sel(
+        TSTEP=df['time'].dt.tz_convert(None).to_xarray(),
+        COL=df['x'].to_xarray(),
+        ROW=df['y'].to_xarray(),
+        method='nearest'
+    )
+    df[f'{prefix}{qkey}'] = qvar.values
+    return df
+
+
+# %%
+# Define Pairing Drivers
+# ''''''''''''''''''''''
+# - serial: download, then extract, one day at a time
+# - concurrent: all downloads start at once (up to nthreads); each
+#   extraction is submitted when its download finishes
+
+
+def pair_serial(paths, qkey, datakey, fetcher, prefix):
+    dfs = []
+    for path in paths:
+        df = fetcher(datakey, *getquery(path))
+        dfs.append(extract(path, qkey, df, prefix))
+    return pd.concat(dfs, ignore_index=True)
+
+
+def pair_concurrent(paths, qkey, datakey, fetcher, prefix, nthreads=4, nprocs=2):
+    """
+    Arguments
+    ---------
+    paths : list
+        Model files in date order.
+    qkey : str
+        Model variable.
+    datakey : str
+        Observation key for the fetcher.
+    fetcher : callable
+        fetcher(datakey, bbox, bdate, edate) returns observations.
+    prefix : str
+        Prefix for the model column.
+    nthreads, nprocs : int
+        Download threads and extraction processes.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        Paired observations in the order of paths
+    """
+    queries = {path: getquery(path) for path in paths}
+    with ThreadPoolExecutor(max_workers=nthreads) as tpool:
+        with ProcessPoolExecutor(max_workers=nprocs) as ppool:
+            fetches = {
+                tpool.submit(fetcher, datakey, *queries[path]): path
+                for path in paths
+            }
+            extracts = {}
+            for future in as_completed(fetches):
+                path = fetches[future]
+                extracts[path] = ppool.submit(extract, path, qkey, future.result(), prefix)
+            dfs = [extracts[path].result() for path in paths]
+    return pd.concat(dfs, ignore_index=True)
+
+
+# %%
+# Local Stand-in Server
+# '''''''''''''''''''''
+# - synthetic hourly observations at random locations for each date
+# - columns are named like RSIG with unit_keys=False (e.g., no2)
+# - each request waits localdelay seconds before responding
+
+
+class SlowHandler(http.server.SimpleHTTPRequestHandler):
+    delay = 0.
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_local_server(servedir, delay):
+    handler = functools.partial(SlowHandler, directory=servedir)
+    SlowHandler.delay = delay
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_local_obs(servedir, key, paths, nstation=200):
+    os.makedirs(servedir, exist_ok=True)
+    rng = np.random.default_rng(0)
+    for path in paths:
+        bbox, bdate, edate = getquery(path)
+        outpath = os.path.join(servedir, f'{key}_{bdate:%Y%m%d}.csv')
+        if os.path.exists(outpath):
+            continue
+        lon = rng.uniform(bbox[0] + 1, bbox[2] - 1, nstation)
+        lat = rng.uniform(bbox[1] + 1, bbox[3] - 1, nstation)
+        times = pd.date_range(bdate, edate, freq='1h')
+        df = pd.DataFrame({
+            'time': np.repeat(times.strftime('%Y-%m-%dT%H:%M:%SZ'), nstation),
+            'LONGITUDE': np.tile(lon, times.size),
+            'LATITUDE': np.tile(lat, times.size),
+            'STATION': np.tile(np.arange(nstation) + 10000000, times.size),
+            key.split('.')[-1]: rng.gamma(2, 5, times.size * nstation).round(1),
+        })
+        df.to_csv(outpath, index=False)
+
+
+# %%
+# Pair and Compare
+# ''''''''''''''''
+# - The __main__ check is required on systems that spawn (e.g., Windows).
+
+if __name__ == '__main__':
+    obskey = f'{obssrc}.{obsspc}'  # must exist in RSIG
+    modkey = f'{modsrc}{modspc}'
+    paths = [avrgtmpl.format(datestr) for datestr in dates]
+    if fetchsrc == 'local':
+        servedir = 'outputs/localobs'
+        write_local_obs(servedir, obskey, paths)
+        server = start_local_server(servedir, localdelay)
+        urltmpl = f'http://127.0.0.1:{server.server_address[1]}/{{key}}_{{bdate:%Y%m%d}}.csv'
+
+    fetchers = {}
+    for mode in ['serial', 'concurrent']:
+        if fetchsrc == 'rsig':
+            fetchers[mode] = RsigFetcher(workdir=f'outputs/{mode}')
+        else:
+            fetchers[mode] = UrlFetcher(urltmpl)
+
+    t0 = time.perf_counter()
+    serialdf = pair_serial(paths, modspc, obskey, fetchers['serial'], modsrc)
+    t1 = time.perf_counter()
+    df = pair_concurrent(
+        paths, modspc, obskey, fetchers['concurrent'], modsrc,
+        nthreads=nthreads, nprocs=nprocs
+    )
+    t2 = time.perf_counter()
+    print(f'INFO:: serial {t1 - t0:.2f}s; concurrent {t2 - t1:.2f}s')
+    print(f'INFO:: speedup {(t1 - t0) / (t2 - t1):.2f}x for {len(paths)} days')
+    pd.testing.assert_frame_equal(serialdf, df)
+
+    df[modkey] *= 1000
+    df.rename(columns={obsspc: obskey}, inplace=True)
+    df.to_csv(pairedpath, index=False)
+    print(pyrsig.utils.quickstats(df[[obskey, modkey]], obskey))
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Set dates to a whole month and try nthreads of 1, 4, and 8.
+# 2. Write a fetcher for another source (e.g., a folder of AQS files).
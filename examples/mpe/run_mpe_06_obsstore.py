@@ -0,0 +1,269 @@
+"""
+Keep Observations in a Local Store
+==================================
+
+Save observations in one local SQLite database and only download the hours
+that are not already saved.
+
+The MPE examples ask RSIG for observations every time they run, and leave
+files in `outputs`. Evaluating a new model run for the same dates downloads
+the same data again. This example keeps every observation in a table keyed by
+observation key, station, and hour, and keeps a table of what has already been
+downloaded (key, bbox, and hours). A request is answered from the database,
+and only hours not covered by earlier downloads are fetched. Once a season is
+saved, pairing another model run for that season uses no network.
+
+The basic steps are:
+
+1. Define the store (SQLite tables and indexes).
+2. Get observations for each model file (fetching only gaps).
+3. Pair with the model (same as pair_rsigcmaq).
+4. Repeat, and check that nothing is fetched.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# Define Analysis
+obssrc = 'airnow'  # or aqs
+obsspc = 'no2'     # or ozone, co, pm25, ...
+modsrc = 'CAMx'    # Or CMAQ
+modspc = 'NO2'     # or O3, CO, PM25, ...
+
+# Set input files
+dates = ['20160610', '20160611']
+avrgtmpl = '../../camx/outputs/CAMx.v7.32.36.12.{}.avrg.grd02.nc'  # placeholder {} for date
+
+# Observation source: 'rsig' or 'url' (see `run_mpe_05_concurrent.py`)
+fetchsrc = 'rsig'
+urltmpl = 'http://localhost:8000/{key}_{bdate:%Y%m%d}.csv'
+
+# Store and outputs
+storepath = 'outputs/obsstore.sqlite'
+outstem = f'outputs/{obssrc}.{obsspc}_and_CAMx.v7.32.36.12.avrg.grd02_store'
+pairedpath = outstem + '.csv'
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+from contextlib import closing
+import sqlite3
+import tempfile
+import time
+import os
+import numpy as np
+import pandas as pd
+import pyproj
+import pyrsig
+import xarray as xr
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Define Fetchers
+# '''''''''''''''
+# - fetcher(key, bbox, bdate, edate) returns a DataFrame with time (UTC),
+#   LONGITUDE, LATITUDE, STATION, and the value named like RSIG with
+#   unit_keys=False (e.g., no2 for airnow.no2)
+
+
+def rsig_fetch(key, bbox, bdate, edate):
+    # downloads go to a temporary folder that is removed after loading
+    with tempfile.TemporaryDirectory() as workdir:
+        api = pyrsig.RsigApi(bbox=bbox, workdir=workdir)
+        return api.to_dataframe(
+            key, bdate=bdate, edate=edate, unit_keys=False, parse_dates=True
+        )
+
+
+def url_fetch(key, bbox, bdate, edate):
+    df = pd.read_csv(urltmpl.format(key=key, bdate=bdate, edate=edate))
+    df['time'] = pd.to_datetime(df['time'], utc=True)
+    return df
+
+
+# %%
+# Define the Store
+# ''''''''''''''''
+# - obs: one row per key, STATION, and hour (hours since 1970-01-01 UTC)
+# - coverage: one row per download (key, bbox, first and last hour)
+# - an hour is covered if any download for the key had a bbox that contains
+#   the requested bbox and included that hour
+# - missing hours are grouped into runs, and each run is one fetch
+# - closing() closes each connection; `with conn` commits (or rolls back)
+
+
+epoch = pd.Timestamp('1970-01-01', tz='UTC')
+p1h = pd.to_timedelta('1h')
+
+
+class ObsStore:
+    def __init__(self, path):
+        self.path = path
+        self.nfetch = 0
+        with closing(sqlite3.connect(path)) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS obs (
+                    key TEXT, STATION TEXT, hour INTEGER,
+                    LONGITUDE REAL, LATITUDE REAL, value REAL,
+                    PRIMARY KEY (key, STATION, hour)
+                ) WITHOUT ROWID
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS obs_key_hour ON obs (key, hour)')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS coverage (
+                    key TEXT, west REAL, south REAL, east REAL, north REAL,
+                    bhour INTEGER, ehour INTEGER
+                )
+            """)
+
+    def missing(self, conn, key, bbox, bhour, ehour):
+        """list of (first, last) hours not covered"""
+        covered = np.zeros(ehour - bhour + 1, dtype=bool)
+        rows = conn.execute(
+            'SELECT bhour, ehour FROM coverage WHERE key = ?'
+            ' AND west <= ? AND south <= ? AND east >= ? AND north >= ?'
+            ' AND ehour >= ? AND bhour <= ?',
+            (key, *bbox, bhour, ehour)
+        )
+        for cb, ce in rows:
+            covered[max(cb, bhour) - bhour:min(ce, ehour) - bhour + 1] = True
+        gaps = np.flatnonzero(~covered)
+        if gaps.size == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(gaps) > 1) + 1
+        starts = gaps[np.r_[0, breaks]] + bhour
+        stops = gaps[np.r_[breaks - 1, gaps.size - 1]] + bhour
+        return list(zip(starts.tolist(), stops.tolist()))
+
+    def add(self, conn, key, bbox, bhour, ehour, df):
+        valkey = key.split('.')[-1]
+        hour = (df['time'] - epoch) // p1h
+        rows = pd.DataFrame({
+            'key': key, 'STATION': df['STATION'].astype(str), 'hour': hour,
+            'LONGITUDE': df['LONGITUDE'], 'LATITUDE': df['LATITUDE'],
+            'value': df[valkey],
+        })
+        conn.executemany(
+            'INSERT OR REPLACE INTO obs VALUES (?, ?, ?, ?, ?, ?)',
+            rows.itertuples(index=False, name=None)
+        )
+        conn.execute(
+            'INSERT INTO coverage VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (key, *bbox, bhour, ehour)
+        )
+
+    def get(self, key, bbox, bdate, edate, fetcher=None):
+        """
+        Arguments
+        ---------
+        key : str
+            Observation key (e.g., airnow.no2).
+        bbox : tuple
+            west, south, east, north in decimal degrees.
+        bdate, edate : pandas.Timestamp
+            First and last time (UTC).
+        fetcher : callable
+            fetcher(key, bbox, bdate, edate) for missing hours; if None,
+            only stored observations are returned.
+
+        Returns
+        -------
+        df : pandas.DataFrame
+            time, LONGITUDE, LATITUDE, STATION, and value (named like RSIG)
+        """
+        bbox = tuple(float(v) for v in bbox)
+        bhour = (pd.Timestamp(bdate) - epoch) // p1h
+        ehour = (pd.Timestamp(edate) - epoch) // p1h
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            if fetcher is not None:
+                for fbhour, fehour in self.missing(conn, key, bbox, bhour, ehour):
+                    fbdate = epoch + fbhour * p1h
+                    fedate = epoch + (fehour + 1) * p1h - pd.to_timedelta('1s')
+                    print(f'INFO:: fetching {key} {fbdate} to {fedate}')
+                    df = fetcher(key, bbox, fbdate, fedate)
+                    self.nfetch += 1
+                    self.add(conn, key, bbox, fbhour, fehour, df)
+            df = pd.read_sql_query(
+                'SELECT STATION, hour, LONGITUDE, LATITUDE, value FROM obs'
+                ' WHERE key = ? AND hour BETWEEN ? AND ?'
+                ' AND LONGITUDE BETWEEN ? AND ? AND LATITUDE BETWEEN ? AND ?'
+                ' ORDER BY hour, STATION',
+                conn, params=(key, bhour, ehour, bbox[0], bbox[2], bbox[1], bbox[3])
+            )
+        df.insert(0, 'time', epoch + df.pop('hour') * p1h)
+        return df.rename(columns={'value': key.split('.')[-1]})
+
+
+# %%
+# Define Model Extraction
+# '''''''''''''''''''''''
+# - same as pair_rsigcmaq
+
+
+def getquery(path):
+    qds = pyrsig.open_ioapi(path)
+    Y, X = xr.broadcast(qds.ROW, qds.COL)
+    qlon, qlat = pyproj.Proj(qds.crs_proj4)(X.values, Y.values, inverse=True)
+    lonb = np.quantile(qlon, [0, 1]) + np.array([-1, 1])
+    latb = np.quantile(qlat, [0, 1]) + np.array([-1, 1])
+    bbox = lonb[0], latb[0], lonb[1], latb[1]
+    times = pd.to_datetime(qds.TSTEP.values).tz_localize('UTC')
+    bdate = times[0]
+    edate = times[-1] + (times[-1] - times[-2]) - pd.to_timedelta('1s')
+    return bbox, bdate, edate
+
+
+def extract(path, qkey, df, prefix):
+    qds = pyrsig.open_ioapi(path)
+    proj = pyproj.Proj(qds.crs_proj4)
+    df = df.copy()
+    df['x'], df['y'] = proj(df['LONGITUDE'], df['LATITUDE'])
+    qvar = qds[qkey][:, 0].sel(
+        TSTEP=df['time'].dt.tz_convert(None).to_xarray(),
+        COL=df['x'].to_xarray(),
+        ROW=df['y'].to_xarray(),
+        method='nearest'
+    )
+    df[f'{prefix}{qkey}'] = qvar.values
+    return df
+
+
+# %%
+# Pair Using the Store
+# ''''''''''''''''''''
+# - the first pass fetches any hours not in the store
+# - the second pass (e.g., a new model run) fetches nothing
+
+obskey = f'{obssrc}.{obsspc}'  # must exist in RSIG
+modkey = f'{modsrc}{modspc}'
+fetcher = {'rsig': rsig_fetch, 'url': url_fetch}[fetchsrc]
+store = ObsStore(storepath)
+paths = [avrgtmpl.format(datestr) for datestr in dates]
+
+for label in ['first', 'second']:
+    t0 = time.perf_counter()
+    nfetch = store.nfetch
+    dfs = []
+    for path in paths:
+        obsdf = store.get(obskey, *getquery(path), fetcher=fetcher)
+        dfs.append(extract(path, modspc, obsdf, modsrc))
+    df = pd.concat(dfs, ignore_index=True)
+    t1 = time.perf_counter()
+    print(f'INFO:: {label} pass {t1 - t0:.2f}s with {store.nfetch - nfetch} fetches')
+
+assert store.nfetch - nfetch == 0
+df[modkey] *= 1000
+df.rename(columns={obsspc: obskey}, inplace=True)
+df.to_csv(pairedpath, index=False)
+print(pyrsig.utils.quickstats(df[[obskey, modkey]], obskey))
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Add dates and rerun; only the new dates are fetched.
+# 2. Use store.get as the fetcher in `run_mpe_05_concurrent.py`.
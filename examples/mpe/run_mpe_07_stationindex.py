@@ -0,0 +1,295 @@
+"""
+Reuse Station Locations in the Grid
+===================================
+
+Find each monitor's grid cell and bilinear weights once, save them, and read
+only the needed cells from each model file.
+
+`pyrsig.cmaq.pair_rsigcmaq` projects every observation and selects model
+values with xarray `.sel(..., method='nearest')` for each date and species.
+The monitors are mostly the same every day. This example saves a station
+index for a grid and station list: the nearest cell, the four cells and
+weights for bilinear interpolation, and a read plan. The read plan sorts the
+needed cells by ROW and groups them into runs of COL, so each run is one
+hyperslab read of all hours (netCDF4 fancy indexing is slow). Pairing a new
+file is then a few reads and array lookups.
+
+The basic steps are:
+
+1. Read stations from the paired file made by `run_mpe_01_no2.py`.
+2. Build (or load) the station index for the grid.
+3. Extract nearest and bilinear values with the read plan.
+4. Check the nearest values against pair_rsigcmaq and compare timing.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# Define Analysis
+obssrc = 'airnow'  # or aqs
+obsspc = 'no2'     # or ozone, co, pm25, ...
+modsrc = 'CAMx'    # Or CMAQ
+modspc = 'NO2'     # or O3, CO, PM25, ...
+
+# Set input files
+dates = ['20160610', '20160611']
+avrgtmpl = '../../camx/outputs/CAMx.v7.32.36.12.{}.avrg.grd02.nc'  # placeholder {} for date
+# paired observations from run_mpe_01_no2.py
+obspath = f'outputs/{obssrc}.{obsspc}_and_CAMx.v7.32.36.12.avrg.grd02.csv'
+
+# Outputs
+cachedir = 'outputs/stationindex'
+outstem = f'outputs/{obssrc}.{obsspc}_and_CAMx.v7.32.36.12.avrg.grd02_index'
+pairedpath = outstem + '.csv'
+# unneeded columns allowed inside a read to make fewer, larger reads
+maxgap = 4
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import hashlib
+import time
+import os
+import numpy as np
+import pandas as pd
+import netCDF4
+import pyproj
+import pyrsig
+
+os.makedirs(cachedir, exist_ok=True)
+
+# %%
+# Build the Station Index
+# '''''''''''''''''''''''
+# - nearest cell is the cell that contains the station (edge cell if outside)
+# - bilinear uses the four cell centers around the station (clamped at edges)
+# - needed cells are grouped by ROW into (ROW, COL start, COL stop) runs
+# - each needed cell has a position in the concatenated runs
+# - the index is saved under a hash of the grid, stations, and locations
+
+gridattrkeys = [
+    'GDTYP', 'P_ALP', 'P_BET', 'P_GAM', 'XCENT', 'YCENT',
+    'XORIG', 'YORIG', 'XCELL', 'YCELL', 'NCOLS', 'NROWS',
+]
+
+
+def getproj(attrs):
+    proj4tmpl = '+proj=lcc +lat_0={YCENT} +lon_0={P_GAM}'
+    proj4tmpl += ' +lat_1={P_ALP} +lat_2={P_BET} +R=6370000 +units=m +no_defs'
+    return pyproj.Proj(proj4tmpl.format(**attrs))
+
+
+def readplan(rows, cols, maxgap=0):
+    """
+    Arguments
+    ---------
+    rows, cols : array-like
+        Needed cells (duplicates allowed).
+    maxgap : int
+        Largest number of unneeded columns allowed inside a run.
+
+    Returns
+    -------
+    runs : np.ndarray (nrun, 3)
+        ROW, COL start, COL stop for each read
+    pos : np.ndarray
+        Position of each (rows, cols) in the concatenated reads
+    """
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    cells, inv = np.unique(np.stack([rows.ravel(), cols.ravel()], axis=1), axis=0, return_inverse=True)
+    ur, uc = cells[:, 0], cells[:, 1]
+    newrun = np.r_[True, (np.diff(ur) != 0) | (np.diff(uc) > maxgap + 1)]
+    runid = np.cumsum(newrun) - 1
+    starts = uc[newrun]
+    stops = np.zeros_like(starts)
+    np.maximum.at(stops, runid, uc + 1)
+    runs = np.stack([ur[newrun], starts, stops], axis=1)
+    offsets = np.r_[0, np.cumsum(stops - starts)[:-1]]
+    cellpos = offsets[runid] + uc - starts[runid]
+    return runs, cellpos[inv.ravel()].reshape(rows.shape)
+
+
+def getstationindex(attrs, stndf, cachedir=cachedir, maxgap=maxgap):
+    """
+    Arguments
+    ---------
+    attrs : dict
+        IOAPI grid attributes.
+    stndf : pandas.DataFrame
+        One row per STATION and location (LONGITUDE, LATITUDE).
+    cachedir : str
+        Folder for saved indexes.
+    maxgap : int
+        See readplan.
+
+    Returns
+    -------
+    index : dict
+        STATION, runs, nearest (position), corners (positions), and weights
+        (one entry per stndf row)
+    """
+    gattrs = {k: attrs[k] for k in gridattrkeys}
+    stations = stndf['STATION'].astype(str).to_numpy().astype('U')
+    lon = stndf['LONGITUDE'].to_numpy(dtype='d')
+    lat = stndf['LATITUDE'].to_numpy(dtype='d')
+    h = hashlib.sha256(repr(sorted(gattrs.items())).encode())
+    h.update('\n'.join(stations).encode())
+    h.update(lon.tobytes())
+    h.update(lat.tobytes())
+    h.update(str(maxgap).encode())
+    cachepath = os.path.join(cachedir, h.hexdigest()[:32] + '.npz')
+    if os.path.exists(cachepath):
+        with np.load(cachepath) as npz:
+            return dict(npz)
+
+    ncols, nrows = int(gattrs['NCOLS']), int(gattrs['NROWS'])
+    x, y = getproj(gattrs)(lon, lat)
+    fx = (x - gattrs['XORIG']) / gattrs['XCELL']
+    fy = (y - gattrs['YORIG']) / gattrs['YCELL']
+    ncol = np.clip(np.floor(fx).astype('i'), 0, ncols - 1)
+    nrow = np.clip(np.floor(fy).astype('i'), 0, nrows - 1)
+    # bilinear from cell centers
+    fx = np.clip(fx - 0.5, 0, ncols - 1)
+    fy = np.clip(fy - 0.5, 0, nrows - 1)
+    c0 = np.minimum(np.floor(fx).astype('i'), max(ncols - 2, 0))
+    r0 = np.minimum(np.floor(fy).astype('i'), max(nrows - 2, 0))
+    wx = fx - c0
+    wy = fy - r0
+    c1 = np.minimum(c0 + 1, ncols - 1)
+    r1 = np.minimum(r0 + 1, nrows - 1)
+    crows = np.stack([r0, r0, r1, r1], axis=1)
+    ccols = np.stack([c0, c1, c0, c1], axis=1)
+    weights = np.stack([(1 - wy) * (1 - wx), (1 - wy) * wx, wy * (1 - wx), wy * wx], axis=1)
+    runs, pos = readplan(
+        np.concatenate([nrow[:, None], crows], axis=1),
+        np.concatenate([ncol[:, None], ccols], axis=1), maxgap=maxgap
+    )
+    index = dict(
+        STATION=stations, runs=runs, nearest=pos[:, 0], corners=pos[:, 1:],
+        weights=weights,
+    )
+    tmppath = cachepath + '.tmp'
+    with open(tmppath, 'wb') as tmpf:
+        np.savez(tmpf, **index)
+    os.replace(tmppath, cachepath)
+    return index
+
+
+# %%
+# Extract with the Read Plan
+# ''''''''''''''''''''''''''
+# - one hyperslab read per run for all hours of the first layer
+# - values are (TSTEP, station) arrays
+
+
+def extract_index(path, keys, index):
+    """
+    Arguments
+    ---------
+    path : str
+        IOAPI file (e.g., CAMx avrg).
+    keys : list
+        Variables to extract.
+    index : dict
+        From getstationindex.
+
+    Returns
+    -------
+    hours : np.ndarray
+        Start time of each TSTEP (datetime64[h], UTC)
+    out : dict
+        key: (nearest, bilinear) arrays (TSTEP, station)
+    """
+    out = {}
+    with netCDF4.Dataset(path) as f:
+        yyyyjjj, hhmmss = f['TFLAG'][:, 0, 0], f['TFLAG'][:, 0, 1]
+        hours = (
+            pd.to_datetime(yyyyjjj.astype(str), format='%Y%j')
+            + pd.to_timedelta(hhmmss // 10000, unit='h')
+        ).to_numpy().astype('datetime64[h]')
+        for key in keys:
+            var = f[key]
+            buf = np.concatenate([
+                var[:, 0, row, start:stop] for row, start, stop in index['runs']
+            ], axis=1)
+            nearest = buf[:, index['nearest']]
+            bilinear = (buf[:, index['corners']] * index['weights']).sum(-1)
+            out[key] = nearest, bilinear
+    return hours, out
+
+
+# %%
+# Read Stations and Build the Index
+# '''''''''''''''''''''''''''''''''
+
+obskey = f'{obssrc}.{obsspc}'
+modkey = f'{modsrc}{modspc}'
+obsdf = pd.read_csv(obspath, parse_dates=['time'])
+obsdf['STATION'] = obsdf['STATION'].astype(str)
+# a station that moves has one entry per location
+sitekeys = ['STATION', 'LONGITUDE', 'LATITUDE']
+stndf = obsdf[sitekeys].drop_duplicates(ignore_index=True)
+paths = [avrgtmpl.format(datestr) for datestr in dates]
+with netCDF4.Dataset(paths[0]) as f:
+    attrs = {k: f.getncattr(k) for k in gridattrkeys}
+
+t0 = time.perf_counter()
+index = getstationindex(attrs, stndf)
+t1 = time.perf_counter()
+print(f'INFO:: {stndf.shape[0]} station locations, {len(index["runs"])} reads, {(t1 - t0) * 1e3:.1f}ms')
+
+# %%
+# Pair with the Index
+# '''''''''''''''''''
+# - observation rows are matched to (TSTEP, station) by array lookup
+
+stnidx = pd.MultiIndex.from_frame(stndf).get_indexer(pd.MultiIndex.from_frame(obsdf[sitekeys]))
+obshour = obsdf['time'].dt.tz_convert(None).to_numpy().astype('datetime64[h]')
+obsdf[f'{modkey}_nearest'] = np.nan
+obsdf[f'{modkey}_bilinear'] = np.nan
+t0 = time.perf_counter()
+for path in paths:
+    hours, out = extract_index(path, [modspc], index)
+    tidx = (obshour - hours[0]).astype('i8')
+    inf = (tidx >= 0) & (tidx < hours.size)
+    nearest, bilinear = out[modspc]
+    obsdf.loc[inf, f'{modkey}_nearest'] = nearest[tidx[inf], stnidx[inf]] * 1000
+    obsdf.loc[inf, f'{modkey}_bilinear'] = bilinear[tidx[inf], stnidx[inf]] * 1000
+t1 = time.perf_counter()
+print(f'INFO:: index extraction {t1 - t0:.2f}s for {len(paths)} files')
+
+# %%
+# Compare to pair_rsigcmaq
+# ''''''''''''''''''''''''
+# - the nearest value should match the model value from run_mpe_01_no2.py
+# - the xarray selection is timed on the same observations
+
+assert np.allclose(obsdf[modkey], obsdf[f'{modkey}_nearest'], rtol=1e-6)
+t0 = time.perf_counter()
+for path in paths:
+    qds = pyrsig.open_ioapi(path)
+    times = qds.TSTEP.values
+    fdf = obsdf.loc[(obshour >= times[0]) & (obshour <= times[-1])]
+    x, y = pyproj.Proj(qds.crs_proj4)(fdf['LONGITUDE'], fdf['LATITUDE'])
+    qds[modspc][:, 0].sel(
+        TSTEP=fdf['time'].dt.tz_convert(None).to_xarray(),
+        COL=pd.Series(x, index=fdf.index).to_xarray(),
+        ROW=pd.Series(y, index=fdf.index).to_xarray(),
+        method='nearest'
+    ).values
+t1 = time.perf_counter()
+print(f'INFO:: xarray extraction {t1 - t0:.2f}s for {len(paths)} files')
+obsdf.to_csv(pairedpath, index=False)
+keys = [obskey, modkey, f'{modkey}_nearest', f'{modkey}_bilinear']
+print(pyrsig.utils.quickstats(obsdf[keys], obskey))
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Extract NO2, O3, and CO with one extract_index call.
+# 2. Try maxgap of 0, 4, and 100; how many reads are there?
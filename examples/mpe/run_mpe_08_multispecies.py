@@ -0,0 +1,237 @@
+"""
+Pair Many Species in One Pass
+=============================
+
+Pair several observed species with CAMx while opening each model file once,
+and save one long table (one row per observation).
+
+The hourly NO2 (`run_mpe_01_no2.py`) and MDA8 (`run_mpe_02_o3mda8.py`)
+examples pair one model species with one observed species, and convert units
+with `*= 1000`. Evaluating NO2, O3, and CO that way opens each model file
+once per species. This example uses a species map (model key to observation
+key and unit factor). For each day, it gets every observed species, finds the
+cells with monitors once, opens the model file once, and reads every mapped
+species at those cells with one hyperslab read per run of columns.
+
+The basic steps are:
+
+1. Define the species map.
+2. Get observations for each mapped species.
+3. Read all mapped species at monitor cells in one pass over the model file.
+4. Save a long table and statistics by species.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# model key: (observation key, factor to convert model to observation units)
+# add PM25 only if it is in the model file (e.g., 'PM25': ('airnow.pm25', 1))
+specmap = {
+    'NO2': ('airnow.no2', 1000),  # ppm to ppb
+    'O3': ('airnow.ozone', 1000),  # ppm to ppb
+    'CO': ('airnow.co', 1),  # ppm to ppm
+}
+
+# Set input files
+dates = ['20160610', '20160611']
+avrgtmpl = '../../camx/outputs/CAMx.v7.32.36.12.{}.avrg.grd02.nc'  # placeholder {} for date
+
+# Observation source: 'rsig' or 'url' (see `run_mpe_05_concurrent.py`)
+fetchsrc = 'rsig'
+urltmpl = 'http://localhost:8000/{key}_{bdate:%Y%m%d}.csv'
+
+# Outputs
+outstem = 'outputs/airnow_and_CAMx.v7.32.36.12.avrg.grd02_long'
+pairedpath = outstem + '.csv'
+statspath = outstem + '_stats.csv'
+# unneeded columns allowed inside a read to make fewer, larger reads
+maxgap = 4
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import tempfile
+import time
+import os
+import numpy as np
+import pandas as pd
+import netCDF4
+import pyproj
+import pyrsig
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Define Fetchers
+# '''''''''''''''
+# - same as `run_mpe_06_obsstore.py`
+# - fetcher(key, bbox, bdate, edate) returns a DataFrame with time (UTC),
+#   LONGITUDE, LATITUDE, STATION, and the value named like RSIG with
+#   unit_keys=False (e.g., no2 for airnow.no2)
+
+
+def rsig_fetch(key, bbox, bdate, edate):
+    # downloads go to a temporary folder that is removed after loading
+    with tempfile.TemporaryDirectory() as workdir:
+        api = pyrsig.RsigApi(bbox=bbox, workdir=workdir)
+        return api.to_dataframe(
+            key, bdate=bdate, edate=edate, unit_keys=False, parse_dates=True
+        )
+
+
+def url_fetch(key, bbox, bdate, edate):
+    df = pd.read_csv(urltmpl.format(key=key, bdate=bdate, edate=edate))
+    df['time'] = pd.to_datetime(df['time'], utc=True)
+    return df
+
+
+# %%
+# Define One-Pass Pairing
+# '''''''''''''''''''''''
+# - the grid, bbox, and hours come from the file (netCDF4, no xarray)
+# - monitor cells are the cells that contain each station (edge if outside)
+# - needed cells are sorted and grouped by ROW into runs of COL with readplan
+#   from `run_mpe_07_stationindex.py`
+# - every mapped species is read with the same runs
+
+
+def getproj(attrs):
+    proj4tmpl = '+proj=lcc +lat_0={YCENT} +lon_0={P_GAM}'
+    proj4tmpl += ' +lat_1={P_ALP} +lat_2={P_BET} +R=6370000 +units=m +no_defs'
+    return pyproj.Proj(proj4tmpl.format(**attrs))
+
+
+def readplan(rows, cols, maxgap=0):
+    """
+    Arguments
+    ---------
+    rows, cols : array-like
+        Needed cells (duplicates allowed).
+    maxgap : int
+        Largest number of unneeded columns allowed inside a run.
+
+    Returns
+    -------
+    runs : np.ndarray (nrun, 3)
+        ROW, COL start, COL stop for each read
+    pos : np.ndarray
+        Position of each (rows, cols) in the concatenated reads
+    """
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    cells, inv = np.unique(np.stack([rows.ravel(), cols.ravel()], axis=1), axis=0, return_inverse=True)
+    ur, uc = cells[:, 0], cells[:, 1]
+    newrun = np.r_[True, (np.diff(ur) != 0) | (np.diff(uc) > maxgap + 1)]
+    runid = np.cumsum(newrun) - 1
+    starts = uc[newrun]
+    stops = np.zeros_like(starts)
+    np.maximum.at(stops, runid, uc + 1)
+    runs = np.stack([ur[newrun], starts, stops], axis=1)
+    offsets = np.r_[0, np.cumsum(stops - starts)[:-1]]
+    cellpos = offsets[runid] + uc - starts[runid]
+    return runs, cellpos[inv.ravel()].reshape(rows.shape)
+
+
+def getquery(f):
+    """bbox, bdate, edate, and hours (datetime64[h]) for an open IOAPI file"""
+    attrs = {k: f.getncattr(k) for k in f.ncattrs()}
+    x = attrs['XORIG'] + (np.arange(attrs['NCOLS']) + 0.5) * attrs['XCELL']
+    y = attrs['YORIG'] + (np.arange(attrs['NROWS']) + 0.5) * attrs['YCELL']
+    lon, lat = getproj(attrs)(*np.meshgrid(x, y), inverse=True)
+    bbox = lon.min() - 1, lat.min() - 1, lon.max() + 1, lat.max() + 1
+    yyyyjjj, hhmmss = f['TFLAG'][:, 0, 0], f['TFLAG'][:, 0, 1]
+    times = (
+        pd.to_datetime(yyyyjjj.astype(str), format='%Y%j')
+        + pd.to_timedelta(hhmmss // 10000, unit='h')
+    ).tz_localize('UTC')
+    bdate = times[0]
+    edate = times[-1] + (times[-1] - times[-2]) - pd.to_timedelta('1s')
+    return bbox, bdate, edate, times.tz_convert(None).to_numpy().astype('datetime64[h]')
+
+
+def pair_file(path, specmap, fetcher, maxgap=maxgap):
+    """
+    Arguments
+    ---------
+    path : str
+        IOAPI file (e.g., CAMx avrg).
+    specmap : dict
+        model key: (observation key, factor)
+    fetcher : callable
+        fetcher(key, bbox, bdate, edate) returns observations.
+    maxgap : int
+        Largest number of unneeded columns inside one read.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        Long table with time, STATION, LONGITUDE, LATITUDE, model_key,
+        obs_key, obs, and mod
+    """
+    with netCDF4.Dataset(path) as f:
+        attrs = {k: f.getncattr(k) for k in f.ncattrs()}
+        bbox, bdate, edate, hours = getquery(f)
+        dfs = []
+        for modkey, (obskey, factor) in specmap.items():
+            odf = fetcher(obskey, bbox, bdate, edate)
+            odf = odf[['time', 'STATION', 'LONGITUDE', 'LATITUDE', obskey.split('.')[-1]]]
+            odf = odf.rename(columns={obskey.split('.')[-1]: 'obs'})
+            dfs.append(odf.assign(model_key=modkey, obs_key=obskey))
+        df = pd.concat(dfs, ignore_index=True)
+
+        # monitor cells for all species at once
+        x, y = getproj(attrs)(df['LONGITUDE'].to_numpy(), df['LATITUDE'].to_numpy())
+        col = np.clip(np.floor((x - attrs['XORIG']) / attrs['XCELL']).astype('i'), 0, attrs['NCOLS'] - 1)
+        row = np.clip(np.floor((y - attrs['YORIG']) / attrs['YCELL']).astype('i'), 0, attrs['NROWS'] - 1)
+        runs, pos = readplan(row, col, maxgap=maxgap)
+        tidx = (df['time'].dt.tz_convert(None).to_numpy().astype('datetime64[h]') - hours[0]).astype('i8')
+        inf = (tidx >= 0) & (tidx < hours.size)
+
+        # one pass: every species with the same reads
+        df['mod'] = np.nan
+        for modkey, (obskey, factor) in specmap.items():
+            var = f[modkey]
+            buf = np.concatenate([
+                var[:, 0, r, s:e] for r, s, e in runs
+            ], axis=1)
+            isspc = inf & (df['model_key'] == modkey).to_numpy()
+            df.loc[isspc, 'mod'] = buf[tidx[isspc], pos[isspc]] * factor
+    return df
+
+
+# %%
+# Pair All Days
+# '''''''''''''
+
+fetcher = {'rsig': rsig_fetch, 'url': url_fetch}[fetchsrc]
+t0 = time.perf_counter()
+dfs = []
+for datestr in dates:
+    path = avrgtmpl.format(datestr)
+    dfs.append(pair_file(path, specmap, fetcher))
+    print(f'INFO:: {path} paired {dfs[-1].shape[0]} observations')
+df = pd.concat(dfs, ignore_index=True)
+t1 = time.perf_counter()
+print(f'INFO:: {len(specmap)} species x {len(dates)} days in {t1 - t0:.2f}s')
+df.to_csv(pairedpath, index=False)
+
+# %%
+# Statistics by Species
+# '''''''''''''''''''''
+
+statsdf = pd.concat({
+    modkey: pyrsig.utils.quickstats(sdf[['obs', 'mod']], 'obs')
+    for modkey, sdf in df.groupby('model_key')
+}, axis=1)
+statsdf.to_csv(statspath)
+print(statsdf)
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Add PM25 to the model file and the species map.
+# 2. Use the station index from `run_mpe_07_stationindex.py` for all days.
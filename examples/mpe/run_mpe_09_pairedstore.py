@@ -0,0 +1,230 @@
+"""
+Store Paired Data by Key and Month
+==================================
+
+Save paired observations and model values in Parquet files partitioned by
+observation key and month, add new days without rewriting old files, and read
+back only the stations, times, or counties needed.
+
+The MPE examples save paired data with `df.to_csv(pairedpath)`. Every new
+analysis reads and parses the whole CSV, including the time zone aware time
+column, which takes minutes for a year of hourly data. This example writes one
+Parquet file per observation key and day in folders like
+`obs_key=airnow.no2/month=201606/`. Adding a day writes (or replaces) one
+file. Reading uses pyarrow.dataset, which skips folders that cannot match a
+filter (obs_key, month) and uses statistics inside each file for the rest
+(STATION, time, COUNTYFP).
+
+The basic steps are:
+
+1. Append the long table from `run_mpe_08_multispecies.py` to the store.
+2. Read with filters on key, station, time, and county.
+3. Benchmark a synthetic year against CSV.
+
+*Reminder*: You must have already activated your python environment.
+*Reminder*: This example requires pyarrow (see requirements.txt).
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# long paired table from run_mpe_08_multispecies.py
+longpath = 'outputs/airnow_and_CAMx.v7.32.36.12.avrg.grd02_long.csv'
+# store folder
+storedir = 'outputs/pairedstore'
+
+# Benchmark size (set nbenchstation to 0 to skip)
+nbenchstation = 500
+nbenchhour = 8760
+benchdir = 'outputs/pairedstore_bench'
+benchcsv = 'outputs/pairedstore_bench.csv'
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import shutil
+import time
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pyrsig
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Define Append
+# '''''''''''''
+# - one file per obs_key and UTC day: obs_key=<key>/month=<YYYYMM>/<YYYYMMDD>.parquet
+# - appending to a day that is already stored merges with that day's file;
+#   new rows replace stored rows with the same STATION and time
+# - rows are sorted by STATION and time so that row group statistics can
+#   skip data when filtering on STATION
+# - COUNTYFP is the first 5 characters of STATION (as in run_mpe_02_o3mda8.py)
+
+
+def append_pairs(df, storedir, rowgroupsize=100000):
+    """
+    Arguments
+    ---------
+    df : pandas.DataFrame
+        Long paired table with time (UTC), STATION, obs_key, and values.
+    storedir : str
+        Store folder.
+    rowgroupsize : int
+        Rows per row group.
+
+    Returns
+    -------
+    paths : list
+        Files written
+    """
+    df = df.copy()
+    df['STATION'] = df['STATION'].astype(str)
+    if 'COUNTYFP' not in df.columns:
+        df['COUNTYFP'] = df['STATION'].str[:5]
+    df['time'] = pd.to_datetime(df['time'], utc=True)
+    utcday = df['time'].dt.normalize()
+    paths = []
+    for (obskey, day), ddf in df.groupby(['obs_key', utcday]):
+        daystr = day.strftime('%Y%m%d')
+        outdir = os.path.join(storedir, f'obs_key={obskey}', f'month={daystr[:6]}')
+        os.makedirs(outdir, exist_ok=True)
+        outpath = os.path.join(outdir, f'{daystr}.parquet')
+        ddf = ddf.drop(columns=['obs_key'])
+        if os.path.exists(outpath):
+            # partitioning=None: obs_key and month are not added from the path
+            olddf = pq.read_table(outpath, partitioning=None).to_pandas()
+            ddf = pd.concat([olddf, ddf], ignore_index=True)
+            ddf = ddf.drop_duplicates(['STATION', 'time'], keep='last')
+        ddf = ddf.sort_values(['STATION', 'time'])
+        table = pa.Table.from_pandas(ddf, preserve_index=False)
+        # a leading . is ignored by pyarrow.dataset, so an interrupted write
+        # is not read as a partition file
+        tmppath = os.path.join(outdir, f'.{daystr}.parquet.tmp')
+        pq.write_table(table, tmppath, row_group_size=rowgroupsize)
+        os.replace(tmppath, outpath)
+        paths.append(outpath)
+    return paths
+
+
+# %%
+# Define Read
+# '''''''''''
+# - obs_key and month come from the folder names (hive partitioning)
+# - a time range is also converted to a month range so folders are skipped
+
+
+def read_pairs(storedir, obs_key=None, stations=None, bdate=None, edate=None, countyfp=None, columns=None):
+    """
+    Arguments
+    ---------
+    storedir : str
+        Store folder.
+    obs_key : str or list
+        Observation keys.
+    stations, countyfp : list
+        STATION or COUNTYFP values.
+    bdate, edate : str or pandas.Timestamp
+        First and last time (UTC).
+    columns : list
+        Columns to read (default all).
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        Matching pairs
+    """
+    def utc(t):
+        t = pd.Timestamp(t)
+        return t.tz_localize('UTC') if t.tzinfo is None else t.tz_convert('UTC')
+
+    dataset = ds.dataset(storedir, format='parquet', partitioning='hive')
+    expr = ds.scalar(True)
+    if obs_key is not None:
+        expr &= ds.field('obs_key').isin(np.atleast_1d(obs_key).tolist())
+    if stations is not None:
+        expr &= ds.field('STATION').isin([str(s) for s in stations])
+    if countyfp is not None:
+        expr &= ds.field('COUNTYFP').isin([str(c) for c in countyfp])
+    if bdate is not None:
+        bdate = utc(bdate)
+        expr &= (ds.field('time') >= pa.scalar(bdate, type=pa.timestamp('ns', 'UTC')))
+        expr &= (ds.field('month') >= int(bdate.strftime('%Y%m')))
+    if edate is not None:
+        edate = utc(edate)
+        expr &= (ds.field('time') <= pa.scalar(edate, type=pa.timestamp('ns', 'UTC')))
+        expr &= (ds.field('month') <= int(edate.strftime('%Y%m')))
+    return dataset.to_table(filter=expr, columns=columns).to_pandas()
+
+
+# %%
+# Append and Query
+# ''''''''''''''''
+
+longdf = pd.read_csv(longpath)
+paths = append_pairs(longdf, storedir)
+print(f'INFO:: wrote {len(paths)} files to {storedir}')
+
+t0 = time.perf_counter()
+no2df = read_pairs(storedir, obs_key='airnow.no2')
+t1 = time.perf_counter()
+print(f'INFO:: {no2df.shape[0]} airnow.no2 pairs in {(t1 - t0) * 1e3:.1f}ms')
+print(pyrsig.utils.quickstats(no2df[['obs', 'mod']], 'obs'))
+
+countyfp = no2df['COUNTYFP'].iloc[:1].tolist()
+cntydf = read_pairs(
+    storedir, countyfp=countyfp, bdate=no2df['time'].min(),
+    edate=no2df['time'].min() + pd.to_timedelta('11h'),
+)
+print(f'INFO:: {cntydf.shape[0]} pairs for COUNTYFP {countyfp} in the first 12h')
+
+# %%
+# Benchmark
+# '''''''''
+# - a synthetic year of hourly pairs for one key
+# - the CSV is read with parse_dates like the MPE examples
+# - the store is read whole, and for one station
+
+if nbenchstation > 0:
+    rng = np.random.default_rng(0)
+    times = pd.date_range('2016-01-01', periods=nbenchhour, freq='1h', tz='UTC')
+    stations = np.arange(nbenchstation) * 1000 + 370010001
+    benchdf = pd.DataFrame({
+        'time': np.repeat(times, nbenchstation),
+        'STATION': np.tile(stations, nbenchhour).astype(str),
+        'LONGITUDE': np.tile(rng.uniform(-90, -75, nbenchstation), nbenchhour),
+        'LATITUDE': np.tile(rng.uniform(30, 40, nbenchstation), nbenchhour),
+        'obs': rng.gamma(2, 5, nbenchstation * nbenchhour),
+        'mod': rng.gamma(2, 5, nbenchstation * nbenchhour),
+        'obs_key': 'aqs.no2',
+    })
+    print(f'INFO:: benchmark {benchdf.shape[0]} pairs')
+    shutil.rmtree(benchdir, ignore_errors=True)
+    t0 = time.perf_counter()
+    append_pairs(benchdf, benchdir)
+    t1 = time.perf_counter()
+    benchdf.to_csv(benchcsv, index=False)
+    t2 = time.perf_counter()
+    print(f'INFO:: write store {t1 - t0:.2f}s; write csv {t2 - t1:.2f}s')
+
+    t0 = time.perf_counter()
+    csvdf = pd.read_csv(benchcsv, parse_dates=['time'])
+    t1 = time.perf_counter()
+    storedf = read_pairs(benchdir)
+    t2 = time.perf_counter()
+    stndf = read_pairs(benchdir, stations=stations[:1])
+    t3 = time.perf_counter()
+    print(f'INFO:: read csv {t1 - t0:.2f}s; store {t2 - t1:.2f}s; one station {t3 - t2:.2f}s')
+    assert storedf.shape[0] == csvdf.shape[0]
+    assert stndf.shape[0] == nbenchhour
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Append each day as it is paired in `run_mpe_08_multispecies.py`.
+# 2. Compute MDA8 from read_pairs(storedir, obs_key='airnow.ozone').
@@ -0,0 +1,279 @@
+"""
+Update Statistics One Day at a Time
+===================================
+
+Keep running sums for model performance statistics, so each new day updates
+the statistics without reloading earlier days.
+
+The MPE examples call `pyrsig.utils.quickstats` on all paired data at once.
+All days must fit in memory, and adding a day means starting over. This
+example keeps an accumulator of counts and sums (obs, mod, squares,
+cross-products, absolute and squared errors) for each station, each day, and
+the whole domain. Accumulators can be added together (e.g., from different
+processes or runs) and saved as JSON. MB, NMB, FMB, NME, RMSE, r, and IOA are
+calculated from the sums and match quickstats.
+
+IOA needs the sum of (|mod - mean(obs)| + |obs - mean(obs)|)^2, and the mean
+is not known until all days are in. The squared terms come from the sums; the
+cross term 2|mod - mean(obs)||obs - mean(obs)| is kept in a sparse 2D
+histogram of (obs, mod) with n, sum(obs), sum(mod), and sum(obs * mod) in
+each bin. It is exact except in bins that contain mean(obs), where the sign is
+taken from the bin mean. ioa_bound is the largest possible IOA error from
+those bins (about 0.001 in this example).
+
+The basic steps are:
+
+1. Define the accumulator.
+2. Update station, day, and domain accumulators one day at a time.
+3. Save, reload, and merge accumulators.
+4. Compare to quickstats.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# long paired table from run_mpe_08_multispecies.py
+longpath = 'outputs/airnow_and_CAMx.v7.32.36.12.avrg.grd02_long.csv'
+# width of IOA bins in observation units for each model key; bins near
+# mean(obs) set ioa_bound, so use about 1-5% of a typical value
+binwidths = {'NO2': 0.5, 'O3': 1., 'CO': 0.005}
+# saved accumulators
+accpath = 'outputs/airnow_and_CAMx.v7.32.36.12.avrg.grd02_accumulators.json'
+statspath = 'outputs/airnow_and_CAMx.v7.32.36.12.avrg.grd02_streamstats.csv'
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyrsig
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Define the Accumulator
+# ''''''''''''''''''''''
+# - update adds pairs (rows with a missing obs or mod are skipped)
+# - merge (or +) adds another accumulator with the same binwidth
+# - to_dict/from_dict make JSON-ready dictionaries
+# - stats returns a quickstats-like table (no quantiles) plus nme, rmse, and
+#   ioa_bound; it is all NaN with no pairs (std and r need 2 pairs)
+
+sumkeys = ['n', 'so', 'sm', 'soo', 'smm', 'som', 'sae', 'sse']
+statrows = [
+    'count', 'mean', 'std', 'min', 'max', 'r', 'mb', 'nmb', 'fmb',
+    'ioa', 'nme', 'rmse', 'ioa_bound',
+]
+binoffset = 2**30
+
+
+class StatsAccumulator:
+    def __init__(self, binwidth=1.):
+        self.binwidth = binwidth
+        self.sums = dict.fromkeys(sumkeys, 0.)
+        self.mins = [np.inf, np.inf]
+        self.maxs = [-np.inf, -np.inf]
+        # bin key (i * 2^31 + j) and [n, so, sm, som] for each bin
+        self.binkeys = np.zeros(0, dtype='i8')
+        self.binvals = np.zeros((0, 4))
+
+    def _addbins(self, keys, vals):
+        keys = np.concatenate([self.binkeys, keys])
+        vals = np.concatenate([self.binvals, vals])
+        self.binkeys, inv = np.unique(keys, return_inverse=True)
+        self.binvals = np.stack([
+            np.bincount(inv, weights=vals[:, k], minlength=self.binkeys.size)
+            for k in range(4)
+        ], axis=1)
+
+    def update(self, obs, mod):
+        obs = np.asarray(obs, dtype='d')
+        mod = np.asarray(mod, dtype='d')
+        ok = np.isfinite(obs) & np.isfinite(mod)
+        o, m = obs[ok], mod[ok]
+        if o.size == 0:
+            return self
+        err = m - o
+        for key, val in zip(sumkeys, [
+            o.size, o.sum(), m.sum(), (o * o).sum(), (m * m).sum(),
+            (o * m).sum(), np.abs(err).sum(), (err * err).sum()
+        ]):
+            self.sums[key] += val
+        self.mins = [min(self.mins[0], o.min()), min(self.mins[1], m.min())]
+        self.maxs = [max(self.maxs[0], o.max()), max(self.maxs[1], m.max())]
+        i = np.floor(o / self.binwidth).astype('i8') + binoffset
+        j = np.floor(m / self.binwidth).astype('i8') + binoffset
+        keys, inv = np.unique(i * 2**31 + j, return_inverse=True)
+        vals = np.stack([
+            np.bincount(inv, weights=w, minlength=keys.size)
+            for w in [np.ones_like(o), o, m, o * m]
+        ], axis=1)
+        self._addbins(keys, vals)
+        return self
+
+    def merge(self, other):
+        if other.binwidth != self.binwidth:
+            raise ValueError('binwidth must match to merge')
+        for key in sumkeys:
+            self.sums[key] += other.sums[key]
+        self.mins = list(np.minimum(self.mins, other.mins))
+        self.maxs = list(np.maximum(self.maxs, other.maxs))
+        self._addbins(other.binkeys, other.binvals)
+        return self
+
+    def __add__(self, other):
+        return StatsAccumulator(self.binwidth).merge(self).merge(other)
+
+    def to_dict(self):
+        return dict(
+            binwidth=self.binwidth, sums=self.sums,
+            mins=[float(v) for v in self.mins], maxs=[float(v) for v in self.maxs],
+            binkeys=self.binkeys.tolist(), binvals=self.binvals.tolist(),
+        )
+
+    @classmethod
+    def from_dict(cls, d):
+        acc = cls(d['binwidth'])
+        acc.sums = dict(d['sums'])
+        acc.mins = list(d['mins'])
+        acc.maxs = list(d['maxs'])
+        acc.binkeys = np.array(d['binkeys'], dtype='i8')
+        acc.binvals = np.array(d['binvals'], dtype='d').reshape(-1, 4)
+        return acc
+
+    def ioa_parts(self):
+        """IOA numerator, denominator, and largest denominator error"""
+        s = self.sums
+        n = s['n']
+        ob = s['so'] / n
+        # sum (m - ob)^2 + sum (o - ob)^2
+        sqdev = s['smm'] - 2 * ob * s['sm'] + s['soo'] - 2 * ob * s['so'] + 2 * n * ob**2
+        w = self.binwidth
+        i = self.binkeys // 2**31 - binoffset
+        j = self.binkeys % 2**31 - binoffset
+        bn, bo, bm, bom = self.binvals.T
+        # sum (m - ob)(o - ob) in each bin, and sign from bin means
+        prod = bom - ob * (bo + bm) + bn * ob**2
+        sign = np.sign(bo - bn * ob) * np.sign(bm - bn * ob)
+        cross = 2 * (sign * prod).sum()
+        # bins containing ob: |o - ob| < w (or |m - ob| < w) for every pair
+        ostraddle = (i * w < ob) & ((i + 1) * w > ob)
+        mstraddle = (j * w < ob) & ((j + 1) * w > ob)
+        mdist = np.maximum(np.abs(j * w - ob), np.abs((j + 1) * w - ob))
+        odist = np.maximum(np.abs(i * w - ob), np.abs((i + 1) * w - ob))
+        bound = 4 * w * (bn * mdist)[ostraddle].sum() + 4 * w * (bn * odist)[mstraddle].sum()
+        return s['sse'], sqdev + cross, bound
+
+    def stats(self, names=('obs', 'mod')):
+        oname, mname = names
+        if self.sums['n'] == 0:
+            return pd.DataFrame(np.nan, index=statrows, columns=[oname, mname])
+        # numpy floats give NaN or inf (not errors) for n=1 or zero variance
+        s = {key: np.float64(val) for key, val in self.sums.items()}
+        n = s['n']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mo, mm = s['so'] / n, s['sm'] / n
+            vo = (s['soo'] - n * mo**2) / (n - 1) if n > 1 else np.nan
+            vm = (s['smm'] - n * mm**2) / (n - 1) if n > 1 else np.nan
+            cov = (s['som'] - n * mo * mm) / (n - 1) if n > 1 else np.nan
+            mb = mm - mo
+            sse, den, bound = self.ioa_parts()
+            ioa = 1 - sse / den
+            ioa_bound = sse * bound / (den * (den - bound)) if den > bound else np.inf
+            r = cov / (vo * vm)**.5
+            nmb = mb / mo
+            fmb = 2 * mb / (mo + mm)
+            nme = s['sae'] / s['so']
+        return pd.DataFrame({
+            oname: [n, mo, vo**.5, self.mins[0], self.maxs[0], 1., 0., 0., 0., 1., 0., 0., 0.],
+            mname: [
+                n, mm, vm**.5, self.mins[1], self.maxs[1], r,
+                mb, nmb, fmb, ioa, nme, (sse / n)**.5, ioa_bound,
+            ],
+        }, index=statrows)
+
+
+# %%
+# Update One Day at a Time
+# ''''''''''''''''''''''''
+# - in a real evaluation, each day comes from pairing (e.g., pair_file in
+#   `run_mpe_08_multispecies.py`); here days are read from the long table
+# - accumulators are kept by (model_key, STATION), (model_key, day), and
+#   model_key (domain)
+# - station and day accumulators are only kept once they have pairs (e.g.,
+#   mod is NaN outside the model file hours)
+
+longdf = pd.read_csv(longpath, parse_dates=['time'])
+longdf['day'] = longdf['time'].dt.strftime('%Y-%m-%d')
+stnacc = {}
+dayacc = {}
+domacc = {}
+for day, ddf in longdf.groupby('day'):
+    for modkey, sdf in ddf.groupby('model_key'):
+        binwidth = binwidths[modkey]
+        dacc = StatsAccumulator(binwidth).update(sdf['obs'], sdf['mod'])
+        if dacc.sums['n'] > 0:
+            dayacc[modkey, day] = dacc
+        domacc[modkey] = domacc.get(modkey, StatsAccumulator(binwidth)).merge(dacc)
+        for stn, stndf in sdf.groupby('STATION'):
+            acc = StatsAccumulator(binwidth).update(stndf['obs'], stndf['mod'])
+            if acc.sums['n'] == 0:
+                continue
+            key = (modkey, str(stn))
+            stnacc[key] = stnacc[key].merge(acc) if key in stnacc else acc
+    print(f'INFO:: {day} added')
+
+# %%
+# Save, Reload, and Merge
+# '''''''''''''''''''''''
+# - keys are joined with | so that they can be JSON keys
+# - the domain is also the sum of the reloaded day accumulators
+
+with open(accpath, 'w') as jf:
+    json.dump({
+        kind: {'|'.join(k): acc.to_dict() for k, acc in accs.items()}
+        for kind, accs in [('station', stnacc), ('day', dayacc)]
+    }, jf)
+
+with open(accpath) as jf:
+    saved = json.load(jf)
+
+reloaded = {}
+for key, d in saved['day'].items():
+    modkey, day = key.split('|')
+    acc = StatsAccumulator.from_dict(d)
+    reloaded[modkey] = reloaded[modkey] + acc if modkey in reloaded else acc
+
+# %%
+# Compare to quickstats
+# '''''''''''''''''''''
+
+rows = ['count', 'mean', 'std', 'min', 'max', 'r', 'mb', 'nmb', 'fmb', 'ioa']
+statsdfs = {}
+for modkey, sdf in longdf.groupby('model_key'):
+    refdf = pyrsig.utils.quickstats(sdf[['obs', 'mod']].dropna(), 'obs')
+    statsdf = domacc[modkey].stats()
+    print(f'INFO:: {modkey}')
+    print(pd.concat({'quickstats': refdf.loc[rows, 'mod'], 'streaming': statsdf['mod']}, axis=1))
+    assert np.allclose(refdf.loc[rows[:-1]], statsdf.loc[rows[:-1]], rtol=1e-6)
+    assert abs(refdf.loc['ioa', 'mod'] - statsdf.loc['ioa', 'mod']) <= statsdf.loc['ioa_bound', 'mod'] + 1e-9
+    assert np.allclose(reloaded[modkey].stats(), statsdf)
+    statsdfs[modkey] = statsdf
+
+pd.concat(statsdfs, axis=1).to_csv(statspath)
+
+# station statistics (e.g., NMB by station)
+stnnmb = pd.Series({k: acc.stats().loc['nmb', 'mod'] for k, acc in stnacc.items()})
+print(stnnmb.groupby(level=0).describe())
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Add tomorrow's pairs to the saved accumulators instead of re-pairing.
+# 2. Accumulate in worker processes and merge the to_dict results.
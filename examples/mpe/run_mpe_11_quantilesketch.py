@@ -0,0 +1,323 @@
+"""
+Time-Series Quantiles with a Sketch
+===================================
+
+Plot median and interquartile range time series from a small quantile sketch
+for each time bin and series, instead of keeping every paired value.
+
+The hourly NO2 (`run_mpe_01_no2.py`) and MDA8 (`run_mpe_02_o3mda8.py`)
+figures call `gb.median()`, `gb.quantile(.75)`, and `gb.quantile(.25)` on the
+whole paired DataFrame, so every value for every network and year must be in
+memory and each group is sorted three times. This example keeps a KLL sketch
+(Karnin, Lang, and Liberty 2016) for each time bin and series. A sketch keeps
+values in levels; a value in level h stands for 2^h values. When a level is
+full, it is sorted and every other value (random start) moves up a level. A
+sketch with k=200 never holds more than about 3k values plus one per level,
+no matter how many values are added. Sketches from different days or workers
+merge by joining levels. All requested quantiles come from one sort.
+
+Error bounds (ranks are normalized by the count, so 0.01 is 1 percentile):
+
+* Until a sketch first compacts (fewer than about k values), quantiles are
+  exact and match pandas (linear interpolation).
+* rank_error() is a guaranteed bound: each compaction at level h can move any
+  rank by at most 2^h, and the sketch adds these up (merges add them too).
+  Interpolating between stored values can add up to the largest weight
+  (2^h of the top level), which is included.
+* The random start makes compaction errors cancel, so actual errors are
+  much smaller than the bound; with k=200 they are usually below 0.01, and
+  this example checks that against exact quantiles.
+
+The basic steps are:
+
+1. Define the sketch.
+2. Update sketches by time bin and series one day at a time.
+3. Compare to pandas quantiles and plot.
+4. Merge sketches from workers and check the error on a synthetic year.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# long paired table from run_mpe_08_multispecies.py
+longpath = 'outputs/airnow_and_CAMx.v7.32.36.12.avrg.grd02_long.csv'
+modkey = 'NO2'
+# time bin (e.g., '1h' as in run_mpe_01_no2.py, '1D', or '7D')
+binfreq = '1h'
+# sketch size: larger k is more accurate and uses more memory
+k = 200
+quantiles = [.25, .5, .75]
+figpath = 'outputs/airnow_and_CAMx.v7.32.36.12.avrg.grd02_sketch.png'
+
+# Synthetic year (set nbenchstation to 0 to skip)
+nbenchstation = 500
+nbenchday = 365
+nworker = 4
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import time
+import os
+import numpy as np
+import pandas as pd
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Define the Sketch
+# '''''''''''''''''
+# - level h holds values that each stand for 2^h values
+# - the top level holds k values; each lower level holds 2/3 as many (at
+#   least 2)
+# - compaction sorts a full level and moves every other value up; an odd
+#   value stays behind
+# - NaN values are skipped
+# - the random start uses an unseeded generator, so sketches for different
+#   bins and workers (and sketches made by from_dict) do not share coin flips
+
+
+class KllSketch:
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.maxerr = 0.
+        self.levels = [np.zeros(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def capacity(self, h):
+        depth = len(self.levels) - 1 - h
+        return max(int(np.ceil(self.k * (2 / 3)**depth)), 2)
+
+    def compress(self):
+        h = 0
+        while h < len(self.levels):
+            buf = self.levels[h]
+            if buf.size > self.capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.zeros(0))
+                buf = np.sort(buf)
+                odd = buf.size % 2
+                self.levels[h] = buf[:odd]
+                start = odd + self.rng.integers(2)
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], buf[start::2]])
+                self.maxerr += 2**h
+            h += 1
+        return self
+
+    def update(self, values):
+        values = np.asarray(values, dtype='d').ravel()
+        values = values[~np.isnan(values)]
+        self.n += values.size
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        return self.compress()
+
+    def merge(self, other):
+        if other.k != self.k:
+            raise ValueError('k must match to merge')
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.zeros(0))
+        for h, buf in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], buf])
+        self.n += other.n
+        self.maxerr += other.maxerr
+        return self.compress()
+
+    def to_dict(self):
+        return dict(
+            k=self.k, n=self.n, maxerr=self.maxerr,
+            levels=[buf.tolist() for buf in self.levels],
+        )
+
+    @classmethod
+    def from_dict(cls, d):
+        sketch = cls(d['k'])
+        sketch.n = d['n']
+        sketch.maxerr = d['maxerr']
+        sketch.levels = [np.array(buf, dtype='d') for buf in d['levels']]
+        return sketch
+
+    def nstored(self):
+        return sum(buf.size for buf in self.levels)
+
+    def rank_error(self):
+        """guaranteed bound on the normalized rank error"""
+        if self.n == 0:
+            return 0.
+        # compaction error plus interpolation between the heaviest values
+        return (self.maxerr + 2.**(len(self.levels) - 1)) / self.n
+
+    def quantile(self, q):
+        """
+        Arguments
+        ---------
+        q : float or array-like
+            Quantiles (0 to 1).
+
+        Returns
+        -------
+        values : np.ndarray
+            Value at each quantile (NaN if empty)
+        """
+        q = np.asarray(q, dtype='d')
+        if self.n == 0:
+            return np.full(q.shape, np.nan)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([
+            np.full(buf.size, 2.**h) for h, buf in enumerate(self.levels)
+        ])
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        weights = weights[order]
+        # each value is at the middle of the ranks it stands for; with all
+        # weights 1, this is the same as pandas linear interpolation
+        total = weights.sum()
+        mid = np.cumsum(weights) - (weights + 1) / 2
+        return np.interp(q * (total - 1), mid, values)
+
+
+# %%
+# Define Sketches by Time Bin
+# '''''''''''''''''''''''''''
+# - sketches is a dict with one sketch per (time bin, series)
+# - update_sketches can be called one day at a time or on any chunk
+
+
+def update_sketches(sketches, df, keys, freq=binfreq, k=k):
+    """
+    Arguments
+    ---------
+    sketches : dict
+        (time bin, key): KllSketch; updated in place.
+    df : pandas.DataFrame
+        Must have time and keys.
+    keys : list
+        Series to sketch (e.g., obs and mod).
+    freq : str
+        Time bin (pandas frequency).
+    k : int
+        Size of new sketches.
+
+    Returns
+    -------
+    sketches : dict
+        Same as input
+    """
+    tbin = df['time'].dt.floor(freq)
+    for t, bdf in df.groupby(tbin):
+        for key in keys:
+            if (t, key) not in sketches:
+                sketches[t, key] = KllSketch(k)
+            sketches[t, key].update(bdf[key].to_numpy())
+    return sketches
+
+
+def merge_sketches(sketches, others):
+    """merge others (dict of sketches) into sketches (dict of sketches)"""
+    for tkey, sketch in others.items():
+        if tkey in sketches:
+            sketches[tkey].merge(sketch)
+        else:
+            sketches[tkey] = KllSketch.from_dict(sketch.to_dict())
+    return sketches
+
+
+def sketch_quantiles(sketches, q=quantiles):
+    """DataFrame indexed by time bin with (q, key) columns"""
+    tkeys = list(sketches)
+    vals = np.array([sketches[tkey].quantile(q) for tkey in tkeys])
+    idx = pd.MultiIndex.from_tuples(tkeys, names=['time', 'key'])
+    qdf = pd.DataFrame(vals, index=idx, columns=q).unstack('key')
+    return qdf.sort_index()
+
+
+# %%
+# Update One Day at a Time
+# ''''''''''''''''''''''''
+
+longdf = pd.read_csv(longpath, parse_dates=['time'])
+df = longdf.loc[longdf['model_key'] == modkey]
+keys = ['obs', 'mod']
+sketches = {}
+for day, ddf in df.groupby(df['time'].dt.floor('1D')):
+    update_sketches(sketches, ddf, keys)
+    print(f'INFO:: {day:%Y-%m-%d} added')
+
+# %%
+# Compare and Plot
+# ''''''''''''''''
+# - exact quantiles from pandas like run_mpe_01_no2.py
+# - error is the normalized rank of the sketch value in the exact values
+
+qdf = sketch_quantiles(sketches)
+gb = df.groupby(df['time'].dt.floor(binfreq))[keys]
+exactdf = pd.concat({q: gb.quantile(q) for q in quantiles}, axis=1)
+diff = qdf.to_numpy() - exactdf.loc[qdf.index, qdf.columns].to_numpy()
+print('INFO:: largest difference from pandas', np.abs(diff).max())
+print('INFO:: largest rank_error bound', max(s.rank_error() for s in sketches.values()))
+
+ax = qdf[.5].plot(color=['k', 'r'], linewidth=2, zorder=2)
+qdf[.75].plot(ax=ax, color=['k', 'r'], linestyle='--', legend=False, zorder=1)
+qdf[.25].plot(ax=ax, color=['k', 'r'], linestyle='--', legend=False, zorder=1)
+ax.set(ylabel=f'{modkey} (median and IQR)')
+ax.figure.savefig(figpath)
+
+# %%
+# Merge Workers on a Synthetic Year
+# '''''''''''''''''''''''''''''''''
+# - hourly values for a year are split across workers by station
+# - each worker sketches daily bins; worker sketches are merged
+# - the sketch error is checked as a normalized rank in the exact values
+
+
+def rankerror(values, qvalues, q):
+    values = np.sort(values)
+    lo = np.searchsorted(values, qvalues, side='left') / values.size
+    hi = np.searchsorted(values, qvalues, side='right') / values.size
+    return np.maximum(0, np.maximum(lo - q, q - hi))
+
+
+if nbenchstation > 0:
+    rng = np.random.default_rng(0)
+    times = pd.date_range('2016-01-01', periods=nbenchday * 24, freq='1h')
+    benchdf = pd.DataFrame({
+        'time': np.repeat(times, nbenchstation),
+        'STATION': np.tile(np.arange(nbenchstation), times.size),
+        'obs': rng.gamma(2, 5, times.size * nbenchstation),
+    })
+    print(f'INFO:: benchmark {benchdf.shape[0]} values')
+    t0 = time.perf_counter()
+    workers = [
+        update_sketches({}, wdf, ['obs'], freq='1D')
+        for w, wdf in benchdf.groupby(benchdf['STATION'] % nworker)
+    ]
+    merged = {}
+    for wsketches in workers:
+        merge_sketches(merged, wsketches)
+    bqdf = sketch_quantiles(merged)
+    t1 = time.perf_counter()
+    gb = benchdf.groupby(benchdf['time'].dt.floor('1D'))['obs']
+    bexactdf = pd.concat({q: gb.quantile(q) for q in quantiles}, axis=1)
+    t2 = time.perf_counter()
+    nstored = sum(s.nstored() for s in merged.values())
+    print(f'INFO:: sketch {t1 - t0:.2f}s; pandas {t2 - t1:.2f}s')
+    print(f'INFO:: sketch stores {nstored} of {benchdf.shape[0]} values')
+    errs = []
+    bounds = []
+    for day, ddf in benchdf.groupby(benchdf['time'].dt.floor('1D')):
+        errs.append(rankerror(ddf['obs'].to_numpy(), bqdf.loc[day, quantiles].to_numpy(), np.array(quantiles)))
+        bounds.append(merged[day, 'obs'].rank_error())
+    errs = np.array(errs)
+    bounds = np.array(bounds)[:, None]
+    print(f'INFO:: rank error max {errs.max():.4f}, mean {errs.mean():.4f}, bound {bounds.max():.4f}')
+    assert (errs <= bounds).all()
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Sketch by hour of day (e.g., df['time'].dt.hour) for a diurnal plot.
+# 2. Try k of 50, 200, and 800; how do the error and nstored change?
@@ -32,6 +32,7 @@ Below is a bash command that makes a requirements.txt
     pycno
     pyrsig>=0.12.0
     cmaqsatproc>=0.5.2
+    pyarrow>=7.0.0,<22
     EOF
 
 Install a new virtual environment
@@ -0,0 +1,185 @@
+"""
+Find Stacks with a Spatial Index
+================================
+
+Build a KD-tree over stack coordinates once per point file and use it for
+radius, box, nearest, and polygon queries.
+
+The select-a-source example (`run_ptsrce_02_editlonlatbox.py`) makes a
+shapely point for every stack, intersects all of them with the shape, and
+then calculates the distance to every stack to list nearby stacks. With 100k+
+stacks, each selection is a full scan. A KD-tree (scipy.spatial.cKDTree) is
+built once, saved to disk, and reused, so each query only visits nearby
+stacks.
+
+The basic steps are:
+
+1. Build (or load) the index for a point file.
+2. Query stacks in a box, a circle, near a point, or in a custom shape.
+3. Compare query time to a full scan.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# date to process
+date = '20160610'
+# point source file to index
+ptpath = f'../../camx/ptsrce/point.camx.ptnonipm.{date}.nc'
+# folder to keep indexes
+cachedir = 'outputs/stackindex'
+
+# Region to find
+center = (-82.5436, 36.5224)
+dx = 250  # m (used as radius for circle)
+dy = 250  # m
+# report stacks within maxdist of the center
+maxdist = 10e3
+# number of nearest stacks to report
+nearestk = 5
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import hashlib
+import pickle
+import time
+import os
+import numpy as np
+import netCDF4
+import pyproj
+import shapely
+from scipy.spatial import cKDTree
+
+os.makedirs(cachedir, exist_ok=True)
+
+# %%
+# Define the Stack Index
+# ''''''''''''''''''''''
+# - The cache key is the file's path, size, and modification time, so the
+#   coordinates are only read when the index must be built.
+# - All queries return sorted stack (COL) indices.
+
+
+class StackIndex:
+    def __init__(self, path, cachedir=cachedir):
+        """
+        Arguments
+        ---------
+        path : str
+            Path to a CAMx point source file with xcoord and ycoord.
+        cachedir : str
+            Folder for saved indexes.
+        """
+        stat = os.stat(path)
+        keystr = f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}'
+        key = hashlib.sha256(keystr.encode()).hexdigest()[:32]
+        cachepath = os.path.join(cachedir, key + '.pkl')
+        if os.path.exists(cachepath):
+            with open(cachepath, 'rb') as cf:
+                self.tree = pickle.load(cf)
+        else:
+            with netCDF4.Dataset(path) as ptf:
+                xy = np.column_stack([ptf['xcoord'][:], ptf['ycoord'][:]])
+            self.tree = cKDTree(xy)
+            tmppath = cachepath + '.tmp'
+            with open(tmppath, 'wb') as cf:
+                pickle.dump(self.tree, cf, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmppath, cachepath)
+        self.x = self.tree.data[:, 0]
+        self.y = self.tree.data[:, 1]
+
+    def radius(self, cx, cy, r):
+        """Stacks within r (m) of cx, cy"""
+        return np.array(sorted(self.tree.query_ball_point([cx, cy], r)), dtype='i')
+
+    def box(self, xmin, ymin, xmax, ymax):
+        """Stacks within the box (inclusive)"""
+        cx, cy = (xmin + xmax) / 2, (ymin + ymax) / 2
+        r = max(xmax - xmin, ymax - ymin) / 2
+        # p=inf makes the query a square; then trim to the box
+        idx = np.array(sorted(self.tree.query_ball_point([cx, cy], r, p=np.inf)), dtype='i')
+        x, y = self.x[idx], self.y[idx]
+        inbox = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        return idx[inbox]
+
+    def nearest(self, cx, cy, k=1):
+        """k nearest stacks and their distances (m), closest first"""
+        dist, idx = self.tree.query([cx, cy], k=k)
+        return np.atleast_1d(idx), np.atleast_1d(dist)
+
+    def polygon(self, shp):
+        """Stacks that intersect shp (in projected coordinates)"""
+        idx = self.box(*shp.bounds)
+        return idx[shapely.intersects_xy(shp, self.x[idx], self.y[idx])]
+
+
+# %%
+# Build or Load the Index
+# '''''''''''''''''''''''
+
+t0 = time.perf_counter()
+sidx = StackIndex(ptpath)
+t1 = time.perf_counter()
+print(f'INFO:: {sidx.x.size} stacks indexed in {(t1 - t0) * 1e3:.1f}ms')
+
+# %%
+# Query Stacks
+# ''''''''''''
+# - Create a projection and project the center
+
+with netCDF4.Dataset(ptpath) as ptf:
+    attrs = {k: ptf.getncattr(k) for k in ptf.ncattrs()}
+
+proj4tmpl = '+proj=lcc +lat_0={YCENT} +lon_0={P_GAM}'
+proj4tmpl += ' +lat_1={P_ALP} +lat_2={P_BET} +R=6370000 +units=m +no_defs'
+proj = pyproj.Proj(proj4tmpl.format(**attrs))
+cx, cy = proj(*center)
+
+queries = {
+    'box': lambda: sidx.box(cx - dx, cy - dy, cx + dx, cy + dy),
+    'circle': lambda: sidx.radius(cx, cy, dx),
+    'polygon': lambda: sidx.polygon(shapely.points(cx, cy).buffer(dx)),
+    'nearest': lambda: sidx.nearest(cx, cy, k=nearestk)[0],
+}
+for qkey, query in queries.items():
+    t0 = time.perf_counter()
+    idx = query()
+    t1 = time.perf_counter()
+    print(f'INFO:: {qkey:8s} {(t1 - t0) * 1e6:8.1f}us {idx.size} stacks: {idx[:10]}')
+
+# %%
+# Compare to Full Scan
+# ''''''''''''''''''''
+# - the approach in `run_ptsrce_02_editlonlatbox.py`
+
+t0 = time.perf_counter()
+myshp = shapely.box(cx - dx, cy - dy, cx + dx, cy + dy)
+psxy = shapely.points(sidx.x, sidx.y)
+scanidx = np.flatnonzero(myshp.intersects(psxy))
+t1 = time.perf_counter()
+print(f'INFO:: full scan {(t1 - t0) * 1e6:8.1f}us {scanidx.size} stacks')
+assert np.array_equal(scanidx, sidx.box(cx - dx, cy - dy, cx + dx, cy + dy))
+
+# %%
+# Nearby Stacks
+# '''''''''''''
+# - Only stacks within maxdist are visited.
+# - Stacks at the same distance are often the same facility.
+
+near = sidx.radius(cx, cy, maxdist)
+neardist = np.hypot(sidx.x[near] - cx, sidx.y[near] - cy)
+fdists, fcnts = np.unique(neardist, return_counts=True)
+print('INFO:: Stacks by distance from center')
+for fdist, fcnt in zip(fdists, fcnts):
+    print(f'INFO:: {fdist:6.0f}m: {fcnt}')
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Use sidx.polygon with a county from the US Census shapefile.
+# 2. Use the indices from sidx.box as ismine in `run_ptsrce_02_editlonlatbox.py`.
@@ -0,0 +1,152 @@
+"""
+Summarize a Point Source File in One Pass
+=========================================
+
+Calculate per-stack daily totals, the largest stack, hourly domain totals,
+and normalized time profiles while reading each species once.
+
+The single-source example (`run_ptsrce_01_singlesource.py`) uses
+PseudoNetCDF `apply(TSTEP='mean')` and `apply(COL='mean')`, which each make a
+new copy of the whole file. This example reads one TSTEP of one species at a
+time and updates running sums, so memory is proportional to one TSTEP.
+
+The basic steps are:
+
+1. Select emission variables.
+2. Read each species one TSTEP at a time, updating sums.
+3. Save per-stack totals and hourly profiles.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# what date are you processing?
+date = '20160610'
+# existing point source file
+ptpath = f'../../camx/ptsrce/point.camx.ptnonipm.{date}.nc'
+# outputs
+stackpath = f'outputs/point.camx.ptnonipm.{date}_stacks.csv'
+profilepath = f'outputs/point.camx.ptnonipm.{date}_profiles.csv'
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import time
+import os
+import numpy as np
+import pandas as pd
+import netCDF4
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Define the Summarizer
+# '''''''''''''''''''''
+# - stack totals are sums over TSTEP (e.g., mol/day for mol/h rates)
+# - domain profiles are sums over COL for each TSTEP
+# - normalized profiles are the domain profile divided by its mean, which is
+#   the same as the time profile in `run_ptsrce_01_singlesource.py`
+
+
+def summarize(ptf, keys):
+    """
+    Arguments
+    ---------
+    ptf : netCDF4.Dataset
+        CAMx point source file.
+    keys : list
+        Emission variables (TSTEP, COL) to summarize.
+
+    Returns
+    -------
+    stackdf : pandas.DataFrame
+        One row per stack (COL) with xcoord, ycoord, and TSTEP sum per key
+    profdf : pandas.DataFrame
+        One row per TSTEP with COL sum per key and normalized profile
+        per key (key_norm; flat 1s if the key is always zero)
+    """
+    nt = len(ptf.dimensions['TSTEP'])
+    ns = len(ptf.dimensions['COL'])
+    stacksums = {}
+    profiles = {}
+    for key in keys:
+        var = ptf.variables[key]
+        stacksum = np.zeros(ns, dtype='d')
+        profile = np.zeros(nt, dtype='d')
+        for ti in range(nt):
+            vals = var[ti]
+            stacksum += vals
+            profile[ti] = vals.sum(dtype='d')
+        stacksums[key] = stacksum
+        profiles[key] = profile
+        profiles[key + '_norm'] = np.divide(
+            profile, profile.mean(), out=np.ones(nt), where=profile.mean() > 0
+        )
+
+    stackdf = pd.DataFrame(dict(
+        xcoord=ptf['xcoord'][:], ycoord=ptf['ycoord'][:], **stacksums
+    ))
+    stackdf.index.name = 'COL'
+    tflag = ptf['TFLAG'][:, 0, :]
+    times = pd.to_datetime(
+        [f'{d:07d}T{t:06d}' for d, t in tflag], format='%Y%jT%H%M%S'
+    )
+    profdf = pd.DataFrame(profiles, index=pd.Index(times, name='time'))
+    return stackdf, profdf
+
+
+# %%
+# Summarize
+# '''''''''
+
+t0 = time.perf_counter()
+with netCDF4.Dataset(ptpath) as ptf:
+    emiskeys = [
+        k for k, v in ptf.variables.items()
+        if getattr(v, 'units', '').strip() in ('mol hr-1', 'g hr-1')
+    ]
+    stackdf, profdf = summarize(ptf, emiskeys)
+t1 = time.perf_counter()
+print(f'INFO:: {len(emiskeys)} species, {stackdf.shape[0]} stacks in {t1 - t0:.2f}s')
+
+stackdf.to_csv(stackpath)
+profdf.to_csv(profilepath)
+
+# %%
+# Largest Stacks
+# ''''''''''''''
+# - the stack with the largest daily total for each species
+
+argmaxdf = pd.DataFrame({
+    'COL': stackdf[emiskeys].idxmax(),
+    'total': stackdf[emiskeys].max(),
+})
+print(argmaxdf.loc[[k for k in ['NO', 'NO2', 'FPRM'] if k in emiskeys]])
+
+# %%
+# Confirm with a Whole-Array Calculation
+# ''''''''''''''''''''''''''''''''''''''
+
+key = emiskeys[0]
+with netCDF4.Dataset(ptpath) as ptf:
+    vals = ptf[key][:]
+assert np.allclose(stackdf[key], vals.sum(0, dtype='d'))
+assert np.allclose(profdf[key], vals.sum(1, dtype='d'))
+
+# %%
+# Visualize Profiles
+# ''''''''''''''''''
+
+ax = profdf[[k + '_norm' for k in emiskeys[:5]]].plot()
+ax.set(ylabel='Hourly / Daily Mean [1]')
+ax.figure.savefig(f'outputs/point.camx.ptnonipm.{date}_profiles.png')
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Use argmaxdf and profdf to make the hypothetical source in `run_ptsrce_01_singlesource.py`.
+# 2. Add the number of hours each stack emits to stackdf.
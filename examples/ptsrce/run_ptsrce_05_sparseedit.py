@@ -0,0 +1,170 @@
+"""
+Edit Only Selected Stacks
+=========================
+
+Scale a few stacks by reading and writing only their columns.
+
+The select-a-source example (`run_ptsrce_02_editlonlatbox.py`) reads the
+whole TSTEP x COL array for each species, scales the selected stacks, and
+writes the whole array back. Usually only a handful of stacks change. This
+example groups the selected COL indices into contiguous runs and reads and
+writes only those runs, so the cost scales with the number of edited stacks.
+
+The basic steps are:
+
+1. Copy an existing emissions file.
+2. Select stacks (same as the select-a-source example).
+3. Group selected stacks into contiguous COL runs.
+4. Scale only those runs.
+5. Compare to the whole-array approach.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# date to process
+date = '20160610'
+# file to copy
+oldpath = f'../../camx/ptsrce/point.camx.ptnonipm.{date}.nc'
+# new file to create
+newpath = f'outputs/point.camx.ptnonipm_sparseedit.{date}.nc'
+
+# Region to modify
+center = (-82.5436, 36.5224)
+dx = 250  # m
+dy = 250  # m
+
+# factor to apply within the shape
+scalekeys = ['NO', 'NO2', 'HONO']  # a list of species or 'all'
+factor = 1.2
+# unselected stacks between selected stacks that may be read (and rewritten
+# unchanged) to make fewer, larger reads
+maxgap = 0
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import shutil
+import time
+import os
+import numpy as np
+import netCDF4
+import pyproj
+from shapely import points, box
+
+os.makedirs('outputs', exist_ok=True)
+shutil.copyfile(oldpath, newpath)
+
+oldf = netCDF4.Dataset(oldpath, mode='r')
+newf = netCDF4.Dataset(newpath, mode='a')
+
+if scalekeys == 'all':
+    scalekeys = [
+        k for k, v in newf.variables.items()
+        if v.units.strip() in ('mol hr-1', 'g hr-1')
+    ]
+
+# %%
+# Select Stacks
+# '''''''''''''
+
+attrs = {k: oldf.getncattr(k) for k in oldf.ncattrs()}
+proj4tmpl = '+proj=lcc +lat_0={YCENT} +lon_0={P_GAM}'
+proj4tmpl += ' +lat_1={P_ALP} +lat_2={P_BET} +R=6370000 +units=m +no_defs'
+proj = pyproj.Proj(proj4tmpl.format(**attrs))
+cx, cy = proj(*center)
+myshp = box(cx - dx, cy - dy, cx + dx, cy + dy)
+psxy = points(oldf['xcoord'][:], oldf['ycoord'][:])
+ismine = myshp.intersects(psxy)
+cols = np.flatnonzero(ismine)
+print(f'INFO:: {cols.size} point sources in myshp')
+
+# %%
+# Group Columns into Runs
+# '''''''''''''''''''''''
+# - each run is a (start, stop) slice of COL
+# - runs separated by maxgap or fewer columns are combined
+
+
+def colruns(cols, maxgap=0):
+    """
+    Arguments
+    ---------
+    cols : array-like
+        COL indices to edit.
+    maxgap : int
+        Largest number of unselected columns allowed inside a run.
+
+    Returns
+    -------
+    runs : list
+        (start, stop) pairs for slices that include all cols
+    """
+    cols = np.unique(cols)
+    if cols.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(cols) > maxgap + 1) + 1
+    starts = cols[np.r_[0, breaks]]
+    stops = cols[np.r_[breaks - 1, cols.size - 1]] + 1
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+runs = colruns(cols, maxgap=maxgap)
+print(f'INFO:: {len(runs)} contiguous runs: {runs[:10]}')
+
+# %%
+# Apply Scaling to Runs
+# '''''''''''''''''''''
+# - values are read from the original file, so rerunning does not compound
+
+
+def scale_runs(oldf, newf, keys, runs, ismine, factor):
+    for skey in keys:
+        oldvar = oldf[skey]
+        newvar = newf[skey]
+        vfactor = np.asarray(factor, dtype=oldvar.dtype)
+        for start, stop in runs:
+            vals = oldvar[:, start:stop]
+            vals[:, ismine[start:stop]] *= vfactor
+            newvar[:, start:stop] = vals
+
+
+t0 = time.perf_counter()
+scale_runs(oldf, newf, scalekeys, runs, ismine, factor)
+newf.sync()
+t1 = time.perf_counter()
+print(f'INFO:: sparse edit {(t1 - t0) * 1e3:.1f}ms')
+
+# %%
+# Compare to Whole-Array Edit
+# '''''''''''''''''''''''''''
+# - the approach in `run_ptsrce_02_editlonlatbox.py`
+
+t0 = time.perf_counter()
+for skey in scalekeys:
+    newvals = oldf[skey][:].copy()
+    newvals[:, ismine] *= factor
+    newf[skey][:] = newvals
+newf.sync()
+t1 = time.perf_counter()
+print(f'INFO:: whole edit {(t1 - t0) * 1e3:.1f}ms')
+
+# Check that the sparse edit gives the same result
+scale_runs(oldf, newf, scalekeys, runs, ismine, factor)
+for skey in scalekeys:
+    newvals = oldf[skey][:].copy()
+    newvals[:, ismine] *= np.asarray(factor, dtype=newvals.dtype)
+    assert np.array_equal(newf[skey][:], newvals)
+
+newf.close()
+oldf.close()
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Select all stacks in a county and try maxgap of 0, 10, and 100.
+# 2. Use StackIndex from `run_ptsrce_03_stackindex.py` to select cols.
@@ -0,0 +1,194 @@
+"""
+Grid Point Sources with a Sparse Operator
+=========================================
+
+Map every stack to its grid cell once, then grid all species and hours with
+one sparse matrix multiplication.
+
+The select-a-source example (`run_ptsrce_02_editlonlatbox.py`) calls
+`np.histogram2d` for each total it plots. Gridding each species and hour
+that way repeats the binning every time. Here, a sparse operator (G) with one
+row per grid cell and one column per stack is built once per point file and
+grid, and saved to disk. Gridded emissions for all hours and species are then
+`G @ E`, where E is stacks x (species and hours). The result is written with
+the same TSTEP, LAY, ROW, COL shape as the gridded sector files.
+
+The basic steps are:
+
+1. Build (or load) the stack-to-cell operator.
+2. Grid all species and hours in batches.
+3. Save an IOAPI-shaped file.
+4. Compare to np.histogram2d.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# date to process
+date = '20160610'
+# point source file to grid
+ptpath = f'../../camx/ptsrce/point.camx.ptnonipm.{date}.nc'
+# gridded file that defines the grid (any sector on the grid)
+gridpath = f'../../camx/emiss/camx_area.mobile.{date}.36km.nc'
+# gridded point sources
+outpath = f'outputs/point.camx.ptnonipm.{date}.36km_gridded.nc'
+# folder to keep operators
+cachedir = 'outputs/gridop'
+# number of species to grid per sparse multiplication
+keybatch = 20
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import hashlib
+import time
+import os
+import numpy as np
+import netCDF4
+import pyproj
+import scipy.sparse
+
+os.makedirs(cachedir, exist_ok=True)
+
+# %%
+# Build the Operator
+# ''''''''''''''''''
+# - stacks are assigned to the cell that contains them
+# - stacks are reprojected if the point file and grid projections differ
+# - stacks outside the grid are dropped (reported as a count)
+
+gridattrkeys = [
+    'GDTYP', 'P_ALP', 'P_BET', 'P_GAM', 'XCENT', 'YCENT',
+    'XORIG', 'YORIG', 'XCELL', 'YCELL', 'NCOLS', 'NROWS',
+]
+
+
+def getproj(attrs):
+    proj4tmpl = '+proj=lcc +lat_0={YCENT} +lon_0={P_GAM}'
+    proj4tmpl += ' +lat_1={P_ALP} +lat_2={P_BET} +R=6370000 +units=m +no_defs'
+    return pyproj.Proj(proj4tmpl.format(**attrs))
+
+
+def getgridop(ptf, gf, cachedir=cachedir):
+    """
+    Arguments
+    ---------
+    ptf : netCDF4.Dataset
+        CAMx point source file.
+    gf : netCDF4.Dataset
+        IOAPI file that defines the grid.
+    cachedir : str
+        Folder for saved operators.
+
+    Returns
+    -------
+    G : scipy.sparse.csr_matrix
+        (NROWS * NCOLS, nstacks) with 1 where the stack is in the cell
+    """
+    gattrs = {k: gf.getncattr(k) for k in gridattrkeys}
+    x = np.asarray(ptf['xcoord'][:], dtype='d')
+    y = np.asarray(ptf['ycoord'][:], dtype='d')
+    h = hashlib.sha256(repr(sorted(gattrs.items())).encode())
+    h.update(x.tobytes())
+    h.update(y.tobytes())
+    cachepath = os.path.join(cachedir, h.hexdigest()[:32] + '.npz')
+    if os.path.exists(cachepath):
+        return scipy.sparse.load_npz(cachepath)
+
+    pattrs = {k: ptf.getncattr(k) for k in ['P_ALP', 'P_BET', 'P_GAM', 'YCENT']}
+    if any(pattrs[k] != gattrs[k] for k in pattrs):
+        x, y = getproj(gattrs)(*getproj(pattrs)(x, y, inverse=True))
+    col = np.floor((x - gattrs['XORIG']) / gattrs['XCELL']).astype('i')
+    row = np.floor((y - gattrs['YORIG']) / gattrs['YCELL']).astype('i')
+    ncols, nrows = int(gattrs['NCOLS']), int(gattrs['NROWS'])
+    ingrid = (col >= 0) & (col < ncols) & (row >= 0) & (row < nrows)
+    print(f'INFO:: {(~ingrid).sum()} stacks outside the grid')
+    stack = np.flatnonzero(ingrid)
+    cell = row[ingrid] * ncols + col[ingrid]
+    G = scipy.sparse.csr_matrix(
+        (np.ones(stack.size), (cell, stack)), shape=(nrows * ncols, x.size)
+    )
+    tmppath = cachepath + '.tmp.npz'
+    scipy.sparse.save_npz(tmppath, G)
+    os.replace(tmppath, cachepath)
+    return G
+
+
+ptf = netCDF4.Dataset(ptpath)
+gf = netCDF4.Dataset(gridpath)
+t0 = time.perf_counter()
+G = getgridop(ptf, gf)
+t1 = time.perf_counter()
+print(f'INFO:: operator {G.shape} nnz={G.nnz} in {(t1 - t0) * 1e3:.1f}ms')
+
+# %%
+# Grid All Species and Hours
+# ''''''''''''''''''''''''''
+# - E has one row per stack and one column per (species, hour)
+# - batches of species limit the memory of the dense result
+
+emiskeys = [
+    k for k, v in ptf.variables.items()
+    if getattr(v, 'units', '').strip() in ('mol hr-1', 'g hr-1')
+]
+nt = len(ptf.dimensions['TSTEP'])
+nrows, ncols = gf.NROWS, gf.NCOLS
+
+outf = netCDF4.Dataset(outpath, mode='w', format='NETCDF4_CLASSIC')
+outf.setncatts({k: gf.getncattr(k) for k in gf.ncattrs()})
+outf.NLAYS = 1
+outf.NVARS = len(emiskeys)
+setattr(outf, 'VAR-LIST', ''.join(k.ljust(16) for k in emiskeys))
+outf.FILEDESC = f'{os.path.basename(ptpath)} gridded to {os.path.basename(gridpath)}'
+outf.createDimension('TSTEP', None)
+outf.createDimension('DATE-TIME', 2)
+outf.createDimension('LAY', 1)
+outf.createDimension('VAR', len(emiskeys))
+outf.createDimension('ROW', nrows)
+outf.createDimension('COL', ncols)
+tflag = outf.createVariable('TFLAG', 'i', ('TSTEP', 'VAR', 'DATE-TIME'))
+tflag.setncatts({k: ptf['TFLAG'].getncattr(k) for k in ptf['TFLAG'].ncattrs()})
+tflag[:] = np.repeat(ptf['TFLAG'][:, :1, :], len(emiskeys), axis=1)
+
+t0 = time.perf_counter()
+for bi in range(0, len(emiskeys), keybatch):
+    bkeys = emiskeys[bi:bi + keybatch]
+    E = np.concatenate([ptf[k][:].T for k in bkeys], axis=1)  # (stack, key x hour)
+    gridded = (G @ E).reshape(nrows, ncols, len(bkeys), nt)
+    for ki, key in enumerate(bkeys):
+        pvar = ptf[key]
+        var = outf.createVariable(key, 'f', ('TSTEP', 'LAY', 'ROW', 'COL'))
+        var.setncatts({k: pvar.getncattr(k) for k in pvar.ncattrs()})
+        var[:] = gridded[:, :, ki, :].transpose(2, 0, 1)[:, None]
+t1 = time.perf_counter()
+print(f'INFO:: gridded {len(emiskeys)} species x {nt} hours in {t1 - t0:.2f}s')
+outf.close()
+
+# %%
+# Compare to np.histogram2d
+# '''''''''''''''''''''''''
+# - daily mean NO with the approach in `run_ptsrce_02_editlonlatbox.py`
+
+key = emiskeys[0]
+xedges = np.arange(ncols + 1) * gf.XCELL + gf.XORIG
+yedges = np.arange(nrows + 1) * gf.YCELL + gf.YORIG
+H, _, _ = np.histogram2d(
+    ptf['ycoord'][:], ptf['xcoord'][:], weights=ptf[key][:].mean(0),
+    bins=[yedges, xedges]
+)
+with netCDF4.Dataset(outpath) as outf:
+    Z = outf[key][:, 0].mean(0)
+print(f'INFO:: {key} histogram2d sum={H.sum():.6e} operator sum={Z.sum():.6e}')
+assert np.allclose(H, Z, rtol=1e-5)
+ptf.close()
+gf.close()
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Compare the gridded file to `camx_area.pt.{date}.36km.nc`.
+# 2. Use G to grid the before and after files from `run_ptsrce_02_editlonlatbox.py`.
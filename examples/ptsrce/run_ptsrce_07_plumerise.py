@@ -0,0 +1,257 @@
+"""
+Estimate Plume Rise Layer Fractions
+===================================
+
+Estimate which CAMx layers each stack's emissions reach for every hour.
+
+Point source files carry stack parameters (height, diameter, temperature,
+and exit velocity), but not the layer that emissions reach. This example uses
+Briggs plume rise with the 3D met file already used in the satellite
+examples (z, temperature, pressure, and winds when available). All stacks and
+hours are calculated with numpy arrays (no loop over stacks), and the result
+is the fraction of each stack's emissions in each layer.
+
+This is a screening estimate for comparing point edits against 3D outputs.
+CAMx has its own plume rise, which will differ in details.
+
+The basic steps are:
+
+1. Read stack parameters and locate each stack in the met grid.
+2. Sample met profiles for every stack and hour.
+3. Calculate plume rise, plume top, and plume bottom.
+4. Calculate the fraction of the plume in each layer.
+5. Benchmark at 100k stacks x 25 hours.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# what date are you processing?
+date = '20160610'
+# existing point source file
+ptpath = f'../../camx/ptsrce/point.camx.ptnonipm.{date}.nc'
+# If you used camx.tar.gz for inputs, update the met folder to metss
+mpath = f'../../camx/met/camx.3d.36km.{date}.nc'
+# layer fractions (TSTEP, LAY, COL)
+outpath = f'outputs/point.camx.ptnonipm.{date}_layfrac.nc'
+# stack parameter variable names in the point file
+stkkeys = dict(hs='stkheight', d='stkdiam', ts='stktemp', vs='stkspeed')
+# emission variable used to report the layer distribution
+emiskey = 'NO'
+# wind speed (m/s) when the met file has no uwind/vwind
+defaultwind = 3.
+# synthetic benchmark size (set nbench to 0 to skip)
+nbench = 100000
+ntbench = 25
+# hours per call in the benchmark; ntbench does all hours in one call, but
+# needs ~2.5GB of memory at 100k stacks x 25 layers
+hourbatch = 5
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import time
+import os
+import numpy as np
+import netCDF4
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Define Plume Rise
+# '''''''''''''''''
+# - Briggs (1975) final rise for buoyant plumes:
+#     - neutral/unstable: 21.425 F^0.75 / u (F < 55) or 38.71 F^0.6 / u
+#     - stable: 2.6 (F / (u s))^(1/3), using the smaller of the two
+# - momentum rise 3 d w / u is used when larger (e.g., cool stacks)
+# - the plume is dh thick, centered at hs + dh
+# - inputs are broadcast, so the met can be (hour, LAY, stack) and the
+#   stack parameters can be (stack,)
+
+g = 9.81
+
+
+def plume_rise(hs, d, ts, vs, zt, ta, pa, ws):
+    """
+    Arguments
+    ---------
+    hs, d, ts, vs : array-like (..., stack)
+        Stack height (m), diameter (m), exit temperature (K), and exit
+        velocity (m/s).
+    zt : array-like (..., LAY, stack)
+        Layer top height (m above ground).
+    ta, pa, ws : array-like (..., LAY, stack)
+        Temperature (K), pressure (hPa), and wind speed (m/s).
+
+    Returns
+    -------
+    bot, top : np.ndarray (..., stack)
+        Plume bottom and top heights (m above ground)
+    """
+    nl = zt.shape[-2]
+    # layer that contains the stack top
+    ks = np.minimum((zt < hs[..., None, :]).sum(-2), nl - 1)[..., None, :]
+    kp = np.minimum(ks + 1, nl - 1)
+    tak = np.take_along_axis(ta, ks, axis=-2)[..., 0, :]
+    u = np.maximum(np.take_along_axis(ws, ks, axis=-2)[..., 0, :], 1.)
+    # stability from potential temperature gradient above the stack
+    theta = ta * (1000. / pa)**0.286
+    zm = zt - np.diff(zt, axis=-2, prepend=0.) / 2
+    dz = np.take_along_axis(zm, kp, axis=-2) - np.take_along_axis(zm, ks, axis=-2)
+    dth = np.take_along_axis(theta, kp, axis=-2) - np.take_along_axis(theta, ks, axis=-2)
+    dthdz = np.where(dz > 0, dth / np.where(dz > 0, dz, 1.), 0.)[..., 0, :]
+    # buoyancy flux (m4/s3)
+    F = g * vs * (d / 2)**2 * np.maximum(ts - tak, 0) / ts
+    dh = np.where(F < 55, 21.425 * F**0.75, 38.71 * F**0.6) / u
+    s = g / tak * np.maximum(dthdz, 1e-6)
+    dhs = 2.6 * (F / (u * s))**(1 / 3.)
+    dh = np.where(dthdz > 0, np.minimum(dh, dhs), dh)
+    dh = np.maximum(dh, 3 * d * vs / u)
+    hc = hs + dh
+    # at least 1m thick so that every plume lands in a layer
+    half = np.maximum(dh, 1.) / 2
+    return np.maximum(hc - half, 0.), hc + half
+
+
+def layer_fractions(bot, top, zt):
+    """
+    Arguments
+    ---------
+    bot, top : array-like (..., stack)
+        Plume bottom and top heights (m).
+    zt : array-like (..., LAY, stack)
+        Layer top height (m above ground).
+
+    Returns
+    -------
+    frac : np.ndarray (..., LAY, stack)
+        Fraction of the plume in each layer (sums to 1); plume above the
+        model top is put in the top layer.
+    """
+    zb = np.concatenate([np.zeros_like(zt[..., :1, :]), zt[..., :-1, :]], axis=-2)
+    bot = bot[..., None, :]
+    top = top[..., None, :]
+    overlap = np.minimum(top, zt) - np.maximum(bot, zb)
+    frac = np.maximum(overlap, 0) / (top - bot)
+    frac[..., -1, :] += 1 - frac.sum(-2)
+    return frac.astype('f')
+
+
+# %%
+# Read Stacks and Locate in the Met Grid
+# ''''''''''''''''''''''''''''''''''''''
+# - the point file and met file share the LCC projection
+
+ptf = netCDF4.Dataset(ptpath)
+mf = netCDF4.Dataset(mpath)
+stk = {k: np.asarray(ptf[v][:], dtype='d') for k, v in stkkeys.items()}
+col = np.floor((ptf['xcoord'][:] - mf.XORIG) / mf.XCELL).astype('i')
+row = np.floor((ptf['ycoord'][:] - mf.YORIG) / mf.YCELL).astype('i')
+ingrid = (col >= 0) & (col < mf.NCOLS) & (row >= 0) & (row < mf.NROWS)
+col = np.clip(col, 0, mf.NCOLS - 1)
+row = np.clip(row, 0, mf.NROWS - 1)
+print(f'INFO:: {(~ingrid).sum()} stacks outside the met grid use the nearest edge')
+
+nt = min(len(ptf.dimensions['TSTEP']), len(mf.dimensions['TSTEP']))
+nl = len(mf.dimensions['LAY'])
+haswind = 'uwind' in mf.variables and 'vwind' in mf.variables
+
+# %%
+# Calculate Layer Fractions
+# '''''''''''''''''''''''''
+# - met is sampled at stack cells one hour at a time to limit memory
+# - every stack is calculated at once
+
+outf = netCDF4.Dataset(outpath, mode='w', format='NETCDF4_CLASSIC')
+outf.setncatts({k: ptf.getncattr(k) for k in ptf.ncattrs()})
+outf.NLAYS = np.int32(nl)
+outf.NVARS = np.int32(1)
+setattr(outf, 'VAR-LIST', 'LAYFRAC'.ljust(16))
+for k in ['VGTYP', 'VGTOP', 'VGLVLS']:
+    if k in mf.ncattrs():
+        outf.setncattr(k, mf.getncattr(k))
+outf.createDimension('TSTEP', None)
+outf.createDimension('DATE-TIME', 2)
+outf.createDimension('LAY', nl)
+outf.createDimension('VAR', 1)
+outf.createDimension('COL', col.size)
+tflag = outf.createVariable('TFLAG', 'i', ('TSTEP', 'VAR', 'DATE-TIME'))
+tflag.setncatts({k: ptf['TFLAG'].getncattr(k) for k in ptf['TFLAG'].ncattrs()})
+tflag[:] = ptf['TFLAG'][:nt, :1, :]
+fvar = outf.createVariable('LAYFRAC', 'f', ('TSTEP', 'LAY', 'COL'))
+fvar.units = '1'
+fvar.long_name = 'LAYFRAC'
+fvar.var_desc = 'Fraction of stack emissions in each layer (Briggs plume rise)'
+
+emislay = np.zeros(nl)
+t0 = time.perf_counter()
+for ti in range(nt):
+    met = {}
+    for mkey in ['z', 'temperature', 'pressure']:
+        met[mkey] = mf[mkey][ti][:, row, col]
+    if haswind:
+        met['ws'] = np.hypot(mf['uwind'][ti][:, row, col], mf['vwind'][ti][:, row, col])
+    else:
+        met['ws'] = np.full_like(met['z'], defaultwind)
+    bot, top = plume_rise(
+        stk['hs'], stk['d'], stk['ts'], stk['vs'],
+        met['z'], met['temperature'], met['pressure'], met['ws']
+    )
+    frac = layer_fractions(bot, top, met['z'])
+    fvar[ti] = frac
+    emislay += (frac * ptf[emiskey][ti]).sum(-1)
+
+t1 = time.perf_counter()
+outf.close()
+print(f'INFO:: {col.size} stacks x {nt} hours in {t1 - t0:.2f}s')
+print(f'INFO:: {emiskey} fraction by layer')
+for li, lfrac in enumerate(emislay / emislay.sum()):
+    print(f'INFO:: {li + 1:3d} {lfrac:.3f}')
+
+# %%
+# Benchmark
+# '''''''''
+# - synthetic stacks and a met profile like the first stack's first hour
+# - all stacks and hourbatch hours in each call
+# - float32 inputs keep the intermediate arrays at 4 bytes per value
+
+if nbench > 0:
+    rng = np.random.default_rng(0)
+    bstk = dict(
+        hs=rng.uniform(5, 250, nbench), d=rng.uniform(0.5, 8, nbench),
+        ts=rng.uniform(290, 600, nbench), vs=rng.uniform(1, 30, nbench),
+    )
+    bstk = {k: v.astype('f') for k, v in bstk.items()}
+    frac = np.empty((ntbench, nl, nbench), dtype='f')
+    shape = (hourbatch, nl, nbench)
+    bmet = {
+        k: np.broadcast_to(
+            np.asarray(mf[k][0, :, row[0], col[0]], dtype='f')[None, :, None], shape
+        )
+        for k in ['z', 'temperature', 'pressure']
+    }
+    bws = np.full(shape, defaultwind, dtype='f')
+    t0 = time.perf_counter()
+    for hi in range(0, ntbench, hourbatch):
+        nh = min(hourbatch, ntbench - hi)
+        bot, top = plume_rise(
+            bstk['hs'], bstk['d'], bstk['ts'], bstk['vs'],
+            bmet['z'][:nh], bmet['temperature'][:nh], bmet['pressure'][:nh], bws[:nh]
+        )
+        frac[hi:hi + nh] = layer_fractions(bot, top, bmet['z'][:nh])
+    t1 = time.perf_counter()
+    assert np.allclose(frac.sum(1), 1, atol=1e-4)
+    print(f'INFO:: benchmark {nbench} stacks x {ntbench} hours x {nl} layers in {t1 - t0:.2f}s')
+
+ptf.close()
+mf.close()
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Use LAYFRAC and the operator from `run_ptsrce_06_gridop.py` to make a 3D gridded file.
+# 2. Compare the layer distribution of ptnonipm and pt_oilgas.
@@ -0,0 +1,221 @@
+"""
+Create Many Hypothetical Sources
+================================
+
+Write hundreds of candidate stacks, each with its own location, stack
+parameters, time profile, and scaling, into one point source file.
+
+The single-source example (`run_ptsrce_01_singlesource.py`) creates one
+hypothetical source at one location and saves a one-stack file. Siting
+studies need many candidate locations. This example reads a table of
+candidates, projects all of them at once, builds every stack's emissions with
+array math, and writes one CAMx point source file (TFLAG/ETFLAG and NCOLS are
+set for the new number of stacks).
+
+The basic steps are:
+
+1. Read a table of candidate sources.
+2. Build a template source from an existing file (max NO stack and mean
+   time profile, as in the single-source example).
+3. Calculate emissions for every candidate at once.
+4. Write all candidates to one file.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# what date are you processing?
+date = '20160610'
+# existing point source file used as a template
+oldpath = f'../../camx/ptsrce/point.camx.ptnonipm.{date}.nc'
+# table of candidates: set to your own CSV, or None to write an example to
+# exampletablepath (rewritten every run)
+tablepath = None
+exampletablepath = 'outputs/candidate_sources.csv'
+# table of named time profiles, one column per name and one row per hour of
+# day (24) or per TSTEP: set to your own CSV, or None to write an example to
+# exampleproftablepath (rewritten every run)
+proftablepath = None
+exampleproftablepath = 'outputs/candidate_profiles.csv'
+# new point source file for all candidates
+newpath = f'outputs/point.camx.candidates.{date}.nc'
+
+# %%
+# Imports
+# '''''''
+
+import os
+import numpy as np
+import pandas as pd
+import netCDF4
+import pyproj
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Candidate Table
+# '''''''''''''''
+# - required: name, lon, lat
+# - optional stack parameters: stkheight, stkdiam, stktemp, stkspeed
+#   (missing values use the template stack)
+# - scale multiplies all species; scale_<species> multiplies one species
+# - profile is 'mean' (template time profile for each species), 'flat', or a
+#   column name in the profile table; each profile is normalized to a mean
+#   of 1, so scale sets the daily mean
+
+if proftablepath is None:
+    proftablepath = exampleproftablepath
+    hour = np.arange(24)
+    exprofdf = pd.DataFrame(dict(
+        daytime=np.where((hour >= 7) & (hour < 19), 1., 0.2),
+        peaking=np.where((hour >= 14) & (hour < 20), 1., 0.),
+    ), index=pd.Index(hour, name='hour'))
+    exprofdf.to_csv(proftablepath)
+
+if tablepath is None:
+    tablepath = exampletablepath
+    # 10 x 10 candidates around Raleigh, NC
+    lon, lat = np.meshgrid(np.linspace(-79.5, -77.8, 10), np.linspace(35.2, 36.4, 10))
+    exdf = pd.DataFrame(dict(
+        name=[f'cand{i:03d}' for i in range(lon.size)],
+        lon=lon.ravel(), lat=lat.ravel(),
+        stkheight=np.where(np.arange(lon.size) % 2 == 0, 50., 150.),
+        scale=1., scale_NO=0.5, profile='mean',
+    ))
+    exdf.loc[exdf.index % 3 == 0, 'profile'] = 'flat'
+    exdf.loc[exdf.index % 3 == 1, 'profile'] = 'daytime'
+    exdf.loc[exdf.index % 10 == 9, 'profile'] = 'peaking'
+    exdf.to_csv(tablepath, index=False)
+
+canddf = pd.read_csv(tablepath)
+nstk = canddf.shape[0]
+print(f'INFO:: {nstk} candidate sources')
+
+# %%
+# Template Source
+# '''''''''''''''
+# - daily mean of the stack with the largest daily mean NO
+# - mean time profile across all stacks (one TSTEP at a time); a species
+#   that is always zero gets a flat profile
+
+oldf = netCDF4.Dataset(oldpath)
+nt = len(oldf.dimensions['TSTEP'])
+emiskeys = [
+    k for k, v in oldf.variables.items()
+    if getattr(v, 'units', '').strip() in ('mol hr-1', 'g hr-1')
+]
+idx = oldf['NO'][:].mean(0).argmax()
+tmplmean = {}
+tmplprof = {}
+for key in emiskeys:
+    var = oldf[key]
+    tmplmean[key] = var[:, idx].mean()
+    hourly = np.array([var[ti].mean() for ti in range(nt)])
+    tmplprof[key] = np.divide(hourly, hourly.mean(), out=np.ones(nt), where=hourly.mean() > 0)
+
+# %%
+# Named Profiles
+# ''''''''''''''
+# - 24 rows are matched to the hour of each TSTEP; otherwise there must be
+#   one row per TSTEP
+
+profdf = pd.read_csv(proftablepath, index_col=0)
+if profdf.shape[0] == 24:
+    profdf = profdf.iloc[oldf['TFLAG'][:, 0, 1] // 10000]
+elif profdf.shape[0] != nt:
+    raise ValueError(f'{proftablepath} must have 24 or {nt} rows; got {profdf.shape[0]}')
+namedprof = {}
+for name, vals in profdf.items():
+    vals = vals.to_numpy(dtype='d')
+    namedprof[name] = np.divide(vals, vals.mean(), out=np.ones(nt), where=vals.mean() > 0)
+namedprof['flat'] = np.ones(nt)
+
+# %%
+# Calculate All Candidates at Once
+# ''''''''''''''''''''''''''''''''
+# - one projection call for all locations
+# - emissions are (TSTEP, COL) arrays built by broadcasting
+
+attrs = {k: oldf.getncattr(k) for k in oldf.ncattrs()}
+proj4tmpl = '+proj=lcc +lat_0={YCENT} +lon_0={P_GAM}'
+proj4tmpl += ' +lat_1={P_ALP} +lat_2={P_BET} +R=6370000 +units=m +no_defs'
+proj = pyproj.Proj(proj4tmpl.format(**attrs))
+x, y = proj(canddf['lon'].to_numpy(), canddf['lat'].to_numpy())
+
+stackvals = {'xcoord': x, 'ycoord': y}
+for key, var in oldf.variables.items():
+    if var.dimensions == ('COL',) and key not in stackvals:
+        tmplval = var[idx]
+        if key in canddf.columns:
+            stackvals[key] = canddf[key].fillna(tmplval).to_numpy()
+        else:
+            stackvals[key] = np.full(nstk, tmplval)
+
+scale = canddf['scale'].to_numpy() if 'scale' in canddf.columns else np.ones(nstk)
+profnames = canddf['profile'].fillna('mean') if 'profile' in canddf.columns else pd.Series('mean', index=canddf.index)
+unknown = set(profnames) - set(namedprof) - {'mean'}
+if len(unknown) > 0:
+    raise KeyError(f'profiles not in {proftablepath}: {sorted(unknown)}')
+# (TSTEP, COL) for named profiles; mean columns are filled per species
+namedvals = np.stack([namedprof.get(name, np.ones(nt)) for name in profnames], axis=1)
+ismean = (profnames == 'mean').to_numpy()
+emisvals = {}
+for key in emiskeys:
+    kscale = scale.copy()
+    if f'scale_{key}' in canddf.columns:
+        kscale *= canddf[f'scale_{key}'].fillna(1).to_numpy()
+    prof = np.where(ismean[None, :], tmplprof[key][:, None], namedvals)  # (TSTEP, COL)
+    emisvals[key] = (tmplmean[key] * kscale[None, :] * prof).astype(oldf[key].dtype)
+
+# %%
+# Write One File
+# ''''''''''''''
+# - dimensions and attributes follow the template, except COL and NCOLS
+
+with netCDF4.Dataset(newpath, mode='w', format='NETCDF4_CLASSIC') as newf:
+    newf.setncatts(attrs)
+    newf.NCOLS = np.int32(nstk)
+    for dk, dim in oldf.dimensions.items():
+        dlen = nstk if dk == 'COL' else len(dim)
+        newf.createDimension(dk, None if dim.isunlimited() else dlen)
+    for key, var in oldf.variables.items():
+        vattrs = {pk: var.getncattr(pk) for pk in var.ncattrs()}
+        fill_value = vattrs.pop('_FillValue', None)
+        newvar = newf.createVariable(key, var.dtype, var.dimensions, fill_value=fill_value)
+        newvar.setncatts(vattrs)
+        if key in emisvals:
+            newvar[:] = emisvals[key]
+        elif key in stackvals:
+            newvar[:] = stackvals[key]
+        elif 'COL' not in var.dimensions:
+            newvar[:] = var[:]  # e.g., TFLAG and ETFLAG
+        else:
+            # any other COL variable uses the template stack
+            newvar[:] = np.take(var[:], [idx] * nstk, axis=var.dimensions.index('COL'))
+
+oldf.close()
+print(f'INFO:: wrote {nstk} stacks to {newpath}')
+
+# %%
+# Visualize Candidates
+# ''''''''''''''''''''
+
+import matplotlib.pyplot as plt
+
+with netCDF4.Dataset(newpath) as newf:
+    nox = newf['NO'][:].mean(0) + newf['NO2'][:].mean(0)
+    fig, ax = plt.subplots()
+    sc = ax.scatter(newf['xcoord'][:], newf['ycoord'][:], c=nox, s=newf['stkheight'][:] / 5)
+    fig.colorbar(sc, label='NO + NO2 [mol/h]')
+    ax.set(title=f'{nstk} candidate sources (size = stack height)')
+    fig.savefig('outputs/example_ptsrce_candidates.png')
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Edit the table to give each candidate its own stack temperature.
+#    Add a profile column for a weekday shift schedule and use it.
+# 2. Add the new file as a Point_Sources entry in the CAMx job script.
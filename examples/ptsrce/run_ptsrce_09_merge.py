@@ -0,0 +1,273 @@
+"""
+Merge and Append Point Source Files
+===================================
+
+Combine several sector point files into one, and add stacks to an existing
+file without rewriting it.
+
+The rerun example (`ex_camxrerun.py`) adds a source by listing another
+`Point_Sources(n)` file. Each sector (othpt, ptnonipm, pt_oilgas, ...) is also
+its own file. This example merges point files into one file, streaming one
+TSTEP at a time, and combines identical stacks (same values for every stack
+parameter) into one column. If the merged file is written with an unlimited
+COL dimension (NETCDF4 format), more stacks can later be appended in place,
+so CAMx opens fewer files and no full rewrite is needed.
+
+The basic steps are:
+
+1. Merge sector files into one file (deduplicating identical stacks).
+2. Append new stacks to the merged file in place.
+3. Check that totals are conserved.
+
+*Reminder*: You must have already activated your python environment.
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# what date are you processing?
+date = '20160610'
+# sector files to merge
+inpaths = [
+    f'../../camx/ptsrce/point.camx.othpt.{date}.nc',
+    f'../../camx/ptsrce/point.camx.ptnonipm.{date}.nc',
+    f'../../camx/ptsrce/point.camx.pt_oilgas.{date}.nc',
+]
+# merged file
+mergedpath = f'outputs/point.camx.merged.{date}.nc'
+# files to append in place (e.g., from run_ptsrce_01_singlesource.py)
+appendpaths = [
+    f'outputs/point.camx.just1.{date}.nc',
+]
+# True: NETCDF4 with unlimited COL (can append in place)
+# False: NETCDF4_CLASSIC with fixed COL (append requires a new merge)
+colunlimited = True
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import time
+import os
+import numpy as np
+import netCDF4
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Define Stack Identity
+# '''''''''''''''''''''
+# - a stack is identified by all of its (COL,) variables (xcoord, ycoord,
+#   stkheight, stkdiam, stktemp, stkspeed, ...)
+# - identical stacks get the same output column and their emissions are added
+# - unique stacks keep the order in which they first appear
+
+
+def stackkeys(ptf):
+    return [k for k, v in ptf.variables.items() if v.dimensions == ('COL',)]
+
+
+def emiskeys(ptf):
+    return [
+        k for k, v in ptf.variables.items()
+        if v.dimensions == ('TSTEP', 'COL') and k not in ('TFLAG', 'ETFLAG')
+    ]
+
+
+def stacktable(ptf, keys):
+    """(COL, nkeys) array of stack parameters"""
+    return np.column_stack([np.asarray(ptf[k][:], dtype='d') for k in keys])
+
+
+def uniquestacks(table):
+    """unique rows in order of first appearance, and the unique row of each row"""
+    _, first, inv = np.unique(table, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    return table[first[order]], rank[inv.ravel()]
+
+
+# %%
+# Merge Files
+# '''''''''''
+# - species are the union of all files (zero where a file lacks a species)
+# - values are read and written one TSTEP at a time
+
+
+def merge_point_files(paths, outpath, colunlimited=False):
+    """
+    Arguments
+    ---------
+    paths : list
+        CAMx point source files with the same times.
+    outpath : str
+        Merged file to create.
+    colunlimited : bool
+        If True, write NETCDF4 with an unlimited COL dimension.
+
+    Returns
+    -------
+    nstk : int
+        Number of unique stacks
+    """
+    if len(paths) == 0:
+        raise ValueError('no point source files to merge (check that the inputs exist)')
+    infiles = [netCDF4.Dataset(p) for p in paths]
+    tmpl = infiles[0]
+    skeys = stackkeys(tmpl)
+    ekeys = []
+    for f in infiles:
+        ekeys.extend(k for k in emiskeys(f) if k not in ekeys)
+    tables = [stacktable(f, skeys) for f in infiles]
+    uniq, inv = uniquestacks(np.concatenate(tables))
+    bounds = np.cumsum([0] + [t.shape[0] for t in tables])
+    fileinv = [inv[s:e] for s, e in zip(bounds[:-1], bounds[1:])]
+    nstk = uniq.shape[0]
+    print(f'INFO:: {bounds[-1]} stacks -> {nstk} unique stacks')
+
+    fmt = 'NETCDF4' if colunlimited else 'NETCDF4_CLASSIC'
+    with netCDF4.Dataset(outpath, mode='w', format=fmt) as outf:
+        outf.setncatts({k: tmpl.getncattr(k) for k in tmpl.ncattrs()})
+        outf.NCOLS = np.int32(nstk)
+        outf.NVARS = np.int32(len(ekeys))
+        setattr(outf, 'VAR-LIST', ''.join(k.ljust(16) for k in ekeys))
+        outf.FILEDESC = 'Merged ' + ' '.join(os.path.basename(p) for p in paths)
+        for dk, dim in tmpl.dimensions.items():
+            dlen = {'COL': nstk, 'VAR': len(ekeys)}.get(dk, len(dim))
+            isunlim = dim.isunlimited() or (dk == 'COL' and colunlimited)
+            outf.createDimension(dk, None if isunlim else dlen)
+        for key in ['TFLAG', 'ETFLAG']:
+            if key in tmpl.variables:
+                var = tmpl[key]
+                ovar = outf.createVariable(key, var.dtype, var.dimensions)
+                ovar.setncatts({pk: var.getncattr(pk) for pk in var.ncattrs()})
+                ovar[:] = np.repeat(var[:, :1], len(ekeys), axis=1)
+        for si, key in enumerate(skeys):
+            var = tmpl[key]
+            ovar = outf.createVariable(key, var.dtype, ('COL',))
+            ovar.setncatts({pk: var.getncattr(pk) for pk in var.ncattrs()})
+            ovar[:] = uniq[:, si]
+        nt = len(tmpl.dimensions['TSTEP'])
+        for key in ekeys:
+            var = next(f[key] for f in infiles if key in f.variables)
+            ovar = outf.createVariable(key, var.dtype, ('TSTEP', 'COL'))
+            ovar.setncatts({pk: var.getncattr(pk) for pk in var.ncattrs()})
+            for ti in range(nt):
+                vals = np.zeros(nstk, dtype='d')
+                for f, finv in zip(infiles, fileinv):
+                    if key in f.variables:
+                        vals += np.bincount(finv, weights=f[key][ti], minlength=nstk)
+                ovar[ti] = vals
+
+    for f in infiles:
+        f.close()
+    return nstk
+
+
+# %%
+# Append in Place
+# '''''''''''''''
+# - only possible when COL is unlimited
+# - stacks that already exist are added to their existing column
+# - new stacks are written after the last column
+
+
+def append_point_file(basepath, newpath):
+    """
+    Arguments
+    ---------
+    basepath : str
+        Point file with an unlimited COL (e.g., from merge_point_files with
+        colunlimited=True). Modified in place.
+    newpath : str
+        Point file with stacks to add; its species must be in basepath.
+
+    Returns
+    -------
+    nadded : int
+        Number of new columns
+    """
+    with netCDF4.Dataset(basepath, mode='a') as basef, netCDF4.Dataset(newpath) as newf:
+        if not basef.dimensions['COL'].isunlimited():
+            raise ValueError(
+                f'{basepath} COL is fixed; use merge_point_files with colunlimited=True'
+            )
+        skeys = stackkeys(basef)
+        ncol = len(basef.dimensions['COL'])
+        basetab = stacktable(basef, skeys)
+        newtab = stacktable(newf, skeys)
+        # find new stacks that match existing stacks
+        lookup = {tuple(row): ci for ci, row in enumerate(basetab)}
+        match = np.array([lookup.get(tuple(row), -1) for row in newtab])
+        isnew = match < 0
+        uniqnew, newinv = uniquestacks(newtab[isnew])
+        nadded = uniqnew.shape[0]
+        outcol = match.copy()
+        outcol[isnew] = ncol + newinv
+        for si, key in enumerate(skeys):
+            basef[key][ncol:ncol + nadded] = uniqnew[:, si]
+        nt = len(basef.dimensions['TSTEP'])
+        matched = np.unique(match[~isnew])
+        for key in emiskeys(newf):
+            var = basef[key]
+            for ti in range(nt):
+                vals = np.bincount(outcol, weights=newf[key][ti], minlength=ncol + nadded)
+                if nadded > 0:
+                    var[ti, ncol:ncol + nadded] = vals[ncol:]
+                if matched.size > 0:
+                    var[ti, matched] = var[ti, matched] + vals[matched]
+        # species missing from newf must be zero (not fill) for new columns
+        for key in emiskeys(basef):
+            if key not in newf.variables and nadded > 0:
+                basef[key][:, ncol:ncol + nadded] = 0.
+        basef.NCOLS = np.int32(ncol + nadded)
+    return nadded
+
+
+# %%
+# Merge and Append
+# ''''''''''''''''
+
+inpaths = [p for p in inpaths if os.path.exists(p)]
+t0 = time.perf_counter()
+nstk = merge_point_files(inpaths, mergedpath, colunlimited=colunlimited)
+t1 = time.perf_counter()
+print(f'INFO:: merged {len(inpaths)} files in {t1 - t0:.2f}s')
+
+if colunlimited:
+    for appendpath in appendpaths:
+        if not os.path.exists(appendpath):
+            print('WARN:: missing (run the earlier example first)', appendpath)
+            continue
+        t0 = time.perf_counter()
+        nadded = append_point_file(mergedpath, appendpath)
+        t1 = time.perf_counter()
+        print(f'INFO:: appended {nadded} stacks from {appendpath} in {t1 - t0:.2f}s')
+        inpaths.append(appendpath)
+
+# %%
+# Check Totals
+# ''''''''''''
+# - the merged total of each species equals the sum of the inputs
+
+with netCDF4.Dataset(mergedpath) as mf:
+    print(f'INFO:: {mergedpath} has {len(mf.dimensions["COL"])} stacks')
+    for key in ['NO', 'NO2', 'FPRM']:
+        if key not in mf.variables:
+            continue
+        intot = 0.
+        for p in inpaths:
+            with netCDF4.Dataset(p) as f:
+                if key in f.variables:
+                    intot += f[key][:].sum(dtype='d')
+        outtot = mf[key][:].sum(dtype='d')
+        print(f'INFO:: {key} inputs={intot:.6e} merged={outtot:.6e}')
+        assert np.isclose(intot, outtot, rtol=1e-5)
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Replace the three Point_Sources entries in the CAMx job with the merged file.
+# 2. Append the candidates from `run_ptsrce_08_bulkinject.py`.
@@ -0,0 +1,258 @@
+"""
+Filter Stacks with a Parquet Table
+==================================
+
+Save one table of stack attributes per point file, and select stacks with
+filters that skip most of the table without opening the netCDF file.
+
+The select-a-source example (`run_ptsrce_02_editlonlatbox.py`) reads xcoord,
+ycoord, and each species from the netCDF file every time a selection is made.
+This example writes a Parquet table (one row per stack) with COL, xcoord,
+ycoord, lon, lat, stack parameters, and daily totals for every species. The
+table is sorted by ycoord, so the min/max statistics of each row group let
+filters (e.g., a bounding box and a NOx threshold) skip row groups that cannot
+match. The COL indices that match are then used to edit the netCDF file.
+
+The basic steps are:
+
+1. Export a stack table (skipped if the table is newer than the file).
+2. Query: all stacks with average NOx above 100 mol/h within 50 km.
+3. Scale the selected COL indices in a copy of the netCDF file.
+
+*Reminder*: You must have already activated your python environment.
+*Reminder*: This example requires pyarrow (see requirements.txt).
+"""
+
+# %%
+# Configuration
+# '''''''''''''
+
+# what date are you processing?
+date = '20160610'
+# existing point source file
+ptpath = f'../../camx/ptsrce/point.camx.ptnonipm.{date}.nc'
+# stack table
+tablepath = f'outputs/point.camx.ptnonipm.{date}_stacks.parquet'
+# new file to create
+newpath = f'outputs/point.camx.ptnonipm_parquetedit.{date}.nc'
+# rows per row group; smaller groups let filters skip more, but add overhead
+rowgroupsize = 10000
+
+# Query
+center = (-82.5436, 36.5224)
+radius = 50000  # m
+minnox = 100  # mol/h average NO + NO2
+
+# factor to apply to selected stacks
+scalekeys = ['NO', 'NO2', 'HONO']
+factor = 0.8
+
+# %%
+# Imports and Folders
+# '''''''''''''''''''
+
+import shutil
+import time
+import os
+import numpy as np
+import netCDF4
+import pyproj
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+os.makedirs('outputs', exist_ok=True)
+
+# %%
+# Export the Stack Table
+# ''''''''''''''''''''''
+# - all (COL,) variables are copied (xcoord, ycoord, stkheight, ...)
+# - daily totals are TSTEP sums, read one TSTEP at a time
+# - NOX is NO + NO2 when both are present
+# - file metadata keeps the projection and the source file mtime
+
+
+def getproj(attrs):
+    proj4tmpl = '+proj=lcc +lat_0={YCENT} +lon_0={P_GAM}'
+    proj4tmpl += ' +lat_1={P_ALP} +lat_2={P_BET} +R=6370000 +units=m +no_defs'
+    return pyproj.Proj(proj4tmpl.format(**attrs))
+
+
+def export_stack_table(ptpath, tablepath, rowgroupsize=rowgroupsize):
+    """
+    Arguments
+    ---------
+    ptpath : str
+        CAMx point source file.
+    tablepath : str
+        Parquet file to create.
+    rowgroupsize : int
+        Rows per row group.
+
+    Returns
+    -------
+    None
+    """
+    with netCDF4.Dataset(ptpath) as ptf:
+        attrs = {k: ptf.getncattr(k) for k in ptf.ncattrs()}
+        nt = len(ptf.dimensions['TSTEP'])
+        ns = len(ptf.dimensions['COL'])
+        cols = {'COL': np.arange(ns, dtype='i4')}
+        for key, var in ptf.variables.items():
+            if var.dimensions == ('COL',):
+                cols[key] = np.asarray(var[:])
+        lon, lat = getproj(attrs)(cols['xcoord'], cols['ycoord'], inverse=True)
+        cols['lon'] = lon
+        cols['lat'] = lat
+        emiskeys = [
+            k for k, v in ptf.variables.items()
+            if getattr(v, 'units', '').strip() in ('mol hr-1', 'g hr-1')
+        ]
+        for key in emiskeys:
+            var = ptf[key]
+            total = np.zeros(ns, dtype='d')
+            for ti in range(nt):
+                total += var[ti]
+            cols[key] = total
+        if 'NO' in cols and 'NO2' in cols:
+            cols['NOX'] = cols['NO'] + cols['NO2']
+
+    table = pa.table(cols)
+    table = table.take(np.argsort(cols['ycoord'], kind='stable'))
+    meta = {
+        'source': os.path.basename(ptpath),
+        'source_mtime': repr(os.stat(ptpath).st_mtime),
+        'ntstep': str(nt),
+    }
+    for k in ['P_ALP', 'P_BET', 'P_GAM', 'XCENT', 'YCENT']:
+        meta[k] = repr(float(attrs[k]))
+    table = table.replace_schema_metadata(meta)
+    tmppath = tablepath + '.tmp'
+    pq.write_table(table, tmppath, row_group_size=rowgroupsize)
+    os.replace(tmppath, tablepath)
+
+
+t0 = time.perf_counter()
+if (
+    not os.path.exists(tablepath)
+    or os.stat(tablepath).st_mtime < os.stat(ptpath).st_mtime
+):
+    export_stack_table(ptpath, tablepath)
+t1 = time.perf_counter()
+pqf = pq.ParquetFile(tablepath)
+print(f'INFO:: {tablepath} {pqf.metadata.num_rows} stacks in {pqf.metadata.num_row_groups} row groups ({t1 - t0:.2f}s)')
+
+# %%
+# Query the Table
+# '''''''''''''''
+# - filters are pushed down: a row group is skipped when its statistics show
+#   that no row can match the bounding box or the threshold
+# - the bounding box is then trimmed to the exact distance
+
+
+def query_stacks(tablepath, cx, cy, radius, filters=None, columns=None):
+    """
+    Arguments
+    ---------
+    tablepath : str
+        Parquet stack table.
+    cx, cy : float
+        Center in projected coordinates (m).
+    radius : float
+        Distance (m).
+    filters : list
+        Additional pyarrow filters (e.g., [('NOX', '>', 2400.)]).
+    columns : list
+        Columns to read (COL, xcoord, and ycoord are always read).
+
+    Returns
+    -------
+    stackdf : pandas.DataFrame
+        Stacks within radius that pass filters, sorted by COL
+    """
+    bbox = [
+        ('xcoord', '>=', cx - radius), ('xcoord', '<=', cx + radius),
+        ('ycoord', '>=', cy - radius), ('ycoord', '<=', cy + radius),
+    ]
+    if columns is not None:
+        columns = ['COL', 'xcoord', 'ycoord'] + [c for c in columns if c not in ('COL', 'xcoord', 'ycoord')]
+    table = pq.read_table(tablepath, columns=columns, filters=bbox + list(filters or []))
+    stackdf = table.to_pandas()
+    dist = np.hypot(stackdf['xcoord'] - cx, stackdf['ycoord'] - cy)
+    stackdf = stackdf.loc[dist <= radius].assign(dist=dist)
+    return stackdf.sort_values('COL')
+
+
+schema = pq.read_schema(tablepath)
+meta = {k.decode(): v.decode() for k, v in schema.metadata.items()}
+ntstep = int(meta['ntstep'])
+cx, cy = getproj(meta)(*center)
+# daily total threshold for an average rate of minnox
+filters = [('NOX', '>', minnox * ntstep)]
+t0 = time.perf_counter()
+seldf = query_stacks(tablepath, cx, cy, radius, filters=filters, columns=['NOX', 'lon', 'lat'])
+t1 = time.perf_counter()
+print(f'INFO:: parquet query {(t1 - t0) * 1e3:.1f}ms {seldf.shape[0]} stacks')
+print(seldf.head(10).to_string())
+
+# %%
+# Compare to netCDF Selection
+# '''''''''''''''''''''''''''
+# - the approach in `run_ptsrce_02_editlonlatbox.py`
+
+t0 = time.perf_counter()
+with netCDF4.Dataset(ptpath) as ptf:
+    x = ptf['xcoord'][:]
+    y = ptf['ycoord'][:]
+    nox = ptf['NO'][:].sum(0) + ptf['NO2'][:].sum(0)
+ismine = (np.hypot(x - cx, y - cy) <= radius) & (nox > minnox * ntstep)
+t1 = time.perf_counter()
+print(f'INFO:: netCDF query {(t1 - t0) * 1e3:.1f}ms {ismine.sum()} stacks')
+assert np.array_equal(np.flatnonzero(ismine), seldf['COL'].to_numpy())
+
+# %%
+# Edit Selected Stacks
+# ''''''''''''''''''''
+# - COL indices from the table are grouped into contiguous runs
+# - colruns is the same as `run_ptsrce_05_sparseedit.py` (keep the copies
+#   identical)
+
+
+def colruns(cols, maxgap=0):
+    """
+    Arguments
+    ---------
+    cols : array-like
+        COL indices to edit.
+    maxgap : int
+        Largest number of unselected columns allowed inside a run.
+
+    Returns
+    -------
+    runs : list
+        (start, stop) pairs for slices that include all cols
+    """
+    cols = np.unique(cols)
+    if cols.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(cols) > maxgap + 1) + 1
+    starts = cols[np.r_[0, breaks]]
+    stops = cols[np.r_[breaks - 1, cols.size - 1]] + 1
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+shutil.copyfile(ptpath, newpath)
+cols = seldf['COL'].to_numpy()
+runs = colruns(cols)
+with netCDF4.Dataset(newpath, mode='a') as newf:
+    for skey in scalekeys:
+        var = newf[skey]
+        vfactor = np.asarray(factor, dtype=var.dtype)
+        for start, stop in runs:
+            var[:, start:stop] = var[:, start:stop] * vfactor
+print(f'INFO:: scaled {cols.size} stacks in {len(runs)} runs in {newpath}')
+
+# %%
+# Extra Credit
+# ''''''''''''
+# 1. Write one table per sector and query them together with pyarrow.dataset.
+# 2. Add a county column (e.g., from a shapefile) and filter on it.